@@ -0,0 +1,213 @@
+# choocha\cache.py
+import logging
+import threading
+import time
+from typing import Any, Iterable
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from redis import RedisError
+
+from .instrumentation import record_count, timed
+from .metrics import observe_cache
+
+try:
+    from django_redis.exceptions import ConnectionInterrupted
+except ImportError:  # django-redis необязателен: встроенный RedisCache бросает исключения redis
+    L2_ERRORS: tuple[type[Exception], ...] = (RedisError,)
+else:
+    L2_ERRORS = (RedisError, ConnectionInterrupted)
+
+logger = logging.getLogger(__name__)
+
+# Значение по умолчанию: запись живёт в памяти процесса недолго, потому что сброс ключа
+# в другом процессе до неё не доходит
+L1_TIMEOUT = 5
+L1_MAX_ENTRIES = 1000
+# Сколько ошибок подряд размыкают выключатель и на сколько секунд
+FAILURE_THRESHOLD = 3
+COOLDOWN = 30
+
+_MISSING = object()
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель L2: после FAILURE_THRESHOLD ошибок подряд обращения к Redis
+    прекращаются на COOLDOWN секунд. Затем один пробный запрос решает, замкнуть ли его снова.
+    Общий для всех потоков процесса.
+    """
+
+    def __init__(self, name: str, threshold: int, cooldown: float) -> None:
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._failures >= self.threshold
+
+    def allow(self) -> bool:
+        with self._lock:
+            if not self.is_open:
+                return True
+            now = time.monotonic()
+            if now < self._open_until:
+                return False
+            # Пробный запрос: остальные потоки ждут его результата ещё один период
+            self._open_until = now + self.cooldown
+            return True
+
+    def success(self) -> None:
+        if not self._failures:
+            return
+        with self._lock:
+            if self.is_open:
+                logger.warning("Кеш %s снова доступен", self.name)
+            self._failures = 0
+
+    def failure(self, error: Exception) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.is_open:
+                self._open_until = time.monotonic() + self.cooldown
+                logger.warning(
+                    "Кеш %s недоступен, следующие %s с используется только память процесса: %s",
+                    self.name, self.cooldown, error,
+                )
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def _get_breaker(alias: str, threshold: int, cooldown: float) -> CircuitBreaker:
+    with _breakers_lock:
+        if alias not in _breakers:
+            _breakers[alias] = CircuitBreaker(alias, threshold, cooldown)
+        return _breakers[alias]
+
+
+class TieredCache(BaseCache):
+    """
+    Двухуровневый кеш: ограниченный LRU в памяти процесса (L1) перед общим кешем (L2, обычно Redis).
+
+    LOCATION - псевдоним L2 в CACHES. Чтение сначала обращается к L1, запись и удаление идут в оба уровня.
+    L1 хранит записи не дольше L1_TIMEOUT, так что сброс ключа в другом процессе виден с этой задержкой.
+    Атомарные операции (add, incr) выполняются в L2, чтобы блокировки и счётчики оставались общими.
+    Ошибки L2 не выходят наружу: кеш продолжает работать на L1, а выключатель после серии ошибок
+    перестаёт обращаться к L2, чтобы запросы не ждали таймаута соединения.
+    """
+
+    def __init__(self, location: str, params: dict[str, Any]) -> None:
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.l2_alias = location
+        self.l1_timeout = options.get("L1_TIMEOUT", L1_TIMEOUT)
+        self.l1 = LocMemCache(f"tiered-{location}", {
+            "TIMEOUT": self.l1_timeout,
+            "OPTIONS": {"MAX_ENTRIES": options.get("L1_MAX_ENTRIES", L1_MAX_ENTRIES)},
+        })
+        self.breaker = _get_breaker(
+            location, options.get("FAILURE_THRESHOLD", FAILURE_THRESHOLD), options.get("COOLDOWN", COOLDOWN),
+        )
+
+    @property
+    def l2(self) -> BaseCache:
+        return caches[self.l2_alias]
+
+    def _l2(self, method: str, *args, **kwargs) -> tuple[bool, Any]:
+        """Вызывает метод L2; возвращает (успех, результат)"""
+        if not self.breaker.allow():
+            return False, None
+        try:
+            with timed("cache"):
+                result = getattr(self.l2, method)(*args, **kwargs)
+        except L2_ERRORS as e:
+            self.breaker.failure(e)
+            return False, None
+        self.breaker.success()
+        return True, result
+
+    @staticmethod
+    def _observe(key: str, hit: bool) -> None:
+        record_count("cache_hit" if hit else "cache_miss")
+        observe_cache(key, hit)
+
+    def _l1_timeout(self, timeout: float | None) -> float:
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def get(self, key: str, default: Any = None, version: int | None = None) -> Any:
+        value = self.l1.get(key, _MISSING, version)
+        if value is not _MISSING:
+            self._observe(key, True)
+            return value
+        ok, value = self._l2("get", key, _MISSING, version)
+        if not ok or value is _MISSING:
+            self._observe(key, False)
+            return default
+        self._observe(key, True)
+        self.l1.set(key, value, self.l1_timeout, version)
+        return value
+
+    def set(self, key: str, value: Any, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> None:
+        self._l2("set", key, value, timeout, version)
+        self.l1.set(key, value, self._l1_timeout(timeout), version)
+
+    def add(self, key: str, value: Any, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> bool:
+        ok, added = self._l2("add", key, value, timeout, version)
+        if not ok:
+            # Без L2 блокировка действует только внутри процесса - лучше, чем никакой
+            return self.l1.add(key, value, self._l1_timeout(timeout), version)
+        if added:
+            self.l1.set(key, value, self._l1_timeout(timeout), version)
+        return added
+
+    def touch(self, key: str, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> bool:
+        ok, touched = self._l2("touch", key, timeout, version)
+        return self.l1.touch(key, self._l1_timeout(timeout), version) or (ok and touched)
+
+    def delete(self, key: str, version: int | None = None) -> bool:
+        deleted = self.l1.delete(key, version)
+        ok, deleted_l2 = self._l2("delete", key, version)
+        return deleted or (ok and deleted_l2)
+
+    def incr(self, key: str, delta: int = 1, version: int | None = None) -> int:
+        self.l1.delete(key, version)
+        ok, value = self._l2("incr", key, delta, version)
+        if not ok:
+            return self.l1.incr(key, delta, version)
+        return value
+
+    def get_many(self, keys: Iterable[str], version: int | None = None) -> dict[str, Any]:
+        keys = list(keys)
+        found = self.l1.get_many(keys, version)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            ok, fetched = self._l2("get_many", missing, version)
+            if ok and fetched:
+                self.l1.set_many(fetched, self.l1_timeout, version)
+                found.update(fetched)
+        for key in keys:
+            self._observe(key, key in found)
+        return found
+
+    def set_many(self, data: dict[str, Any], timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> list:
+        self._l2("set_many", data, timeout, version)
+        self.l1.set_many(data, self._l1_timeout(timeout), version)
+        return []
+
+    def delete_many(self, keys: Iterable[str], version: int | None = None) -> None:
+        keys = list(keys)
+        self.l1.delete_many(keys, version)
+        self._l2("delete_many", keys, version)
+
+    def clear(self) -> None:
+        self.l1.clear()
+        self._l2("clear")
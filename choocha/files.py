@@ -0,0 +1,190 @@
+# choocha\files.py
+"""
+Отдача статики и медиафайлов в продакшене.
+
+Если перед приложением стоит прокси (nginx, Apache), сама отдача файла перекладывается на него
+через X-Accel-Redirect / X-Sendfile, а приложение только проверяет путь и выставляет заголовки.
+Без прокси файл отдаётся потоком с поддержкой условных запросов, Range и заранее сжатых вариантов.
+"""
+import mimetypes
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+# Имя вида styles.1a2b3c4d5e6f.css, которое выдаёт ManifestStaticFilesStorage
+HASHED_NAME_RE = re.compile(r"\.[0-9a-f]{12}\.[^./]+$")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Заранее сжатые варианты в порядке предпочтения: (кодировка, суффикс файла)
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+
+def _resolve(document_root: Path, path: str) -> Path:
+    try:
+        full_path = Path(safe_join(document_root, path))
+    except SuspiciousFileOperation:
+        raise Http404("Файл не найден")
+    if not full_path.is_file():
+        raise Http404("Файл не найден")
+    return full_path
+
+
+def _encoding_weights(header: str) -> dict[str, float]:
+    """Кодировки из Accept-Encoding с их q ("br;q=0" - явный отказ от br)"""
+    weights = {}
+    for item in header.split(","):
+        name, *params = item.split(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+    return weights
+
+
+def _accepted_variant(request, full_path: Path) -> tuple[Path, str | None]:
+    """Выбирает сжатый вариант файла, если клиент его принимает и он был создан при collectstatic"""
+    weights = _encoding_weights(request.headers.get("Accept-Encoding", ""))
+    for encoding, suffix in PRECOMPRESSED:
+        # Кодировка без собственного q подпадает под "*"
+        if weights.get(encoding, weights.get("*", 0.0)) > 0:
+            variant = full_path.with_name(full_path.name + suffix)
+            if variant.is_file():
+                return variant, encoding
+    return full_path, None
+
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Разбирает одиночный диапазон байт. Возвращает (start, stop) с исключительной правой границей.
+    Несколько диапазонов не поддерживаются - в этом случае отдаётся весь файл.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # "bytes=-0" - пустой суффикс: диапазон невыполним
+        if not int(last):
+            raise ValueError(header)
+        return max(0, size - int(last)), size
+    start = int(first)
+    stop = min(int(last) + 1, size) if last else size
+    if start >= stop:
+        raise ValueError(header)
+    return start, stop
+
+
+def _read_range(path: Path, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _sendfile_response(full_path: Path, document_root: Path, url_prefix: str) -> HttpResponse | None:
+    """Ответ, который поручает отдачу файла прокси-серверу (settings.SENDFILE_BACKEND)"""
+    backend = settings.SENDFILE_BACKEND
+    if not backend:
+        return None
+    response = HttpResponse()
+    if backend == "nginx":
+        relative = full_path.relative_to(document_root).as_posix()
+        prefix = settings.SENDFILE_URL_PREFIX.rstrip("/")
+        response["X-Accel-Redirect"] = f"{prefix}/{url_prefix.strip('/')}/{relative}"
+    elif backend == "apache":
+        response["X-Sendfile"] = str(full_path)
+    else:
+        raise ValueError(f"Неизвестный SENDFILE_BACKEND: {backend!r}")
+    return response
+
+
+def serve_file(request, path: str, document_root: Path, url_prefix: str, cache_control: str,
+               precompressed: bool = False) -> HttpResponse:
+    full_path = _resolve(Path(document_root), path)
+    served_path, encoding = _accepted_variant(request, full_path) if precompressed else (full_path, None)
+    stat = served_path.stat()
+
+    etag = quote_etag(f"{int(stat.st_mtime):x}-{stat.st_size:x}{'-' + encoding if encoding else ''}")
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _sendfile_response(served_path, Path(document_root), url_prefix)
+        if response is None:
+            response = _file_response(request, served_path, stat.st_size, etag)
+    if response.status_code in (200, 206):
+        # Тип - по исходному файлу, а не по .gz/.br: прокси определил бы его по имени варианта
+        # и отдал бы сжатые данные без Content-Encoding. Ответы без тела файла (416, 304) их не получают
+        content_type, _ = mimetypes.guess_type(full_path.name)
+        response["Content-Type"] = content_type or "application/octet-stream"
+        if encoding:
+            response["Content-Encoding"] = encoding
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = cache_control
+    if precompressed:
+        response["Vary"] = "Accept-Encoding"
+    return response
+
+
+def _file_response(request, path: Path, size: int, etag: str) -> HttpResponse:
+    range_header = request.headers.get("Range")
+    # If-Range: диапазон действителен, только если файл не изменился с прошлого ответа
+    if range_header and request.headers.get("If-Range", etag) == etag:
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        if byte_range is not None:
+            start, stop = byte_range
+            response = StreamingHttpResponse(_read_range(path, start, stop - start), status=206)
+            response["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+            response["Content-Length"] = str(stop - start)
+            response["Accept-Ranges"] = "bytes"
+            return response
+
+    response = FileResponse(open(path, "rb"))
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+@require_safe
+def serve_static(request, path: str) -> HttpResponse:
+    """Статика из STATIC_ROOT: хешированные имена кешируются навсегда"""
+    if HASHED_NAME_RE.search(path):
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        cache_control = f"public, max-age={settings.STATIC_CACHE_MAX_AGE}"
+    return serve_file(request, path, settings.STATIC_ROOT, settings.STATIC_URL, cache_control, precompressed=True)
+
+
+@require_safe
+def serve_media(request, path: str) -> HttpResponse:
+    """Загруженные файлы из MEDIA_ROOT: кешируются на MEDIA_CACHE_MAX_AGE и перепроверяются по ETag"""
+    cache_control = f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}"
+    return serve_file(request, path, settings.MEDIA_ROOT, settings.MEDIA_URL, cache_control)
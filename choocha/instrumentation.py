@@ -0,0 +1,215 @@
+# choocha\instrumentation.py
+"""
+Лёгкие замеры каждого запроса: SQL (число и время), кеш (попадания, промахи, время),
+рендеринг шаблонов и отправка почты.
+
+Итоги отдаются заголовком Server-Timing, одной строкой журнала с полями в extra
+и метриками Prometheus (choocha/metrics.py).
+Подробные замеры ведутся только для доли запросов INSTRUMENTATION["SAMPLE_RATE"]; у остальных
+измеряется лишь общее время. Для медленного запроса (дольше SLOW_REQUEST_MS) из выборки
+в журнал попадают и сами SQL-запросы, самые долгие первыми.
+"""
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.exceptions import TemplateDoesNotExist
+
+from .metrics import observe_request
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "SAMPLE_RATE": 1.0,
+    "SLOW_REQUEST_MS": 500,
+    "SERVER_TIMING": True,
+    # Сколько SQL-запросов медленного запроса попадает в журнал
+    "MAX_LOGGED_QUERIES": 20,
+}
+
+# Сколько запросов запоминается для журнала медленных: на случай страниц с тысячами запросов
+MAX_CAPTURED_QUERIES = 500
+
+
+def get_setting(name: str) -> Any:
+    return getattr(settings, "INSTRUMENTATION", {}).get(name, DEFAULTS[name])
+
+
+class RequestMetrics:
+    """Накопленные замеры одного запроса"""
+
+    def __init__(self) -> None:
+        self.durations: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self.queries: list[tuple[float, str]] = []
+        # Глубина вложенных рендерингов шаблонов: учитывается только внешний
+        self.template_depth = 0
+
+    def add(self, name: str, duration: float, count: int = 1) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def count(self, name: str, count: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + count
+
+
+_current: ContextVar[RequestMetrics | None] = ContextVar("request_metrics", default=None)
+
+
+def record(name: str, duration: float, count: int = 1) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(name, duration, count)
+
+
+def record_count(name: str, count: int = 1) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.count(name, count)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Добавляет время блока к замерам текущего запроса (вне запроса ничего не делает)"""
+    if _current.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+###################################
+#   Источники замеров             #
+###################################
+
+def _sql_wrapper(metrics: RequestMetrics) -> Callable:
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            metrics.add("db", duration)
+            if len(metrics.queries) < MAX_CAPTURED_QUERIES:
+                metrics.queries.append((duration, sql))
+
+    return wrapper
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None) -> str:
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            # render_to_string внутри тега шаблона уже учтён во времени внешнего шаблона
+            if not metrics.template_depth:
+                metrics.add("tpl", time.perf_counter() - started)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Бэкенд шаблонов Django, который замеряет время рендеринга"""
+
+    def from_string(self, template_code: str) -> TimedTemplate:
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name: str) -> TimedTemplate:
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+###################################
+#   Middleware                    #
+###################################
+
+# Метрики Server-Timing: SQL, обращения к Redis, рендеринг шаблонов, отправка почты.
+# desc - число операций (заголовок допускает только ASCII)
+SERVER_TIMING_METRICS = ("db", "cache", "tpl", "mail")
+
+
+def server_timing(metrics: RequestMetrics | None, total: float) -> str:
+    parts = []
+    if metrics is not None:
+        for name in SERVER_TIMING_METRICS:
+            if name in metrics.counts:
+                parts.append(f"{name};dur={metrics.durations.get(name, 0.0) * 1000:.1f};desc=\"{metrics.counts[name]}\"")
+        if "cache_hit" in metrics.counts or "cache_miss" in metrics.counts:
+            parts.append(
+                f"cache-hit;desc=\"{metrics.counts.get('cache_hit', 0)}/"
+                f"{metrics.counts.get('cache_hit', 0) + metrics.counts.get('cache_miss', 0)}\""
+            )
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class InstrumentationMiddleware:
+    """Должен стоять первым в MIDDLEWARE, чтобы замер охватывал остальные middleware"""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        metrics = RequestMetrics() if random.random() < get_setting("SAMPLE_RATE") else None
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                if metrics is not None:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(_sql_wrapper(metrics)))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+
+        observe_request(request, response, total, metrics.counts.get("db", 0) if metrics is not None else None)
+        if get_setting("SERVER_TIMING"):
+            response["Server-Timing"] = server_timing(metrics, total)
+        self.log(request, response, metrics, total)
+        return response
+
+    def log(self, request: HttpRequest, response: HttpResponse, metrics: RequestMetrics | None, total: float) -> None:
+        fields = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(total * 1000, 1),
+            "sampled": metrics is not None,
+        }
+        if metrics is not None:
+            for name in SERVER_TIMING_METRICS:
+                fields[f"{name}_count"] = metrics.counts.get(name, 0)
+                fields[f"{name}_ms"] = round(metrics.durations.get(name, 0.0) * 1000, 1)
+            fields["cache_hits"] = metrics.counts.get("cache_hit", 0)
+            fields["cache_misses"] = metrics.counts.get("cache_miss", 0)
+        summary = " ".join(f"{key}={value}" for key, value in fields.items() if key not in ("method", "path"))
+        message = f"{request.method} {request.path} {summary}"
+
+        if total * 1000 < get_setting("SLOW_REQUEST_MS"):
+            logger.info("%s", message, extra={"request_metrics": fields})
+            return
+        if metrics is not None:
+            slowest = sorted(metrics.queries, key=lambda query: query[0], reverse=True)
+            fields["slow_queries"] = [
+                {"ms": round(duration * 1000, 2), "sql": sql}
+                for duration, sql in slowest[:get_setting("MAX_LOGGED_QUERIES")]
+            ]
+            message += "".join(f"\n  {query['ms']} мс: {query['sql']}" for query in fields["slow_queries"])
+        logger.warning("Медленный запрос: %s", message, extra={"request_metrics": fields})
@@ -0,0 +1,139 @@
+# choocha\metrics.py
+"""
+Метрики Prometheus: время ответа по имени маршрута, SQL-запросы, попадания в кеш по семействам ключей,
+исходы отправки почты и длина очередей (почта, модерация комментариев).
+
+Под gunicorn с несколькими процессами переменная PROMETHEUS_MULTIPROC_DIR (её задаёт gunicorn.conf.py)
+включает многопроцессный режим prometheus_client: каждый процесс пишет значения в свои файлы
+в этом каталоге, а /metrics суммирует файлы всех процессов. Без неё метрики живут в памяти процесса.
+Обработчик почты (manage.py send_queued_mail) должен запускаться с тем же каталогом, иначе исходы
+отправки не попадут в /metrics.
+Длина очередей считается запросами к БД не чаще раза в QUEUE_COUNTS_TTL: результат хранится в общем кеше.
+Эндпоинт требует заголовок "Authorization: Bearer <METRICS_TOKEN>".
+"""
+import hmac
+import os
+from functools import lru_cache
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpRequest, HttpResponse
+from django.views.decorators.http import require_safe
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+REQUEST_LATENCY = Histogram(
+    "choocha_http_request_duration_seconds", "Время ответа", ("view", "method", "status"),
+)
+DB_QUERIES = Histogram(
+    "choocha_db_queries_per_request", "SQL-запросов на запрос (только запросы из выборки замеров)", ("view",),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+CACHE_REQUESTS = Counter(
+    "choocha_cache_requests_total", "Чтения кеша по семействам ключей", ("family", "result"),
+)
+MAIL_MESSAGES = Counter(
+    "choocha_mail_messages_total", "Исходы отправки писем из очереди", ("result",),
+)
+
+UNMATCHED_VIEW = "<unmatched>"
+OTHER_FAMILY = "other"
+
+# Префиксы ключей кеша (до первой подстановки), от длинных к коротким
+_key_families: list[str] = []
+
+
+def register_cache_key_families(templates: Iterable[str]) -> None:
+    """Регистрирует шаблоны ключей ("notes:cat:{slug}"): семейство ключа - часть шаблона до первой подстановки"""
+    families = {template.split("{", 1)[0].rstrip(":") for template in templates}
+    _key_families[:] = sorted(set(_key_families) | families, key=len, reverse=True)
+    key_family.cache_clear()
+
+
+@lru_cache(maxsize=4096)
+def key_family(key: str) -> str:
+    for family in _key_families:
+        if key == family or key.startswith(family + ":"):
+            return family
+    return OTHER_FAMILY
+
+
+def observe_cache(key: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(key_family(key), "hit" if hit else "miss").inc()
+
+
+def observe_request(request: HttpRequest, response: HttpResponse, duration: float, queries: int | None) -> None:
+    # Имя маршрута, а не путь: число различных значений метки должно быть ограничено
+    match = getattr(request, "resolver_match", None)
+    view = match.view_name if match is not None and match.view_name else UNMATCHED_VIEW
+    REQUEST_LATENCY.labels(view, request.method, f"{response.status_code // 100}xx").observe(duration)
+    if queries is not None:
+        DB_QUERIES.labels(view).observe(queries)
+
+
+def observe_mail(result: str, count: int = 1) -> None:
+    if count:
+        MAIL_MESSAGES.labels(result).inc(count)
+
+
+###################################
+#   Эндпоинт /metrics             #
+###################################
+
+QUEUE_COUNTS_KEY = "metrics:queues"
+# Несколько серверов Prometheus и процессов gunicorn не должны считать очереди при каждом опросе
+QUEUE_COUNTS_TTL = 15
+register_cache_key_families([QUEUE_COUNTS_KEY])
+
+
+def queue_counts() -> dict[str, int]:
+    counts = cache.get(QUEUE_COUNTS_KEY)
+    if counts is None:
+        from notes.models import Comment, OutgoingEmail
+
+        counts = {
+            "mail": OutgoingEmail.objects.filter(
+                status__in=(OutgoingEmail.Status.PENDING, OutgoingEmail.Status.SENDING),
+            ).count(),
+            "moderation": Comment.objects.filter(status=Comment.Status.ON_MODERATE).count(),
+        }
+        cache.set(QUEUE_COUNTS_KEY, counts, QUEUE_COUNTS_TTL)
+    return counts
+
+
+class QueueCollector:
+    """Длина очередей (с задержкой до QUEUE_COUNTS_TTL)"""
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        counts = queue_counts()
+        yield GaugeMetricFamily("choocha_mail_queue_pending", "Писем в очереди на отправку", value=counts["mail"])
+        yield GaugeMetricFamily(
+            "choocha_moderation_queue_pending", "Комментариев, ожидающих модерации", value=counts["moderation"],
+        )
+
+
+def _registry() -> CollectorRegistry:
+    registry = CollectorRegistry()
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(REGISTRY)
+    registry.register(QueueCollector())
+    return registry
+
+
+def _is_authorized(request: HttpRequest) -> bool:
+    token = settings.METRICS_TOKEN
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    return bool(token) and scheme.lower() == "bearer" and hmac.compare_digest(credentials.strip(), token)
+
+
+@require_safe
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    # Метрики не публичные: без токена эндпоинта как будто нет
+    if not _is_authorized(request):
+        raise Http404
+    return HttpResponse(generate_latest(_registry()), content_type=CONTENT_TYPE_LATEST)
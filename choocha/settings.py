@@ -44,34 +44,51 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'social_django',
     'django_ckeditor_5',
-    'debug_toolbar',
     'django.contrib.sites',
     'django.contrib.sitemaps',
     'analytical',
     'captcha',
-
+    'rest_framework',
 ]
 
 
 
 MIDDLEWARE = [
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    # Server-Timing и журнал замеров каждого запроса; первым, чтобы охватить остальные middleware
+    'choocha.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # 304 по ETag/Last-Modified, в том числе для страниц из кеша анонимных страниц (notes/pagecache.py)
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
-    "django.middleware.cache.UpdateCacheMiddleware",
     'django.middleware.common.CommonMiddleware',
-    "django.middleware.cache.FetchFromCacheMiddleware",
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Панель отладки тяжёлая и в продакшене не нужна
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
+# Замеры запросов (choocha/instrumentation.py): доля запросов с подробными замерами и порог медленного запроса
+INSTRUMENTATION = {
+    'SAMPLE_RATE': float(os.getenv('INSTRUMENTATION_SAMPLE_RATE', '1.0')),
+    'SLOW_REQUEST_MS': int(os.getenv('INSTRUMENTATION_SLOW_REQUEST_MS', '500')),
+    'SERVER_TIMING': True,
+}
+
+# Токен для /metrics (Prometheus: authorization.credentials в scrape_config). Без токена эндпоинт отключён.
+# Адрес клиента не проверяется: за прокси все запросы приходят с 127.0.0.1
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 ROOT_URLCONF = 'choocha.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендеринга
+        'BACKEND': 'choocha.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -132,6 +149,36 @@ MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 #MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Статика с хешем содержимого в имени и заранее сжатыми .gz/.br вариантами (создаются при collectstatic)
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'choocha.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Заранее построенные файлы карты сайта (notes/sitemaps.py)
+SITEMAP_ROOT = BASE_DIR / 'sitemaps'
+
+# Время кеширования в браузере для статики без хеша в имени и для загруженных файлов (секунды)
+STATIC_CACHE_MAX_AGE = 60 * 60
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 7
+
+# Отдача файлов прокси-сервером: 'nginx' (X-Accel-Redirect), 'apache' (X-Sendfile) или пусто
+SENDFILE_BACKEND = os.getenv('SENDFILE_BACKEND', '')
+# internal-location nginx, которому соответствует BASE_DIR (location /protected/ { internal; alias /app/; })
+SENDFILE_URL_PREFIX = os.getenv('SENDFILE_URL_PREFIX', '/protected/')
+
+# JSON API только для чтения (notes/api.py): без сессий и CSRF, данные одинаковы для всех клиентов
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': ('rest_framework.renderers.JSONRenderer',),
+    'DEFAULT_AUTHENTICATION_CLASSES': (),
+    'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.AllowAny',),
+    'UNAUTHENTICATED_USER': None,
+}
+
 
 
 # Default primary key field type
@@ -161,6 +208,10 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
 EMAIL_ADMIN = EMAIL_HOST_USER
 
+# Очередь исходящей почты: письма отправляет manage.py send_queued_mail.
+# True - отправлять сразу после сохранения (для разработки без фонового обработчика)
+EMAIL_QUEUE_EAGER = os.getenv('EMAIL_QUEUE_EAGER', 'False') == 'True'
+
 AUTH_USER_MODEL = 'users.User'
 
 SOCIAL_AUTH_PIPELINE = (
@@ -335,29 +386,54 @@ if DEBUG:
         }
     }
 else:
+    REDIS_OPTIONS = {
+        "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        "PICKLE_VERSION": -1,
+        "SOCKET_CONNECT_TIMEOUT": 5,
+        "SOCKET_TIMEOUT": 5,
+        "COMPRESSOR": "django_redis.compressors.zlib.ZlibCompressor",
+        "IGNORE_EXCEPTIONS": not DEBUG,
+        "CONNECTION_POOL_KWARGS": {
+            "max_connections": 100,
+            "retry_on_timeout": True,
+           },
+    }
     CACHES = {
+        # Память процесса перед Redis; при недоступности Redis сайт работает на L1
         "default": {
+            "BACKEND": "choocha.cache.TieredCache",
+            "LOCATION": "redis",
+            "OPTIONS": {
+                "L1_TIMEOUT": 5,
+                "L1_MAX_ENTRIES": 1000,
+                "FAILURE_THRESHOLD": 3,
+                "COOLDOWN": 30,
+            },
+        },
+        # L2: ошибки нужны выключателю TieredCache, а короткие таймауты - чтобы он быстрее сработал
+        "redis": {
             "BACKEND": "django_redis.cache.RedisCache",  # Явно указываем django-redis
             "LOCATION": REDIS_URL,
             "OPTIONS": {
-                "CLIENT_CLASS": "django_redis.client.DefaultClient",
-                "PICKLE_VERSION": -1,
-                "SOCKET_CONNECT_TIMEOUT": 5,
-                "SOCKET_TIMEOUT": 5,
-                "COMPRESSOR": "django_redis.compressors.zlib.ZlibCompressor",
-                "IGNORE_EXCEPTIONS": not DEBUG,
-                "CONNECTION_POOL_KWARGS": {
-                    "max_connections": 100,
-                    "retry_on_timeout": True,
-                   },
+                **REDIS_OPTIONS,
+                "SOCKET_CONNECT_TIMEOUT": 1,
+                "SOCKET_TIMEOUT": 1,
+                "IGNORE_EXCEPTIONS": False,
             },
             "KEY_PREFIX": "choocha.ru",  # Префикс для всех ключей
-        }
+        },
+        # Сессии не кешируются в памяти процесса: выход из аккаунта должен действовать сразу
+        "sessions": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "OPTIONS": REDIS_OPTIONS,
+            "KEY_PREFIX": "choocha.ru",
+        },
     }
 
     # Настройки сессий
     SESSION_ENGINE = "django.contrib.sessions.backends.cache"
-    SESSION_CACHE_ALIAS = "default"
+    SESSION_CACHE_ALIAS = "sessions"
     SESSION_COOKIE_SECURE = True
     CSRF_COOKIE_SECURE = True
 
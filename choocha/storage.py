@@ -0,0 +1,70 @@
+# choocha\storage.py
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него создаются только .gz
+    brotli = None
+
+# Расширения, которые имеет смысл сжимать (картинки и шрифты уже сжаты)
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".mjs", ".map", ".svg", ".html", ".txt", ".xml", ".json", ".ico"}
+
+# Сжатый вариант сохраняется, только если он заметно меньше исходного
+MIN_COMPRESSION_RATIO = 0.95
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Статика с хешем содержимого в имени файла и заранее сжатыми вариантами (.gz и .br).
+
+    Хешированные имена позволяют отдавать файлы с Cache-Control immutable,
+    а сжатие выполняется один раз при collectstatic, а не на каждый запрос.
+    """
+
+    def stored_name(self, name: str) -> str:
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # До collectstatic (разработка, тесты) манифеста нет - используем исходные имена
+            if self.hashed_files:
+                raise
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        processed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+            if not dry_run and not isinstance(processed, Exception):
+                processed_names.update(n for n in (name, hashed_name) if n)
+
+        if dry_run:
+            return
+        for name in sorted(processed_names):
+            for compressed_name in self.compress(name):
+                yield name, compressed_name, True
+
+    def compress(self, name: str) -> list[str]:
+        """Создаёт рядом с файлом его .gz и .br варианты. Возвращает имена созданных файлов"""
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+            return []
+        with self.open(name) as f:
+            data = f.read()
+
+        variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data, quality=11)
+
+        created = []
+        for suffix, compressed in variants.items():
+            if len(compressed) >= len(data) * MIN_COMPRESSION_RATIO:
+                continue
+            compressed_name = name + suffix
+            if self.exists(compressed_name):
+                self.delete(compressed_name)
+            self._save(compressed_name, ContentFile(compressed))
+            created.append(compressed_name)
+        return created
@@ -18,30 +18,25 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
 from django.urls import path, include, re_path
-from django.views.static import serve
 
-from notes.sitemaps import NoteSitemap, TagSitemap, CategorySitemap
+from notes.sitemaps import sitemap_index, sitemap_shard
+from .files import serve_media, serve_static
+from .metrics import metrics_view
 from .robots import robots_txt
 from .views import e_handler404, e_handler500, e_handler403
 
-sitemaps = {
-    'notes': NoteSitemap,
-    'tags': TagSitemap,
-    'categories': CategorySitemap,
-}
-
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('notes.urls')),
     path('users/', include('users.urls')),
+    path('api/', include('notes.api')),
     path('social-auth/', include('social_django.urls', namespace='social')),
     path("ckeditor5/", include('django_ckeditor_5.urls'), name="ck_editor_5_upload_file"),
-    re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
-    re_path(r'^static/(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT}),
-    path("__debug__/", include("debug_toolbar.urls")),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    re_path(r'^media/(?P<path>.*)$', serve_media),
+    re_path(r'^static/(?P<path>.*)$', serve_static),
+    path('sitemap.xml', sitemap_index, name='sitemap'),
+    re_path(r'^(?P<name>sitemap-[a-z]+-\d+\.xml)$', sitemap_shard, name='sitemap-shard'),
     path('captcha/', include('captcha.urls')),
 ]
 
@@ -51,8 +46,12 @@ urlpatterns = [
 
 urlpatterns += [
     path('robots.txt', robots_txt),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
+if settings.DEBUG:
+    urlpatterns.append(path("__debug__/", include("debug_toolbar.urls")))
+
 handler403 = e_handler403
 handler404 = e_handler404
 handler500 = e_handler500
@@ -0,0 +1,24 @@
+# gunicorn.conf.py
+"""
+Настройки gunicorn для метрик Prometheus (choocha/metrics.py).
+
+Каталог PROMETHEUS_MULTIPROC_DIR задаётся до загрузки приложения, чтобы все рабочие процессы
+писали метрики в файлы, а /metrics суммировал их. При запуске каталог очищается.
+"""
+import os
+import shutil
+from pathlib import Path
+
+PROMETHEUS_DIR = Path(os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/choocha-prometheus"))
+
+
+def on_starting(server) -> None:
+    # Значения прошлого запуска не должны суммироваться с новыми
+    shutil.rmtree(PROMETHEUS_DIR, ignore_errors=True)
+    PROMETHEUS_DIR.mkdir(parents=True)
+
+
+def child_exit(server, worker) -> None:
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
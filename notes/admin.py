@@ -1,9 +1,16 @@
 from django.contrib import admin, messages
 from django.db.models import QuerySet
 from django.http import HttpRequest
-from django.utils.safestring import mark_safe
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+from django.utils.html import format_html
 
-from .models import Note, TagPost, Category, Comment
+from .caching import invalidate_notes
+from .counters import recount_for_notes
+from .images import picture
+from .models import Note, TagPost, Category, Comment, OutgoingEmail
+from .moderation import moderate
+from .search import filter_notes
 
 
 @admin.register(Note)
@@ -37,6 +44,7 @@ class NotesAdmin(admin.ModelAdmin):
         "time_update",
         "cat",
         "status",
+        "comment_count",
         "post_image",
         "post_image_size",
     )
@@ -48,16 +56,15 @@ class NotesAdmin(admin.ModelAdmin):
         "-time_update",
         "title",
     )
+    # Поиск выполняется по полнотекстовому индексу (см. get_search_results)
     search_fields = (
         "title",
-        "content_short",
-        "content_full",
-        "cat__name",
     )
+    search_help_text = "Полнотекстовый поиск по заголовку и тексту статьи"
     list_editable = ("status",)
     list_per_page = 5
     actions = [
-        "status",
+        "set_published",
         "set_draft",
     ]
     list_filter = [
@@ -66,32 +73,54 @@ class NotesAdmin(admin.ModelAdmin):
     ]
     save_on_top = True
 
+    def get_search_results(self, request: HttpRequest, queryset: QuerySet, search_term: str) -> tuple[QuerySet, bool]:
+        if not search_term.strip():
+            return queryset, False
+        return filter_notes(queryset, search_term), False
+
     @staticmethod
     @admin.display(description="Изображение")
     def post_image(note: Note) -> str:
         if note.image:
-            return mark_safe(
-                f'<img src="{note.image.url}" alt="{note.title}" width="200">'
+            # Браузер выберет самую маленькую копию подходящего формата вместо оригинала
+            return picture(
+                note.image.name,
+                format_html('<img src="{}" alt="{}" width="200">', note.image.url, note.title),
+                sizes="200px",
             )
         return "Нет фото"
 
     @staticmethod
     @admin.display(description="Размер изображения")
     def post_image_size(note: Note) -> str:
-        if note.image:
-            return f"{note.image.width}x{note.image.height}"
-        return "Нет фото"
+        if not note.image:
+            return "Нет фото"
+        # Сведения берутся из строки статьи: файл изображения не открывается
+        if note.image_width is None:
+            return "Не заполнен (backfill_image_metadata)"
+        return f"{note.image_width}x{note.image_height}, {filesizeformat(note.image_size)}"
+
+    @staticmethod
+    def _set_status(queryset: QuerySet, status: Note.Status) -> int:
+        # Первичные ключи берутся до UPDATE: при фильтре списка по статусу queryset после него пуст
+        pks = list(queryset.values_list("pk", flat=True))
+        count = Note.objects.filter(pk__in=pks).update(status=status)
+        # update() не отправляет сигналы, поэтому счётчики и кеш обновляем вручную
+        notes = Note.objects.filter(pk__in=pks)
+        recount_for_notes(notes)
+        invalidate_notes(notes)
+        return count
 
     @admin.action(description="Опубликовать выбранные записи")
     def set_published(self, request: HttpRequest, queryset: QuerySet) -> None:
-        count = queryset.update(status=Note.Status.PUBLISHED)
-        self.message_user(request, f"{count} записей опубликованы")
+        count = self._set_status(queryset, Note.Status.PUBLISHED)
+        self.message_user(request, f"{count} записей опубликованы")
 
     @admin.action(description="Снять с публикации выбранные записи")
     def set_draft(self, request: HttpRequest, queryset: QuerySet) -> None:
-        count = queryset.update(status=Note.Status.DRAFT)
+        count = self._set_status(queryset, Note.Status.DRAFT)
         self.message_user(
-            request, f"{count} записей сняты с публикации", messages.WARNING
+            request, f"{count} записей сняты с публикации", messages.WARNING
         )
 
 
@@ -101,6 +130,7 @@ class CategoryAdmin(admin.ModelAdmin):
         "id",
         "name",
         "slug",
+        "published_count",
     )
     list_display_links = (
         "id",
@@ -129,3 +159,57 @@ class CommentAdmin(admin.ModelAdmin):
         "user",
         "body",
     )
+    list_select_related = ("user", "post")
+    actions = [
+        "approve_comments",
+        "hide_comments",
+        "delete_comments",
+    ]
+
+    # Пакетные действия: один UPDATE статуса, один пересчёт счётчиков и одна инвалидация кеша на пачку
+    @admin.action(description="Одобрить выбранные комментарии")
+    def approve_comments(self, request: HttpRequest, queryset: QuerySet) -> None:
+        count = moderate(queryset, Comment.Status.ACTIVE)
+        self.message_user(request, f"{count} комментариев одобрены")
+
+    @admin.action(description="Скрыть выбранные комментарии")
+    def hide_comments(self, request: HttpRequest, queryset: QuerySet) -> None:
+        count = moderate(queryset, Comment.Status.HIDE)
+        self.message_user(request, f"{count} комментариев скрыты", messages.WARNING)
+
+    @admin.action(description="Пометить удалёнными выбранные комментарии")
+    def delete_comments(self, request: HttpRequest, queryset: QuerySet) -> None:
+        count = moderate(queryset, Comment.Status.DELETED)
+        self.message_user(request, f"{count} комментариев помечены удалёнными", messages.WARNING)
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = (
+        "subject",
+        "created",
+        "status",
+        "attempts",
+        "next_attempt_at",
+        "sent_at",
+    )
+    list_filter = (
+        "status",
+        "created",
+    )
+    search_fields = ("subject",)
+    readonly_fields = (
+        "created",
+        "sent_at",
+        "last_error",
+    )
+    actions = ["retry"]
+
+    @admin.action(description="Повторить отправку выбранных писем")
+    def retry(self, request: HttpRequest, queryset: QuerySet) -> None:
+        # Письма, которые сейчас отправляет обработчик, не трогаем
+        count = queryset.exclude(status__in=(OutgoingEmail.Status.SENT, OutgoingEmail.Status.SENDING)).update(
+            status=OutgoingEmail.Status.PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{count} писем поставлены в очередь")
+
@@ -0,0 +1,169 @@
+"""
+JSON API только для чтения: статьи, категории, метки и одобренные комментарии.
+
+/api/notes/                   - список опубликованных статей (?category=, ?tag=, ?fields=, курсор)
+/api/notes/<slug>/            - статья целиком
+/api/notes/<slug>/comments/   - одобренные комментарии к статье
+/api/categories/, /api/tags/  - категории и метки, в которых есть опубликованные статьи
+
+ETag ответа строится из адреса запроса, версии содержимого (CONTENT_VERSION_KEY) и времени
+последнего изменения данных (time_update и счётчики комментариев статей, updated комментариев),
+которое читается одним агрегирующим запросом. Совпавший If-None-Match получает 304, иначе готовые данные берутся из
+общего кеша по ETag, и сериализация выполняется только после изменений.
+"""
+import hashlib
+from typing import Any, Callable
+
+from django.core.cache import cache
+from django.db.models import Count, Max, QuerySet, Sum
+from django.http import HttpRequest, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.routers import SimpleRouter
+
+from .caching import CACHE_TTL, api_response_key, content_version
+from .models import Note, Comment
+from .pagination import KEYSET_ORDERING
+from .serializers import (
+    NoteListSerializer, NoteDetailSerializer, CategorySerializer, TagSerializer, CommentSerializer,
+)
+
+# Клиент всегда перепроверяет ответ по ETag: 304 дешевле, чем устаревшие данные
+API_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+
+
+class NoteCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    # Совпадает с индексом Note.Meta.indexes
+    ordering = KEYSET_ORDERING
+
+
+class CommentCursorPagination(CursorPagination):
+    page_size = 50
+    ordering = ("created", "pk")
+
+
+class CachedResponseMixin:
+    """Условные ответы по ETag и кеширование готовых данных ответа"""
+
+    def cached_response(self, request: HttpRequest, state: Any, build: Callable[[], Any]) -> HttpResponse:
+        raw = f"{request.get_full_path()}|{content_version()}|{state}"
+        etag = quote_etag(hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest())
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            key = api_response_key(etag)
+            data = cache.get(key)
+            if data is None:
+                data = build()
+                cache.set(key, data, CACHE_TTL)
+            response = Response(data)
+        response["ETag"] = etag
+        response["Cache-Control"] = API_CACHE_CONTROL
+        return response
+
+
+class SparseFieldsViewMixin:
+    """Передаёт сериализатору список полей из ?fields=slug,title"""
+
+    def requested_fields(self) -> list[str] | None:
+        fields = self.request.query_params.get("fields")
+        if not fields:
+            return None
+        return [name.strip() for name in fields.split(",") if name.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("fields", self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+
+class NoteViewSet(SparseFieldsViewMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    lookup_field = "slug"
+    pagination_class = NoteCursorPagination
+
+    def get_serializer_class(self):
+        return NoteDetailSerializer if self.action == "retrieve" else NoteListSerializer
+
+    def get_queryset(self) -> QuerySet:
+        # Колонки сортировки нужны курсору даже если их нет среди запрошенных полей
+        return self.get_serializer_class().optimize(
+            Note.published.all(), self.requested_fields(), extra=("time_update", "title"),
+        )
+
+    def filter_queryset(self, queryset: QuerySet) -> QuerySet:
+        params = self.request.query_params
+        if params.get("category"):
+            queryset = queryset.filter(cat__slug=params["category"])
+        if params.get("tag"):
+            queryset = queryset.filter(tags__slug=params["tag"])
+        return queryset
+
+    def list(self, request, *args, **kwargs) -> HttpResponse:
+        state = self.filter_queryset(Note.published.all()).aggregate(
+            last=Max("time_update"), count=Count("id"),
+            # Счётчики комментариев меняются без обновления time_update
+            last_comment=Max("last_comment_at"), comments=Sum("comment_count"),
+        )
+        return self.cached_response(request, state, lambda: super(NoteViewSet, self).list(request, *args, **kwargs).data)
+
+    def retrieve(self, request, *args, **kwargs) -> HttpResponse:
+        note = get_object_or_404(Note.published.only("time_update", "comment_count"), slug=kwargs["slug"])
+        return self.cached_response(
+            request, (note.time_update, note.comment_count), lambda: super(NoteViewSet, self).retrieve(request, *args, **kwargs).data,
+        )
+
+    @action(detail=True)
+    def comments(self, request, slug: str) -> HttpResponse:
+        note = get_object_or_404(Note.published.only("id"), slug=slug)
+        comments = Comment.objects.filter(post=note, status=Comment.Status.ACTIVE)
+        state = comments.aggregate(last=Max("updated"), count=Count("id"))
+
+        def build() -> Any:
+            paginator = CommentCursorPagination()
+            page = paginator.paginate_queryset(
+                comments.select_related("user").only("body", "created", "updated", "user__username"),
+                request, view=self,
+            )
+            return paginator.get_paginated_response(CommentSerializer(page, many=True).data).data
+
+        return self.cached_response(request, state, build)
+
+
+class TaxonomyViewSet(SparseFieldsViewMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    """Категории и метки меняются редко и целиком версионируются CONTENT_VERSION_KEY"""
+    lookup_field = "slug"
+    pagination_class = None
+
+    def get_queryset(self) -> QuerySet:
+        return self.serializer_class.Meta.model.objects.filter(published_count__gt=0).order_by("name")
+
+    def list(self, request, *args, **kwargs) -> HttpResponse:
+        return self.cached_response(request, "", lambda: super(TaxonomyViewSet, self).list(request, *args, **kwargs).data)
+
+    def retrieve(self, request, *args, **kwargs) -> HttpResponse:
+        return self.cached_response(
+            request, "", lambda: super(TaxonomyViewSet, self).retrieve(request, *args, **kwargs).data,
+        )
+
+
+class CategoryViewSet(TaxonomyViewSet):
+    serializer_class = CategorySerializer
+
+
+class TagViewSet(TaxonomyViewSet):
+    serializer_class = TagSerializer
+
+
+router = SimpleRouter()
+router.register("notes", NoteViewSet, basename="api-note")
+router.register("categories", CategoryViewSet, basename="api-category")
+router.register("tags", TagViewSet, basename="api-tag")
+
+urlpatterns = router.urls
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class NotesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'notes'
+
+    def ready(self) -> None:
+        from . import signals  # noqa: F401 - регистрация обработчиков инвалидации кеша
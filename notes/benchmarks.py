@@ -0,0 +1,297 @@
+"""
+Нагрузочные замеры публичных страниц.
+
+generate_data() наполняет базу статьями, категориями, метками и комментариями пачками bulk_create,
+run_benchmarks() прогоняет сценарии (главная, статья, категория, метка, боковая колонка, карта сайта)
+с пустым ("cold") и заполненным ("warm") кешем и для каждого записывает число SQL-запросов,
+p50/p95 времени ответа и пик выделенной памяти. Число запросов не должно зависеть от объёма данных,
+поэтому для холодного кеша у каждого сценария есть бюджет QUERY_BUDGETS, а сравнение с сохранённым
+базовым прогоном (compare) считает регрессией любой рост числа запросов.
+
+Запуск: manage.py generate_bench_data, затем manage.py benchmark (см. --help).
+"""
+import json
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Iterable, NamedTuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.template import Context, Template
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .counters import recount_categories, recount_comments, recount_tags
+from .models import Note, Category, TagPost, Comment
+from .sitemaps import refresh_sitemaps
+
+###################################
+#   Генератор данных              #
+###################################
+
+BENCH_USER_PREFIX = "bench-user-"
+
+_WORDS = (
+    "кеш", "запрос", "индекс", "страница", "шаблон", "статья", "метка", "категория", "сервер", "память",
+    "python", "django", "redis", "postgres", "курсор", "счётчик", "очередь", "фрагмент", "лента", "поиск",
+)
+
+
+def _text(rnd: random.Random, words: int) -> str:
+    return " ".join(rnd.choice(_WORDS) for _ in range(words))
+
+
+def _batches(total: int, size: int) -> Iterable[range]:
+    for start in range(0, total, size):
+        yield range(start, min(start + size, total))
+
+
+def generate_data(
+    notes: int,
+    categories: int = 20,
+    tags: int = 200,
+    tags_per_note: int = 3,
+    comments_per_note: int = 5,
+    users: int = 50,
+    batch_size: int = 2000,
+    seed: int = 0,
+    log: Callable[[str], None] = lambda message: None,
+) -> None:
+    """
+    Создаёт статьи (90% опубликованы) с метками и комментариями (80% одобрены).
+    Сигналы bulk_create не отправляет, поэтому счётчики пересчитываются в конце одним UPDATE на таблицу.
+    Названия содержат seed: с другим seed данные можно добавить к уже созданным.
+    AutoSlugField проверяет уникальность слага отдельным запросом на каждую строку - это самая медленная часть.
+    """
+    rnd = random.Random(seed)
+    prefix = f"b{seed}"
+
+    with transaction.atomic():
+        cats = Category.objects.bulk_create(
+            Category(name=f"Категория {prefix}-{i}") for i in range(categories)
+        )
+        tag_objs = TagPost.objects.bulk_create(
+            TagPost(name=f"Метка {prefix}-{i}") for i in range(tags)
+        )
+        user_model = get_user_model()
+        user_objs = user_model.objects.bulk_create(
+            user_model(username=f"{BENCH_USER_PREFIX}{prefix}-{i}", password="!") for i in range(users)
+        )
+    log(f"Категорий: {len(cats)}, меток: {len(tag_objs)}, пользователей: {len(user_objs)}")
+
+    for batch in _batches(notes, batch_size):
+        with transaction.atomic():
+            objs = []
+            for i in batch:
+                note = Note(
+                    title=f"{_text(rnd, 4).capitalize()} {prefix}-{i}",
+                    content_short=f"<p>{_text(rnd, 40)}</p>",
+                    content_full="".join(f"<p>{_text(rnd, 80)}</p>" for _ in range(5)),
+                    status=Note.Status.PUBLISHED if rnd.random() < 0.9 else Note.Status.DRAFT,
+                    cat=rnd.choice(cats),
+                    author=rnd.choice(user_objs) if user_objs else None,
+                )
+                # save() не вызывается - вычисляемые поля заполняются вручную
+                note.refresh_derived_fields()
+                objs.append(note)
+            objs = Note.objects.bulk_create(objs)
+
+            Note.tags.through.objects.bulk_create(
+                Note.tags.through(note_id=note.pk, tagpost_id=tag.pk)
+                for note in objs
+                for tag in rnd.sample(tag_objs, min(tags_per_note, len(tag_objs)))
+            )
+            if user_objs:
+                Comment.objects.bulk_create(
+                    Comment(
+                        post_id=note.pk,
+                        user=rnd.choice(user_objs),
+                        body=_text(rnd, 20),
+                        status=Comment.Status.ACTIVE if rnd.random() < 0.8 else Comment.Status.HIDE,
+                    )
+                    for note in objs
+                    for _ in range(comments_per_note)
+                )
+        log(f"Статей: {batch.stop} из {notes}")
+
+    with transaction.atomic():
+        recount_categories()
+        recount_tags()
+        recount_comments()
+    cache.clear()
+    log("Счётчики пересчитаны")
+
+
+###################################
+#   Сценарии и замеры             #
+###################################
+
+# Наибольшее допустимое число SQL-запросов сценария с холодным кешем. Для карты сайта - при одной части
+# на раздел: каждые следующие 50 000 статей добавляют запросы своей части
+QUERY_BUDGETS = {
+    "index": 5,
+    "index_page": 5,
+    "post": 12,
+    "category": 6,
+    "tag": 6,
+    "sidebar": 3,
+    "sitemap": 12,
+}
+
+MODES = ("cold", "warm")
+
+SIDEBAR_TEMPLATE = (
+    "{% load show_categories_tags_lastposts %}"
+    "{% show_categories %}{% show_all_tags %}{% show_last_posts %}"
+)
+
+
+class Scenario(NamedTuple):
+    name: str
+    run: Callable[[], object]
+
+
+def _get(client: Client, path: str) -> Callable[[], object]:
+    def run() -> object:
+        response = client.get(path, secure=settings.SECURE_SSL_REDIRECT)
+        if response.status_code != 200:
+            raise AssertionError(f"{path}: {response.status_code}")
+        return response
+
+    return run
+
+
+def build_scenarios(sitemap_root: Path) -> list[Scenario]:
+    """Сценарии на самых нагруженных объектах: статья с наибольшим числом комментариев, крупнейшие категория и метка"""
+    # Хост из ALLOWED_HOSTS, чтобы замеры работали и с боевыми настройками
+    host = next((host.lstrip(".") for host in settings.ALLOWED_HOSTS if host and host != "*"), "testserver")
+    client = Client(SERVER_NAME=host)
+    post = Note.published.order_by("-comment_count", "pk").only("slug").first()
+    category = Category.objects.order_by("-published_count", "pk").only("slug").first()
+    tag = TagPost.objects.order_by("-published_count", "pk").only("slug").first()
+    if post is None or category is None or tag is None:
+        raise ValueError("Нет опубликованных статей - сначала выполните generate_bench_data")
+
+    template = Template(SIDEBAR_TEMPLATE)
+
+    def sitemap() -> object:
+        with override_settings(SITEMAP_ROOT=sitemap_root):
+            return refresh_sitemaps()
+
+    return [
+        Scenario("index", _get(client, reverse("home"))),
+        Scenario("index_page", _get(client, reverse("home") + "?page=2")),
+        Scenario("post", _get(client, post.get_absolute_url())),
+        Scenario("category", _get(client, category.get_absolute_url())),
+        Scenario("tag", _get(client, tag.get_absolute_url())),
+        Scenario("sidebar", lambda: template.render(Context())),
+        Scenario("sitemap", sitemap),
+    ]
+
+
+def _percentile(samples: list[float], percent: int) -> float:
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[percent - 1]
+
+
+def measure(scenario: Scenario, mode: str, iterations: int) -> dict[str, float]:
+    """
+    Время и число запросов - по iterations прогонам, память - отдельным прогоном под tracemalloc,
+    который заметно замедляет выполнение.
+    """
+    def prepare() -> None:
+        if mode == "cold":
+            cache.clear()
+
+    prepare()
+    scenario.run()  # прогрев: импорты, шаблоны, а для "warm" - кеш
+
+    timings, queries = [], 0
+    for _ in range(iterations):
+        prepare()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            scenario.run()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = max(queries, len(captured))
+
+    prepare()
+    tracemalloc.start()
+    try:
+        scenario.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "queries": queries,
+        "p50_ms": round(_percentile(timings, 50), 2),
+        "p95_ms": round(_percentile(timings, 95), 2),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(
+    iterations: int = 20, names: Iterable[str] | None = None, modes: Iterable[str] = MODES,
+) -> dict[str, dict[str, float]]:
+    """Результаты по ключам "сценарий:режим". Кеш очищается - не запускать на боевом сервере"""
+    names = set(names or ())
+    results = {}
+    with tempfile.TemporaryDirectory() as sitemap_root:
+        for scenario in build_scenarios(Path(sitemap_root)):
+            if names and scenario.name not in names:
+                continue
+            for mode in modes:
+                results[f"{scenario.name}:{mode}"] = measure(scenario, mode, iterations)
+    cache.clear()
+    return results
+
+
+###################################
+#   Бюджеты и базовый прогон      #
+###################################
+
+def over_budget(results: dict[str, dict[str, float]]) -> list[str]:
+    problems = []
+    for key, result in results.items():
+        name, mode = key.split(":")
+        budget = QUERY_BUDGETS.get(name)
+        if mode == "cold" and budget is not None and result["queries"] > budget:
+            problems.append(f"{key}: {result['queries']} запросов при бюджете {budget}")
+    return problems
+
+
+def compare(
+    results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]], tolerance: float = 0.2,
+) -> tuple[list[str], list[str]]:
+    """
+    Возвращает (регрессии, предупреждения). Рост числа запросов - регрессия; рост времени и памяти
+    больше чем на tolerance - только предупреждение, потому что они зависят от машины и шума.
+    """
+    regressions, warnings = [], []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result["queries"] > base["queries"]:
+            regressions.append(f"{key}: запросов {base['queries']} -> {result['queries']}")
+        for metric in ("p95_ms", "peak_kib"):
+            if base[metric] and result[metric] > base[metric] * (1 + tolerance):
+                warnings.append(f"{key}: {metric} {base[metric]} -> {result[metric]}")
+    return regressions, warnings
+
+
+def load_baseline(path: Path) -> dict[str, dict[str, float]]:
+    return json.loads(Path(path).read_text())
+
+
+def save_baseline(path: Path, results: dict[str, dict[str, float]]) -> None:
+    Path(path).write_text(json.dumps(results, indent=1, sort_keys=True))
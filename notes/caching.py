@@ -0,0 +1,332 @@
+import hashlib
+import logging
+import math
+import random
+import time
+import uuid
+from typing import Any, Callable, Iterable, NamedTuple, TypeVar
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import QuerySet
+
+from choocha.metrics import register_cache_key_families
+
+from .models import Note, Category, TagPost
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Ключи кеша. Все ключи собираются только через эти шаблоны,
+# чтобы инвалидация удаляла ровно те записи, которые читают представления и теги.
+CATEGORY_POSTS_KEY = "notes:cat:{slug}"
+TAG_POSTS_KEY = "notes:tag:{slug}"
+CATEGORIES_KEY = "notes:categories:{cat_selected}"
+ALL_TAGS_KEY = "notes:all_tags"
+# v2: в снимке только заголовок и slug статей
+LAST_POSTS_KEY = "last_posts:v2:{count}"
+# v3: в снимке готовый content_short_html вместо исходного content_short (v2 добавила счётчик комментариев)
+NOTE_ROW_KEY = "notes:row:v3:{pk}"
+PUBLISHED_COUNT_KEY = "notes:count:published"
+# Фрагменты HTML версионируются самим ключом (время изменения), поэтому не требуют инвалидации
+POST_BODY_KEY = "notes:html:post:{pk}:{version}"
+COMMENT_HTML_KEY = "notes:html:comment:{pk}:{version}"
+# Список готовых уменьшенных копий изображения (digest - md5 имени файла)
+IMAGE_DERIVATIVES_KEY = "notes:img:{digest}"
+# Увеличивается, когда появляются копии картинок из текста статей, и входит в версию фрагмента статьи
+IMAGE_GENERATION_KEY = "notes:img:generation"
+# Метка актуальности раздела карты сайта: удаляется при изменениях, файлы раздела перестраиваются
+SITEMAP_FRESH_KEY = "notes:sitemap:fresh:{section}"
+SITEMAP_LOCK_KEY = "notes:sitemap:lock"
+# Версия опубликованного содержимого (статьи, категории, метки). Удаляется при любых их изменениях,
+# и всё, что версионировано ею (RSS/Atom ленты, ответы API), строится заново
+CONTENT_VERSION_KEY = "notes:content:version"
+FEED_KEY = "notes:feed:{version}:{name}:{args}"
+# Страницы для анонимных посетителей (digest - md5 пути с query string). Запись хранит версию
+# содержимого, при которой построена: после её смены страница отдаётся устаревшей, пока один процесс её перестраивает
+# v2: запись хранит все заголовки ответа, а не только Content-Type
+PAGE_KEY = "notes:page:v2:{digest}"
+PAGE_LOCK_KEY = "notes:page:lock:{digest}"
+API_RESPONSE_KEY = "notes:api:{etag}"
+
+# Семейства ключей для метрик попаданий в кеш (choocha/metrics.py)
+register_cache_key_families((
+    CATEGORY_POSTS_KEY, TAG_POSTS_KEY, CATEGORIES_KEY, ALL_TAGS_KEY, LAST_POSTS_KEY, NOTE_ROW_KEY,
+    PUBLISHED_COUNT_KEY, POST_BODY_KEY, COMMENT_HTML_KEY, IMAGE_DERIVATIVES_KEY, IMAGE_GENERATION_KEY,
+    SITEMAP_FRESH_KEY, SITEMAP_LOCK_KEY, CONTENT_VERSION_KEY, FEED_KEY, PAGE_KEY, PAGE_LOCK_KEY, API_RESPONSE_KEY,
+))
+
+# Размеры блока последних статей, которые используются в шаблонах
+LAST_POSTS_COUNTS = (5,)
+
+# Записи инвалидируются по событиям моделей, поэтому TTL - лишь страховка
+CACHE_TTL = 60 * 60 * 24 * 7
+
+
+def category_posts_key(slug: str) -> str:
+    return CATEGORY_POSTS_KEY.format(slug=slug)
+
+
+def tag_posts_key(slug: str) -> str:
+    return TAG_POSTS_KEY.format(slug=slug)
+
+
+def categories_key(cat_selected: int) -> str:
+    return CATEGORIES_KEY.format(cat_selected=cat_selected)
+
+
+def last_posts_key(count: int) -> str:
+    return LAST_POSTS_KEY.format(count=count)
+
+
+def note_row_key(pk: int) -> str:
+    return NOTE_ROW_KEY.format(pk=pk)
+
+
+def post_body_key(pk: int, version: str) -> str:
+    return POST_BODY_KEY.format(pk=pk, version=version)
+
+
+def comment_html_key(pk: int, version: str) -> str:
+    return COMMENT_HTML_KEY.format(pk=pk, version=version)
+
+
+def image_derivatives_key(name: str) -> str:
+    digest = hashlib.md5(name.encode(), usedforsecurity=False).hexdigest()
+    return IMAGE_DERIVATIVES_KEY.format(digest=digest)
+
+
+def sitemap_fresh_key(section: str) -> str:
+    return SITEMAP_FRESH_KEY.format(section=section)
+
+
+def sitemap_keys(*sections: str) -> list[str]:
+    """Метки актуальности разделов карты сайта; без аргументов - всех разделов"""
+    return [sitemap_fresh_key(section) for section in sections or ("notes", "tags", "categories")]
+
+
+def page_digest(path: str) -> str:
+    return hashlib.md5(path.encode(), usedforsecurity=False).hexdigest()
+
+
+def page_key(path: str) -> str:
+    return PAGE_KEY.format(digest=page_digest(path))
+
+
+def page_lock_key(path: str) -> str:
+    return PAGE_LOCK_KEY.format(digest=page_digest(path))
+
+
+def content_version() -> str:
+    """Текущая версия содержимого; после инвалидации создаётся новая"""
+    return cache.get_or_set(CONTENT_VERSION_KEY, lambda: uuid.uuid4().hex, CACHE_TTL)
+
+
+def api_response_key(etag: str) -> str:
+    return API_RESPONSE_KEY.format(etag=etag.strip('"'))
+
+
+def feed_key(name: str, version: str, *args: str) -> str:
+    return FEED_KEY.format(version=version, name=name, args=":".join(args))
+
+
+def sidebar_keys() -> list[str]:
+    """
+    Ключи боковой панели: списки категорий (для каждой выбранной категории) и меток.
+    """
+    cat_ids = [0, *Category.objects.values_list("pk", flat=True)]
+    return [categories_key(pk) for pk in cat_ids] + [ALL_TAGS_KEY]
+
+
+def last_posts_keys() -> list[str]:
+    return [last_posts_key(count) for count in LAST_POSTS_COUNTS]
+
+
+def invalidate(keys: Iterable[str]) -> None:
+    """
+    Удаляет ключи из кеша после фиксации текущей транзакции.
+
+    Удаление откладывается до commit, иначе параллельный запрос может успеть
+    положить в кеш ещё не зафиксированное (или откатившееся) состояние.
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return
+
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_notes(notes: QuerySet) -> None:
+    """
+    Инвалидация всех списков, в которых могут присутствовать указанные статьи.
+    Используется для массовых операций (queryset.update), которые не отправляют сигналы.
+    """
+    note_ids = list(notes.values_list("pk", flat=True))
+    if not note_ids:
+        return
+    cat_slugs = Category.objects.filter(posts__in=note_ids).values_list("slug", flat=True)
+    tag_slugs = TagPost.objects.filter(posts__in=note_ids).values_list("slug", flat=True)
+    invalidate([
+        *(category_posts_key(slug) for slug in cat_slugs),
+        *(tag_posts_key(slug) for slug in tag_slugs),
+        *(note_row_key(pk) for pk in note_ids),
+        PUBLISHED_COUNT_KEY,
+        *sidebar_keys(),
+        *last_posts_keys(),
+        *sitemap_keys(),
+        CONTENT_VERSION_KEY,
+    ])
+
+
+###################################
+#   Защита от лавины пересчётов   #
+###################################
+
+# Срок записи случайно сокращается на долю до TTL_JITTER, чтобы ключи не истекали одновременно
+TTL_JITTER = 0.1
+# XFetch: чем больше, тем раньше дорогая запись пересчитывается до истечения срока
+XFETCH_BETA = 1.0
+# Запись хранится дольше своего срока, чтобы было что отдать, пока другой процесс её пересчитывает
+STALE_GRACE = 60 * 5
+RECOMPUTE_LOCK_TIMEOUT = 30
+# Сколько ждать результата чужого пересчёта, если устаревшего значения нет
+RECOMPUTE_WAIT = 2.0
+RECOMPUTE_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+
+class CachedValue(NamedTuple):
+    value: Any
+    # Время вычисления значения, с - по нему XFetch решает, насколько заранее его обновлять
+    delta: float
+    # Логический срок годности (unix time) или None для бессрочных записей
+    expires: float | None
+
+
+def _lock_key(key: str) -> str:
+    return f"{key}:lock"
+
+
+def _read(key: str) -> CachedValue | None:
+    entry = cache.get(key)
+    # Значения, записанные до появления обёртки, считаются промахом
+    return entry if isinstance(entry, CachedValue) else None
+
+
+def _is_fresh(entry: CachedValue, now: float) -> bool:
+    if entry.expires is None:
+        return True
+    # 1 - random() лежит в (0, 1], поэтому логарифм определён
+    return now - entry.delta * XFETCH_BETA * math.log(1.0 - random.random()) < entry.expires
+
+
+def _recompute(key: str, compute: Callable[[], T], timeout: int | None) -> T:
+    started = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - started
+    if timeout is None:
+        expires, physical_timeout = None, None
+    else:
+        lifetime = timeout * (1 - TTL_JITTER * random.random())
+        expires, physical_timeout = time.time() + lifetime, int(lifetime) + STALE_GRACE
+    cache.set(key, CachedValue(value, delta, expires), physical_timeout)
+    logger.info("cache recompute %s: %.3f с", key, delta, extra={"cache_event": "recompute", "cache_key": key})
+    return value
+
+
+def _wait_for(key: str) -> Any:
+    """Ждёт, пока другой процесс запишет значение или снимет блокировку"""
+    deadline = time.monotonic() + RECOMPUTE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(RECOMPUTE_POLL_INTERVAL)
+        entry = _read(key)
+        if entry is not None:
+            return entry.value
+        if not cache.has_key(_lock_key(key)):
+            break
+    return _MISSING
+
+
+def get_or_compute(key: str, compute: Callable[[], T], timeout: int | None = CACHE_TTL) -> T:
+    """
+    Аналог cache.get_or_set, защищённый от одновременного пересчёта одного ключа.
+
+    Значение пересчитывает только процесс, захвативший блокировку в Redis; остальные
+    отдают устаревшее значение или недолго ждут нового. Дорогие записи обновляются
+    заранее с вероятностью, растущей к концу срока (XFetch), а сам срок случайно сокращается.
+    """
+    entry = _read(key)
+    if entry is not None and _is_fresh(entry, time.time()):
+        logger.debug("cache hit %s", key, extra={"cache_event": "hit", "cache_key": key})
+        return entry.value
+
+    locked = cache.add(_lock_key(key), 1, RECOMPUTE_LOCK_TIMEOUT)
+    if not locked:
+        if entry is not None:
+            logger.debug("cache stale %s", key, extra={"cache_event": "stale", "cache_key": key})
+            return entry.value
+        value = _wait_for(key)
+        if value is not _MISSING:
+            logger.debug("cache wait %s", key, extra={"cache_event": "wait", "cache_key": key})
+            return value
+
+    logger.debug("cache miss %s", key, extra={"cache_event": "miss", "cache_key": key})
+    try:
+        return _recompute(key, compute, timeout)
+    finally:
+        if locked:
+            cache.delete(_lock_key(key))
+
+
+###################################
+#   Снимки строк списков статей   #
+###################################
+
+# Поля, которые нужны шаблону списка статей (notes/index.html)
+NOTE_ROW_FIELDS = (
+    "id", "title", "slug", "content_short_html", "time_create", "time_update", "comment_count",
+    "cat__name", "cat__slug", "author__username",
+)
+
+
+def note_from_row(row: dict) -> Note:
+    """
+    Собирает несохраняемый экземпляр Note из компактного снимка строки.
+    Шаблону доступны те же атрибуты и методы, что и у статьи из QuerySet.
+    """
+    return Note(
+        id=row["id"],
+        title=row["title"],
+        slug=row["slug"],
+        content_short_html=row["content_short_html"],
+        time_create=row["time_create"],
+        time_update=row["time_update"],
+        comment_count=row["comment_count"],
+        status=Note.Status.PUBLISHED,
+        cat=Category(name=row["cat__name"], slug=row["cat__slug"]),
+        author=get_user_model()(username=row["author__username"]) if row["author__username"] else None,
+    )
+
+
+def fetch_note_rows(ids: list[int]) -> dict[int, dict]:
+    return {row["id"]: row for row in Note.published.filter(pk__in=ids).values(*NOTE_ROW_FIELDS)}
+
+
+def get_note_rows(ids: list[int]) -> list[Note]:
+    """
+    Возвращает статьи по списку идентификаторов в исходном порядке.
+    Снимки строк читаются из кеша одним get_many, недостающие - одним запросом к БД.
+    """
+    if not ids:
+        return []
+    rows = {row["id"]: row for row in cache.get_many([note_row_key(pk) for pk in ids]).values()}
+    missing = [pk for pk in ids if pk not in rows]
+    if missing:
+        fetched = fetch_note_rows(missing)
+        rows.update(fetched)
+        cache.set_many({note_row_key(pk): row for pk, row in fetched.items()}, CACHE_TTL)
+    # Статья могла быть снята с публикации между чтением списка и строк
+    return [note_from_row(rows[pk]) for pk in ids if pk in rows]
@@ -0,0 +1,326 @@
+"""
+Подготовка HTML из CKEditor при сохранении статьи.
+
+render_content() очищает разметку по белому списку тегов, атрибутов, свойств style и схем ссылок,
+собранному из кнопок панелей CKEditor, убирает пустые абзацы, добавляет картинкам loading="lazy"
+и размеры, подсвечивает блоки кода (если установлен Pygments) и удаляет пробелы между блоками. Результат хранится в Note.content_short_html и Note.content_full_html,
+и шаблоны выводят его как есть: при запросе страницы разметка уже не разбирается.
+"""
+import logging
+import re
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import PreformattedString
+from django.conf import settings
+from django.core.files.images import get_image_dimensions
+from django.core.files.storage import default_storage
+
+try:
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+except ImportError:  # Pygments необязателен: без него блоки кода выводятся без подсветки
+    highlight = None
+
+logger = logging.getLogger(__name__)
+
+# Увеличивается при любом изменении обработки ниже. Входит в версию кешированного фрагмента статьи:
+# backfill_note_fields перезаписывает HTML через bulk_update, не трогая time_update, и без этой
+# версии страницы продолжали бы отдавать фрагменты, построенные прежней обработкой
+CONTENT_PIPELINE_VERSION = 3
+
+###################################
+#   Белый список                  #
+###################################
+
+# Белый список собирается из кнопок панелей CKEDITOR_5_CONFIGS: для каждой кнопки - теги с атрибутами
+# и свойства style, которые она выводит в данных редактора (CKEditor 5, версия из django-ckeditor-5).
+# Кнопка, убранная из настроек, перестаёт пропускать свою разметку, новая - требует записи здесь
+BASE_MARKUP = {"p": (), "br": (), "hr": (), "span": ()}
+_IMAGE_MARKUP = {"figure": (), "figcaption": (), "img": ("src", "alt", "title", "width", "height")}
+_LIST_MARKUP = {"ul": (), "ol": ("start", "reversed"), "li": ()}
+EDITOR_MARKUP = {
+    "heading": {"h1": (), "h2": (), "h3": (), "h4": (), "h5": (), "h6": ()},
+    "bold": {"strong": (), "b": ()},
+    "italic": {"i": (), "em": ()},
+    "underline": {"u": ()},
+    "strikethrough": {"s": ()},
+    "code": {"code": ()},
+    "subscript": {"sub": ()},
+    "superscript": {"sup": ()},
+    "highlight": {"mark": ()},
+    "link": {"a": ("href", "title", "target")},
+    "blockQuote": {"blockquote": ()},
+    "codeBlock": {"pre": (), "code": ()},
+    "bulletedList": _LIST_MARKUP,
+    "numberedList": _LIST_MARKUP,
+    "todoList": {**_LIST_MARKUP, "label": (), "input": ("type", "checked", "disabled")},
+    "imageUpload": _IMAGE_MARKUP,
+    "insertImage": _IMAGE_MARKUP,
+    "mediaEmbed": {"figure": (), "oembed": ("url",)},
+    "insertTable": {
+        "figure": (), "figcaption": (), "table": (), "caption": (), "colgroup": (), "col": (),
+        "thead": (), "tbody": (), "tfoot": (), "tr": (),
+        "th": ("colspan", "rowspan", "scope"), "td": ("colspan", "rowspan"),
+    },
+}
+_BORDER_STYLES = (
+    "border", "border-top", "border-right", "border-bottom", "border-left",
+    "border-color", "border-style", "border-width",
+)
+_CELL_STYLES = (*_BORDER_STYLES, "background-color", "padding", "width", "height", "text-align", "vertical-align")
+_IMAGE_STYLES = {"figure": ("width",), "img": ("width", "height", "aspect-ratio")}
+_LIST_STYLES = {"ul": ("list-style-type",), "ol": ("list-style-type",)}
+_INDENT_STYLES = dict.fromkeys(("p", "h1", "h2", "h3", "h4", "h5", "h6"), ("margin-left",))
+EDITOR_STYLES = {
+    "fontSize": {"span": ("font-size",)},
+    "fontFamily": {"span": ("font-family",)},
+    "fontColor": {"span": ("color",)},
+    "fontBackgroundColor": {"span": ("background-color",)},
+    "bulletedList": _LIST_STYLES,
+    "numberedList": _LIST_STYLES,
+    "indent": _INDENT_STYLES,
+    "outdent": _INDENT_STYLES,
+    "imageUpload": _IMAGE_STYLES,
+    "insertImage": _IMAGE_STYLES,
+    # Ширина столбцов, изменённая мышью
+    "insertTable": {"figure": ("width",), "col": ("width",)},
+    "tableProperties": {
+        "figure": ("width", "height", "float"), "table": (*_BORDER_STYLES, "background-color", "width", "height"),
+    },
+    "tableCellProperties": {"td": _CELL_STYLES, "th": _CELL_STYLES},
+}
+
+
+def _toolbar_items(config: dict) -> set[str]:
+    """Кнопки всех панелей конфигурации редактора, включая вложенные (image.toolbar, table.contentToolbar)"""
+    items = set()
+    for key, value in config.items():
+        if key.endswith(("toolbar", "Toolbar")):
+            if isinstance(value, dict):
+                value = value.get("items", ())
+            # "imageStyle:alignLeft" - вариант кнопки imageStyle
+            items.update(item.split(":")[0] for item in value if isinstance(item, str) and item != "|")
+        elif isinstance(value, dict):
+            items |= _toolbar_items(value)
+    return items
+
+
+def editor_allowlist(configs: dict) -> tuple[frozenset[str], dict[str, frozenset[str]], dict[str, frozenset[str]]]:
+    """Теги, их атрибуты и свойства style, которые выводят кнопки всех конфигураций CKEditor"""
+    items = set().union(*(_toolbar_items(config) for config in configs.values() if isinstance(config, dict)))
+    attributes = {tag: set(names) for tag, names in BASE_MARKUP.items()}
+    styles = {}
+    for item in items:
+        for tag, names in EDITOR_MARKUP.get(item, {}).items():
+            attributes.setdefault(tag, set()).update(names)
+        for tag, names in EDITOR_STYLES.get(item, {}).items():
+            styles.setdefault(tag, set()).update(names)
+    for tag in styles:
+        attributes.setdefault(tag, set()).add("style")
+    return (
+        frozenset(attributes),
+        {tag: frozenset(names) for tag, names in attributes.items()},
+        {tag: frozenset(names) for tag, names in styles.items()},
+    )
+
+
+ALLOWED_TAGS, ALLOWED_ATTRIBUTES, ALLOWED_STYLES = editor_allowlist(getattr(settings, "CKEDITOR_5_CONFIGS", {}))
+# Теги, которые удаляются вместе с содержимым; остальные теги не из списка заменяются содержимым
+DROPPED_TAGS = frozenset({
+    "script", "style", "iframe", "frame", "object", "embed", "template", "noscript",
+    "form", "textarea", "select", "button", "svg", "math", "head", "title", "meta", "link",
+})
+URL_ATTRIBUTES = frozenset({"href", "src", "url"})
+ALLOWED_SCHEMES = frozenset({"http", "https", "mailto", "tel"})
+# Функции в значениях style: цвета из палитры редактора. url(), expression() и прочие не пропускаются
+STYLE_FUNCTIONS = frozenset({"rgb", "rgba", "hsl", "hsla"})
+
+# Классы CKEditor (image, image-style-side, language-python): только буквы, цифры, дефис и подчёркивание
+_CLASS_RE = re.compile(r"^[a-z][\w-]*$", re.IGNORECASE)
+# Значение свойства style: "1px solid hsl(0, 0%, 0%)", "'Courier New', Courier, monospace", "800/600"
+_STYLE_VALUE_RE = re.compile(r"^[\w\s#%.,'\"()+/-]+$")
+_STYLE_FUNCTION_RE = re.compile(r"([\w-]*)\s*\(")
+_SCHEME_RE = re.compile(r"^([a-z][a-z0-9+.\-]*):", re.IGNORECASE)
+# Управляющие символы и пробелы, которыми прячут схему: "java\tscript:"
+_URL_NOISE_RE = re.compile(r"[\x00-\x20\x7f]+")
+_SIZE_RE = re.compile(r"^\d{1,5}$")
+
+
+def _is_safe_url(url: str) -> bool:
+    match = _SCHEME_RE.match(_URL_NOISE_RE.sub("", url))
+    return match is None or match.group(1).lower() in ALLOWED_SCHEMES
+
+
+def _is_safe_style_value(value: str) -> bool:
+    return bool(_STYLE_VALUE_RE.match(value)) and all(
+        name.lower() in STYLE_FUNCTIONS for name in _STYLE_FUNCTION_RE.findall(value)
+    )
+
+
+def _clean_style(tag: Tag, value: str) -> str:
+    """Оставляет в style только разрешённые для тега свойства с безопасными значениями"""
+    allowed = ALLOWED_STYLES.get(tag.name, ())
+    declarations = []
+    for declaration in value.split(";"):
+        name, _, style_value = declaration.partition(":")
+        name, style_value = name.strip().lower(), style_value.strip()
+        if name in allowed and style_value and _is_safe_style_value(style_value):
+            declarations.append(f"{name}:{style_value};")
+    return "".join(declarations)
+
+
+def _clean_attributes(tag: Tag) -> None:
+    allowed = ALLOWED_ATTRIBUTES.get(tag.name, ())
+    for name, value in list(tag.attrs.items()):
+        if name == "class":
+            classes = [cls for cls in value if _CLASS_RE.match(cls)]
+            if classes:
+                tag["class"] = classes
+            else:
+                del tag["class"]
+        elif name == "style" and name in allowed:
+            style = _clean_style(tag, value)
+            if style:
+                tag["style"] = style
+            else:
+                del tag["style"]
+        elif (
+            name not in allowed
+            or (name in URL_ATTRIBUTES and not _is_safe_url(value))
+            or (name in ("width", "height") and not _SIZE_RE.match(value))
+        ):
+            del tag[name]
+
+    if tag.name == "a":
+        if tag.get("target") == "_blank":
+            tag["rel"] = "noopener noreferrer"
+        elif "target" in tag.attrs:
+            del tag["target"]
+
+
+def sanitize(soup: BeautifulSoup) -> None:
+    # Комментарии, CDATA, <!DOCTYPE>, <!...> и <?...?>: html.parser выводит их содержимое как есть,
+    # а браузер закрывает такой узел на первом ">", и разметка после него исполняется
+    for node in soup.find_all(string=lambda text: isinstance(text, PreformattedString)):
+        node.extract()
+    for tag in soup.find_all(True):
+        if tag.decomposed:
+            # Потомок тега, уже удалённого вместе с содержимым
+            continue
+        if tag.name in DROPPED_TAGS:
+            tag.decompose()
+        elif tag.name == "input" and tag.get("type") != "checkbox":
+            # Из полей ввода редактор выводит только флажки списка задач
+            tag.decompose()
+        elif tag.name not in ALLOWED_TAGS:
+            tag.unwrap()
+        else:
+            _clean_attributes(tag)
+
+
+###################################
+#   Нормализация                  #
+###################################
+
+def _is_blank(tag: Tag) -> bool:
+    return not tag.get_text().replace("\xa0", " ").strip() and tag.find(("img", "br", "hr")) is None
+
+
+def remove_empty_blocks(soup: BeautifulSoup) -> None:
+    """Убирает пустые абзацы и заголовки (<p>&nbsp;</p>), которые CKEditor оставляет вместо отступов"""
+    for tag in soup.find_all(("p", "h1", "h2", "h3", "h4", "h5", "h6")):
+        if _is_blank(tag):
+            tag.decompose()
+
+
+def _image_size(src: str) -> tuple[int, int] | None:
+    """Размеры загруженной картинки по её URL; для внешних картинок - None"""
+    # Импорт здесь: notes.images зависит от notes.caching, а тот - от моделей, которые импортируют этот модуль
+    from .images import media_name
+
+    name = media_name(src)
+    if not name:
+        return None
+    try:
+        with default_storage.open(name) as file:
+            width, height = get_image_dimensions(file)
+    except (OSError, ValueError) as e:
+        logger.warning("Не удалось прочитать размеры картинки %s: %s", name, e)
+        return None
+    return (width, height) if width and height else None
+
+
+def prepare_images(soup: BeautifulSoup) -> None:
+    """
+    Ленивую загрузку и размеры получают все картинки текста: с width и height браузер
+    резервирует место заранее, и страница не сдвигается при загрузке.
+    """
+    for img in soup.find_all("img"):
+        img["loading"] = "lazy"
+        img["decoding"] = "async"
+        if "alt" not in img.attrs:
+            img["alt"] = ""
+        if not (img.get("width") and img.get("height")):
+            size = _image_size(img.get("src", ""))
+            if size:
+                img["width"], img["height"] = map(str, size)
+
+
+def highlight_code(soup: BeautifulSoup) -> None:
+    """
+    Подсвечивает <pre><code class="language-..."> (формат блоков кода CKEditor) со стилями в атрибутах,
+    чтобы не подключать отдельную таблицу стилей. Выполняется после очистки: style в span от Pygments
+    белый список не пропустил бы.
+    """
+    if highlight is None:
+        return
+    formatter = HtmlFormatter(nowrap=True, noclasses=True)
+    for code in soup.select("pre > code[class]"):
+        language = next((cls[9:] for cls in code["class"] if cls.startswith("language-")), "")
+        if not language or language == "plaintext":
+            continue
+        try:
+            lexer = get_lexer_by_name(language)
+        except ClassNotFound:
+            continue
+        highlighted = highlight(code.get_text(), lexer, formatter)
+        code.clear()
+        code.append(BeautifulSoup(highlighted, "html.parser"))
+
+
+###################################
+#   Минификация                   #
+###################################
+
+# Теги, в которых текст между дочерними элементами ничего не значит
+CONTAINER_TAGS = frozenset({
+    "blockquote", "ul", "ol", "figure", "table", "colgroup", "thead", "tbody", "tfoot", "tr",
+})
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def minify(soup: BeautifulSoup) -> None:
+    """Схлопывает пробелы и удаляет переводы строк между блоками; содержимое <pre> не меняется"""
+    for text in soup.find_all(string=True):
+        if text.find_parent("pre") is not None:
+            continue
+        collapsed = _WHITESPACE_RE.sub(" ", text)
+        if not collapsed.strip() and (text.parent is soup or text.parent.name in CONTAINER_TAGS):
+            text.extract()
+        elif collapsed != text:
+            text.replace_with(NavigableString(collapsed))
+
+
+def render_content(html: str | None) -> str:
+    """Готовый к выводу HTML текста статьи"""
+    if not html or not html.strip():
+        return ""
+    soup = BeautifulSoup(html, "html.parser")
+    sanitize(soup)
+    remove_empty_blocks(soup)
+    prepare_images(soup)
+    highlight_code(soup)
+    minify(soup)
+    return soup.decode(formatter="minimal").strip()
@@ -0,0 +1,51 @@
+from typing import Iterable
+
+from django.db.models import Count, Max, OuterRef, Subquery, QuerySet
+from django.db.models.functions import Coalesce
+
+from .models import Note, Category, TagPost, Comment
+
+
+def recount_categories(pks: Iterable[int] | None = None) -> int:
+    """
+    Пересчитывает Category.published_count одним UPDATE с подзапросом.
+    Без pks пересчитываются все категории.
+    """
+    published = (
+        Note.published.filter(cat=OuterRef("pk"))
+        .order_by().values("cat").annotate(total=Count("pk")).values("total")
+    )
+    categories = Category.objects.all() if pks is None else Category.objects.filter(pk__in=set(pks))
+    return categories.update(published_count=Coalesce(Subquery(published), 0))
+
+
+def recount_tags(pks: Iterable[int] | None = None) -> int:
+    """
+    Пересчитывает TagPost.published_count одним UPDATE с подзапросом.
+    Без pks пересчитываются все метки.
+    """
+    published = (
+        Note.tags.through.objects.filter(tagpost=OuterRef("pk"), note__status=Note.Status.PUBLISHED)
+        .order_by().values("tagpost").annotate(total=Count("pk")).values("total")
+    )
+    tags = TagPost.objects.all() if pks is None else TagPost.objects.filter(pk__in=set(pks))
+    return tags.update(published_count=Coalesce(Subquery(published), 0))
+
+
+def recount_for_notes(notes: QuerySet) -> None:
+    """Пересчёт счётчиков категорий и меток, к которым относятся статьи (для массовых операций)"""
+    recount_categories(notes.values_list("cat", flat=True))
+    recount_tags(Note.tags.through.objects.filter(note__in=notes).values_list("tagpost", flat=True))
+
+
+def recount_comments(pks: Iterable[int] | None = None) -> int:
+    """
+    Пересчитывает Note.comment_count и Note.last_comment_at по одобренным комментариям
+    одним UPDATE с подзапросами. Без pks пересчитываются все статьи.
+    """
+    active = Comment.objects.filter(post=OuterRef("pk"), status=Comment.Status.ACTIVE).order_by().values("post")
+    notes = Note.objects.all() if pks is None else Note.objects.filter(pk__in=set(pks))
+    return notes.update(
+        comment_count=Coalesce(Subquery(active.annotate(total=Count("pk")).values("total")), 0),
+        last_comment_at=Subquery(active.annotate(last=Max("created")).values("last")),
+    )
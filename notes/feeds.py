@@ -0,0 +1,160 @@
+"""
+RSS и Atom ленты: общая, по категории и по метке.
+
+Готовый XML ленты хранится в кеше и перестраивается только после изменения статей,
+категорий или меток (ключи включают версию содержимого CONTENT_VERSION_KEY, которую сбрасывают сигналы).
+Ответы отдаются с ETag и Last-Modified, поэтому опрашивающие клиенты чаще всего получают 304.
+"""
+import hashlib
+from typing import Callable
+
+from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.db.models import QuerySet
+from django.http import HttpRequest, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse_lazy
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .caching import CACHE_TTL, content_version, feed_key
+from .models import Note, Category, TagPost
+
+FEED_ITEMS = 20
+FEED_CACHE_CONTROL = "public, max-age=300"
+
+
+class LatestNotesFeed(Feed):
+    feed_type = Rss201rev2Feed
+    link = reverse_lazy("home")
+
+    def title(self, obj=None) -> str:
+        return "choocha.ru"
+
+    def description(self, obj=None) -> str:
+        return "Новые статьи на choocha.ru"
+
+    def get_notes(self, obj=None) -> QuerySet:
+        return Note.published.all()
+
+    def items(self, obj=None) -> QuerySet:
+        return (
+            self.get_notes(obj)
+            .select_related("cat", "author")
+            .only("title", "slug", "content_short_html", "time_create", "time_update", "cat__name", "author__username")
+            .order_by("-time_create")[:FEED_ITEMS]
+        )
+
+    def item_title(self, item: Note) -> str:
+        return item.title
+
+    def item_description(self, item: Note) -> str:
+        return item.content_short_html
+
+    def item_pubdate(self, item: Note):
+        return item.time_create
+
+    def item_updateddate(self, item: Note):
+        return item.time_update
+
+    def item_author_name(self, item: Note) -> str | None:
+        return item.author.username if item.author else None
+
+    def item_categories(self, item: Note) -> list[str]:
+        return [item.cat.name]
+
+
+class CategoryFeed(LatestNotesFeed):
+    def get_object(self, request: HttpRequest, cat_slug: str) -> Category:
+        return get_object_or_404(Category, slug=cat_slug)
+
+    def title(self, obj: Category) -> str:
+        return f"choocha.ru: {obj.name}"
+
+    def link(self, obj: Category) -> str:
+        return obj.get_absolute_url()
+
+    def description(self, obj: Category) -> str:
+        return f"Новые статьи из категории {obj.name}"
+
+    def get_notes(self, obj: Category) -> QuerySet:
+        return Note.published.filter(cat=obj)
+
+
+class TagFeed(LatestNotesFeed):
+    def get_object(self, request: HttpRequest, tag_slug: str) -> TagPost:
+        return get_object_or_404(TagPost, slug=tag_slug)
+
+    def title(self, obj: TagPost) -> str:
+        return f"choocha.ru: #{obj.name}"
+
+    def link(self, obj: TagPost) -> str:
+        return obj.get_absolute_url()
+
+    def description(self, obj: TagPost) -> str:
+        return f"Новые статьи с меткой {obj.name}"
+
+    def get_notes(self, obj: TagPost) -> QuerySet:
+        return Note.published.filter(tags=obj)
+
+
+class AtomFeedMixin:
+    feed_type = Atom1Feed
+
+    def subtitle(self, obj=None) -> str:
+        return self.description(obj)
+
+
+class LatestNotesAtomFeed(AtomFeedMixin, LatestNotesFeed):
+    pass
+
+
+class CategoryAtomFeed(AtomFeedMixin, CategoryFeed):
+    pass
+
+
+class TagAtomFeed(AtomFeedMixin, TagFeed):
+    pass
+
+
+###################################
+#      Кеширование лент           #
+###################################
+
+def _render(feed: Feed, request: HttpRequest, kwargs: dict) -> dict:
+    response = feed(request, **kwargs)
+    return {
+        "content": response.content,
+        "content_type": response["Content-Type"],
+        "etag": f'"{hashlib.md5(response.content, usedforsecurity=False).hexdigest()}"',
+        # Лента строится только после изменений, поэтому момент построения - время её изменения
+        "last_modified": int(timezone.now().timestamp()),
+    }
+
+
+def cached_feed(feed: Feed) -> Callable[..., HttpResponse]:
+    """Представление, которое отдаёт ленту из кеша и отвечает 304 на условные запросы"""
+
+    @require_safe
+    def view(request: HttpRequest, **kwargs) -> HttpResponse:
+        key = feed_key(type(feed).__name__, content_version(), *kwargs.values())
+        rendered = cache.get(key)
+        if rendered is None:
+            # Http404 для несуществующей категории или метки пробрасывается и не кешируется
+            rendered = _render(feed, request, kwargs)
+            cache.set(key, rendered, CACHE_TTL)
+
+        response = get_conditional_response(
+            request, etag=rendered["etag"], last_modified=rendered["last_modified"],
+        )
+        if response is None:
+            response = HttpResponse(rendered["content"], content_type=rendered["content_type"])
+        response["ETag"] = rendered["etag"]
+        response["Last-Modified"] = http_date(rendered["last_modified"])
+        response["Cache-Control"] = FEED_CACHE_CONTROL
+        return response
+
+    return view
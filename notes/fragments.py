@@ -0,0 +1,62 @@
+"""
+Кеш отрендеренных фрагментов страницы статьи.
+
+Кешируется только та часть разметки, которая одинакова для всех посетителей: текст статьи
+и шапка/текст каждого комментария. Кнопки действий зависят от прав пользователя и
+выводятся шаблоном вокруг кешированных фрагментов, поэтому кеш работает и для авторизованных.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe, SafeString
+
+from . import images
+from .content import CONTENT_PIPELINE_VERSION
+from .caching import CACHE_TTL, post_body_key, comment_html_key
+from .models import Note, Comment
+
+
+def _version(*parts: object) -> str:
+    return hashlib.md5(":".join(map(str, parts)).encode(), usedforsecurity=False).hexdigest()
+
+
+def post_body_version(post: Note) -> str:
+    # Поколение копий картинок меняется, когда для загрузок из текста появились уменьшенные копии.
+    # Версия обработки меняется вместе с правилами render_content, после которых HTML статей пересчитывается
+    return _version(post.time_update.timestamp(), images.generation(), CONTENT_PIPELINE_VERSION)
+
+
+def comment_version(comment: Comment) -> str:
+    # Аватар хранится у пользователя, поэтому его имя файла тоже входит в версию
+    return _version(comment.updated.timestamp(), comment.status, comment.user.photo.name or "")
+
+
+def render_post_body(post: Note) -> SafeString:
+    """
+    Возвращает HTML текста статьи. При попадании в кеш content_full_html не читается из БД вовсе,
+    поэтому в ShowPost поле загружается отложенно.
+    """
+    key = post_body_key(post.pk, post_body_version(post))
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string("notes/post_body.html", {"post": post})
+        cache.set(key, html, CACHE_TTL)
+    return mark_safe(html)
+
+
+def attach_comment_html(comments: list[Comment]) -> None:
+    """
+    Добавляет комментариям атрибут html с общей для всех частью разметки.
+    Фрагменты читаются из кеша одним get_many, недостающие рендерятся и сохраняются одним set_many.
+    """
+    keys = {comment.pk: comment_html_key(comment.pk, comment_version(comment)) for comment in comments}
+    cached = cache.get_many(keys.values())
+    missing = {}
+    for comment in comments:
+        html = cached.get(keys[comment.pk])
+        if html is None:
+            html = missing[keys[comment.pk]] = render_to_string("notes/comment_body.html", {"comment": comment})
+        comment.html = mark_safe(html)
+    if missing:
+        cache.set_many(missing, CACHE_TTL)
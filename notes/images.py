@@ -0,0 +1,202 @@
+"""
+Уменьшенные копии изображений (WebP, AVIF) фиксированной ширины для srcset.
+
+Копии создаёт фоновый обработчик (manage.py generate_image_derivatives) и сохраняет в каталог
+derivatives/ под детерминированными именами: images/2025/01/02/photo.jpg ->
+derivatives/images/2025/01/02/photo-w640.webp. Повторная обработка ничего не пересоздаёт,
+а шаблону для построения srcset достаточно имени оригинала.
+"""
+import io
+import logging
+import posixpath
+import re
+from urllib.parse import unquote, urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, Storage
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe, SafeString
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .caching import CACHE_TTL, IMAGE_GENERATION_KEY, image_derivatives_key
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = "derivatives"
+DERIVATIVE_WIDTHS = (320, 640, 1024)
+# (формат Pillow, расширение, MIME-тип, качество) в порядке предпочтения: браузер берёт первый подходящий <source>
+DERIVATIVE_FORMATS = (
+    ("AVIF", "avif", "image/avif", 50),
+    ("WEBP", "webp", "image/webp", 80),
+)
+DEFAULT_SIZES = "(max-width: 1024px) 100vw, 1024px"
+
+# GIF не обрабатываются: копия потеряла бы анимацию
+SOURCE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+# EXIF-ориентации с поворотом на 90°, при которых ширина и высота меняются местами
+ORIENTATION_TAG = 0x0112
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Пока копий нет, пустой результат кешируется ненадолго
+EMPTY_CACHE_TTL = 60 * 10
+
+_DERIVATIVE_RE = re.compile(r"^(?P<stem>.+)-w(?P<width>\d+)\.(?P<ext>[a-z]+)$")
+_IMG_RE = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+_SRC_RE = re.compile(r"""\bsrc\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+
+
+def supported_formats() -> list[tuple[str, str, str, int]]:
+    """Форматы, которые умеет сохранять установленная сборка Pillow (AVIF есть не везде)"""
+    Image.init()
+    return [fmt for fmt in DERIVATIVE_FORMATS if fmt[0] in Image.SAVE]
+
+
+def derivative_name(name: str, width: int, ext: str) -> str:
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(DERIVATIVES_DIR, directory, f"{stem}-w{width}.{ext}")
+
+
+def _scan(name: str, storage: Storage) -> list[tuple[str, int, str]]:
+    """Готовые копии изображения на диске: (расширение, ширина, имя файла)"""
+    directory, filename = posixpath.split(name)
+    derivatives_dir = posixpath.join(DERIVATIVES_DIR, directory)
+    stem = posixpath.splitext(filename)[0]
+    try:
+        _, files = storage.listdir(derivatives_dir)
+    except FileNotFoundError:
+        return []
+    found = []
+    for file in files:
+        match = _DERIVATIVE_RE.match(file)
+        if match and match["stem"] == stem:
+            found.append((match["ext"], int(match["width"]), posixpath.join(derivatives_dir, file)))
+    return sorted(found)
+
+
+def available_derivatives(name: str, storage: Storage = default_storage) -> list[tuple[str, int, str]]:
+    key = image_derivatives_key(name)
+    derivatives = cache.get(key)
+    if derivatives is None:
+        derivatives = _scan(name, storage)
+        cache.set(key, derivatives, CACHE_TTL if derivatives else EMPTY_CACHE_TTL)
+    return derivatives
+
+
+def generate_derivatives(name: str, storage: Storage = default_storage) -> list[str]:
+    """
+    Создаёт недостающие копии изображения для всех ширин и форматов.
+    Ширины больше оригинала заменяются шириной оригинала. Возвращает имена созданных файлов.
+    """
+    if posixpath.splitext(name)[1].lower() not in SOURCE_EXTENSIONS:
+        return []
+    formats = supported_formats()
+    existing = {(ext, width) for ext, width, _ in _scan(name, storage)}
+
+    try:
+        with storage.open(name, "rb") as f:
+            original = Image.open(f)
+            # Размер и ориентация читаются из заголовка, без декодирования пикселей
+            width, height = original.size
+            if original.getexif().get(ORIENTATION_TAG) in ROTATED_ORIENTATIONS:
+                width, height = height, width
+            widths = sorted({min(target, width) for target in DERIVATIVE_WIDTHS})
+            missing = [(w, fmt) for w in widths for fmt in formats if (fmt[1], w) not in existing]
+            if not missing:
+                return []
+            original.load()
+    except (FileNotFoundError, UnidentifiedImageError, OSError) as e:
+        logger.warning("Не удалось открыть изображение %s: %s", name, e)
+        return []
+
+    image = ImageOps.exif_transpose(original)
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    created, resized = [], {}
+    for target_width, (pillow_format, ext, _, quality) in missing:
+        if target_width not in resized:
+            target_height = max(1, round(image.height * target_width / image.width))
+            resized[target_width] = (
+                image if target_width == image.width
+                else image.resize((target_width, target_height), Image.Resampling.LANCZOS)
+            )
+        buffer = io.BytesIO()
+        resized[target_width].save(buffer, pillow_format, quality=quality)
+        created.append(storage.save(derivative_name(name, target_width, ext), ContentFile(buffer.getvalue())))
+
+    if created:
+        cache.set(image_derivatives_key(name), _scan(name, storage), CACHE_TTL)
+    return created
+
+
+def bump_generation() -> None:
+    """Сбрасывает кешированные фрагменты статей, чтобы в них попали новые копии картинок из текста"""
+    try:
+        cache.incr(IMAGE_GENERATION_KEY)
+    except ValueError:
+        cache.set(IMAGE_GENERATION_KEY, 1, None)
+
+
+def generation() -> int:
+    return cache.get(IMAGE_GENERATION_KEY, 0)
+
+
+###################################
+#      Разметка <picture>         #
+###################################
+
+def media_name(url: str) -> str | None:
+    """Имя файла в хранилище по его URL или None, если URL не указывает в MEDIA_URL"""
+    path = unquote(urlparse(url).path)
+    prefix = urlparse(settings.MEDIA_URL).path
+    if not prefix.startswith("/"):
+        prefix = "/" + prefix
+    if not path.startswith(prefix):
+        return None
+    name = posixpath.normpath(path[len(prefix):])
+    return None if name.startswith("..") or name == "." else name
+
+
+def content_image_names(html: str) -> list[str]:
+    """Имена загруженных файлов, на которые ссылаются <img> в HTML статьи"""
+    names = []
+    for tag in _IMG_RE.findall(html or ""):
+        src = _SRC_RE.search(tag)
+        name = media_name(src.group(1)) if src else None
+        if name:
+            names.append(name)
+    return names
+
+
+def picture(name: str, img_tag: str, sizes: str = DEFAULT_SIZES) -> SafeString:
+    """
+    Оборачивает готовый тег <img> в <picture> с <source> для каждого формата копий.
+    Если копий ещё нет, возвращает <img> как есть.
+    """
+    derivatives = available_derivatives(name)
+    if not derivatives:
+        return mark_safe(img_tag)
+    sources = []
+    for _, ext, mime, _ in DERIVATIVE_FORMATS:
+        srcset = ", ".join(
+            f"{default_storage.url(file)} {width}w" for file_ext, width, file in derivatives if file_ext == ext
+        )
+        if srcset:
+            sources.append(format_html('<source type="{}" srcset="{}" sizes="{}">', mime, srcset, sizes))
+    return mark_safe(f"<picture>{''.join(sources)}{img_tag}</picture>")
+
+
+def responsive_content(html: str) -> str:
+    """Добавляет <picture> вокруг картинок из MEDIA_ROOT в HTML статьи (загрузки CKEditor)"""
+
+    def replace(match: re.Match) -> str:
+        src = _SRC_RE.search(match.group(0))
+        name = media_name(src.group(1)) if src else None
+        return picture(name, match.group(0)) if name else match.group(0)
+
+    return _IMG_RE.sub(replace, html or "")
@@ -0,0 +1,133 @@
+"""
+Очередь исходящей почты.
+
+Запрос только сохраняет письмо в таблицу OutgoingEmail, а отправку выполняет
+фоновый обработчик (manage.py send_queued_mail) пачками через одно SMTP-соединение.
+При EMAIL_QUEUE_EAGER=True письмо отправляется сразу после фиксации транзакции -
+для разработки и тестов (совместимо с locmem-бэкендом и mail.outbox).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from choocha.instrumentation import timed
+from choocha.metrics import observe_mail
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 60  # секунд; задержка удваивается с каждой попыткой
+RETRY_MAX_DELAY = 60 * 60
+# Срок, на который обработчик забирает пачку. Если он упал, не закончив, письма после этого срока
+# забирает другой обработчик (часть из них может уйти повторно). Должен быть больше, чем отправка
+# пачки с учётом таймаутов SMTP (EMAIL_TIMEOUT)
+SEND_LEASE = timedelta(minutes=10)
+
+
+def enqueue_email(subject: str, body: str, recipients: list[str], from_email: str | None = None) -> OutgoingEmail:
+    """Ставит письмо в очередь на отправку"""
+    email = OutgoingEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL or '',
+        recipients=list(recipients),
+    )
+    if getattr(settings, 'EMAIL_QUEUE_EAGER', False):
+        transaction.on_commit(lambda: deliver([email]))
+    return email
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY))
+
+
+def deliver(emails: list[OutgoingEmail]) -> int:
+    """
+    Отправляет письма через одно соединение с почтовым сервером.
+    Неудачные попытки откладываются с экспоненциальной задержкой, после MAX_ATTEMPTS письмо помечается ошибочным.
+    Возвращает количество отправленных писем.
+    """
+    if not emails:
+        return 0
+    sent = 0
+    now = timezone.now()
+    try:
+        connection = get_connection(fail_silently=False)
+        connection.open()
+    except Exception as e:
+        logger.warning('Не удалось подключиться к почтовому серверу: %s', e)
+        for email in emails:
+            _mark_failed(email, e, now)
+        return 0
+
+    try:
+        for email in emails:
+            message = EmailMessage(
+                subject=email.subject,
+                body=email.body,
+                from_email=email.from_email or None,
+                to=email.recipients,
+                connection=connection,
+            )
+            try:
+                with timed("mail"):
+                    message.send()
+            except Exception as e:
+                logger.warning('Ошибка отправки письма #%s: %s', email.pk, e)
+                _mark_failed(email, e, now)
+            else:
+                sent += 1
+                observe_mail("sent")
+                email.status = OutgoingEmail.Status.SENT
+                email.attempts += 1
+                email.sent_at = now
+                email.last_error = ''
+                email.save(update_fields=['status', 'attempts', 'sent_at', 'last_error'])
+    finally:
+        connection.close()
+    return sent
+
+
+def _mark_failed(email: OutgoingEmail, error: Exception, now) -> None:
+    email.attempts += 1
+    email.last_error = str(error)[:1000]
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutgoingEmail.Status.FAILED
+        observe_mail("failed")
+    else:
+        email.status = OutgoingEmail.Status.PENDING
+        email.next_attempt_at = now + retry_delay(email.attempts)
+        observe_mail("retry")
+    email.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at'])
+
+
+def claim(batch_size: int) -> list[OutgoingEmail]:
+    """
+    Забирает пачку писем, время отправки которых наступило (и писем упавшего обработчика с истёкшим сроком),
+    помечая их SENDING на SEND_LEASE. Транзакция короткая: строки заблокированы только на время пометки,
+    а select_for_update(skip_locked=True) позволяет нескольким обработчикам не ждать друг друга.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(
+                status__in=(OutgoingEmail.Status.PENDING, OutgoingEmail.Status.SENDING),
+                next_attempt_at__lte=now,
+            )
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status=OutgoingEmail.Status.SENDING, next_attempt_at=now + SEND_LEASE,
+        )
+    return emails
+
+
+def deliver_pending(batch_size: int = 50) -> int:
+    """Забирает пачку писем и отправляет её вне транзакции: SMTP не держит блокировки строк"""
+    return deliver(claim(batch_size))
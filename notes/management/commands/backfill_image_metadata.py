@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    help = 'Заполняет размеры, объём и хеш изображений статей (читает файлы изображений)'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--force', action='store_true', help='Пересчитать и уже заполненные сведения')
+
+    def handle(self, *args, **options) -> None:
+        batch_size = options['batch_size']
+        notes = Note.objects.exclude(image='').exclude(image__isnull=True).only('image', *Note.image_fields)
+        if not options['force']:
+            notes = notes.filter(image_hash='')
+
+        batch, updated, missing = [], 0, 0
+        for note in notes.order_by('pk').iterator(chunk_size=batch_size):
+            try:
+                note.refresh_image_metadata(force=True)
+            except FileNotFoundError:
+                missing += 1
+                self.stderr.write(f'Нет файла изображения у статьи {note.pk}: {note.image.name}')
+                continue
+            batch.append(note)
+            if len(batch) >= batch_size:
+                # bulk_update не трогает time_update и не отправляет сигналы
+                updated += Note.objects.bulk_update(batch, Note.image_fields)
+                batch = []
+        if batch:
+            updated += Note.objects.bulk_update(batch, Note.image_fields)
+
+        self.stdout.write(self.style.SUCCESS(f'Обновлено статей: {updated}, без файла: {missing}'))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.caching import invalidate_notes
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает вычисляемые поля статей (описание для метатегов, текст для поиска, HTML для вывода)'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            '--fields', nargs='+', default=list(Note.derived_fields),
+            help=f'Поля для пересчёта: {", ".join(Note.derived_fields)}',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options) -> None:
+        fields = options['fields']
+        unknown = set(fields) - set(Note.derived_fields)
+        if unknown:
+            raise CommandError(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+
+        batch_size = options['batch_size']
+        # Читаются и пересчитываются только нужные колонки: HTML для вывода, например,
+        # строится дольше остальных и открывает файлы картинок
+        sources = {source for field in fields for source in Note.derived_field_sources[field]}
+        notes = Note.objects.only(*sources, *fields).order_by('pk')
+        batch, updated = [], 0
+        for note in notes.iterator(chunk_size=batch_size):
+            old_values = [getattr(note, field) for field in fields]
+            note.refresh_derived_fields(fields)
+            if old_values != [getattr(note, field) for field in fields]:
+                batch.append(note)
+            if len(batch) >= batch_size:
+                updated += self.save(batch, fields)
+                batch = []
+        if batch:
+            updated += self.save(batch, fields)
+
+        self.stdout.write(self.style.SUCCESS(f'Обновлено статей: {updated}'))
+
+    @staticmethod
+    def save(notes: list[Note], fields: list[str]) -> int:
+        # bulk_update не трогает time_update и не отправляет сигналы, поэтому кеши с этими статьями
+        # (снимки строк списков, ленты, ответы API) сбрасываются здесь
+        updated = Note.objects.bulk_update(notes, fields)
+        invalidate_notes(Note.objects.filter(pk__in=[note.pk for note in notes]))
+        return updated
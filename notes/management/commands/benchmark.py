@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.benchmarks import MODES, compare, load_baseline, over_budget, run_benchmarks, save_baseline
+
+
+class Command(BaseCommand):
+    help = 'Замеряет запросы, время и память публичных страниц; падает при росте числа запросов'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--scenario', action='append', dest='scenarios', help='Только указанные сценарии')
+        parser.add_argument('--mode', action='append', dest='modes', choices=MODES, help='cold и/или warm')
+        parser.add_argument('--baseline', type=Path, help='Сравнить с сохранённым прогоном (JSON)')
+        parser.add_argument('--save-baseline', type=Path, help='Сохранить результаты как базовый прогон')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимый рост времени и памяти')
+        parser.add_argument('--force', action='store_true', help='Разрешить запуск при DEBUG = False')
+
+    def handle(self, *args, **options) -> None:
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Замеры очищают кеш. Запустите с --force, если это стенд')
+        try:
+            results = run_benchmarks(options['iterations'], options['scenarios'], options['modes'] or MODES)
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.stdout.write(f'{"сценарий":<20}{"запросов":>10}{"p50, мс":>10}{"p95, мс":>10}{"пик, КиБ":>12}')
+        for key, result in results.items():
+            self.stdout.write(
+                f'{key:<20}{result["queries"]:>10}{result["p50_ms"]:>10}{result["p95_ms"]:>10}{result["peak_kib"]:>12}'
+            )
+
+        problems = over_budget(results)
+        if options['baseline']:
+            regressions, warnings = compare(results, load_baseline(options['baseline']), options['tolerance'])
+            problems += regressions
+            for warning in warnings:
+                self.stdout.write(self.style.WARNING(warning))
+        if options['save_baseline']:
+            save_baseline(options['save_baseline'], results)
+            self.stdout.write(f'Базовый прогон сохранён в {options["save_baseline"]}')
+        if problems:
+            raise CommandError('Рост числа запросов:\n' + '\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS('Бюджеты запросов соблюдены'))
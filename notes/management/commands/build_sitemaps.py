@@ -0,0 +1,42 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from notes.sitemaps import refresh_sitemaps
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Строит файлы карты сайта (устаревшие разделы или все с --force)'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--force', action='store_true', help='Перестроить все разделы')
+        parser.add_argument(
+            '--interval', type=float,
+            help='Работать постоянно, проверяя разделы с этой паузой, сек (без него - один проход)',
+        )
+
+    def handle(self, *args, **options) -> None:
+        if options['interval'] is None:
+            if refresh_sitemaps(force=options['force']):
+                self.stdout.write(self.style.SUCCESS('Карта сайта построена'))
+            else:
+                self.stdout.write(self.style.WARNING('Карту сайта уже строит другой процесс'))
+            return
+
+        force = options['force']
+        while True:
+            try:
+                # Актуальные разделы пропускаются, так что частый проход почти ничего не стоит
+                refresh_sitemaps(force=force)
+            except DatabaseError as e:
+                # Обработчик продолжает работу: на следующем проходе соединение будет открыто заново
+                logger.warning('Ошибка базы данных при построении карты сайта: %s', e)
+            else:
+                force = False
+            time.sleep(options['interval'])
+            # Как между запросами: соединение, оборванное сервером или старше CONN_MAX_AGE, открывается заново
+            close_old_connections()
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.benchmarks import generate_data
+
+
+class Command(BaseCommand):
+    help = 'Наполняет базу статьями, метками и комментариями для нагрузочных замеров (manage.py benchmark)'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--notes', type=int, default=10000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--tags-per-note', type=int, default=3)
+        parser.add_argument('--comments-per-note', type=int, default=5)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0, help='Другой seed добавляет ещё один набор данных')
+        parser.add_argument('--force', action='store_true', help='Разрешить запуск при DEBUG = False')
+
+    def handle(self, *args, **options) -> None:
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('Похоже на боевую базу (DEBUG = False). Запустите с --force, если это стенд')
+        generate_data(
+            notes=options['notes'],
+            categories=options['categories'],
+            tags=options['tags'],
+            tags_per_note=options['tags_per_note'],
+            comments_per_note=options['comments_per_note'],
+            users=options['users'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS('Данные для замеров созданы'))
@@ -0,0 +1,65 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from notes.images import generate_derivatives, content_image_names, bump_generation
+from notes.models import Note
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии (WebP/AVIF) изображений статей и картинок из их текста'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--interval', type=float, default=60.0, help='Пауза между проверками статей, сек')
+        parser.add_argument('--once', action='store_true', help='Обработать все статьи один раз и завершиться')
+
+    def handle(self, *args, **options) -> None:
+        since = None
+        while True:
+            started = timezone.now()
+            try:
+                created = self.process(since)
+            except DatabaseError as e:
+                if options['once']:
+                    raise
+                # Проход повторится с той же отметки времени и новым соединением
+                logger.warning('Ошибка базы данных при обработке изображений: %s', e)
+            else:
+                if created:
+                    self.stdout.write(self.style.SUCCESS(f'Создано копий изображений: {created}'))
+                # Первый проход - по всем статьям, дальше только по изменённым
+                since = started
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+            # Как между запросами: соединение, оборванное сервером или старше CONN_MAX_AGE, открывается заново
+            close_old_connections()
+
+    @staticmethod
+    def generate(name: str) -> int:
+        """Одно повреждённое изображение не должно останавливать обработчик"""
+        try:
+            return len(generate_derivatives(name))
+        except Exception:
+            logger.exception('Не удалось создать копии изображения %s', name)
+            return 0
+
+    def process(self, since) -> int:
+        notes = Note.objects.only('image', 'content_short', 'content_full').order_by('pk')
+        if since is not None:
+            notes = notes.filter(time_update__gte=since)
+
+        created = content_created = 0
+        for note in notes.iterator():
+            if note.image:
+                created += self.generate(note.image.name)
+            for name in {*content_image_names(note.content_short), *content_image_names(note.content_full)}:
+                content_created += self.generate(name)
+        if content_created:
+            bump_generation()
+        return created + content_created
@@ -0,0 +1,20 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from notes.search import FTS_TABLE
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает плоский текст статей и перестраивает полнотекстовый индекс'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options) -> None:
+        call_command(
+            'backfill_note_fields', fields=['search_text'], batch_size=options['batch_size'], stdout=self.stdout
+        )
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from notes.caching import invalidate, sidebar_keys
+from notes.counters import recount_categories, recount_tags
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает количество опубликованных статей в категориях и метках'
+
+    def handle(self, *args, **options) -> None:
+        with transaction.atomic():
+            categories = recount_categories()
+            tags = recount_tags()
+            invalidate(sidebar_keys())
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано категорий: {categories}, меток: {tags}'))
@@ -0,0 +1,37 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from notes.mail import deliver_pending
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из очереди исходящей почты'
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument('--batch-size', type=int, default=50, help='Писем за одно SMTP-соединение')
+        parser.add_argument('--interval', type=float, default=5.0, help='Пауза между проверками очереди, сек')
+        parser.add_argument('--once', action='store_true', help='Обработать очередь один раз и завершиться')
+
+    def handle(self, *args, **options) -> None:
+        batch_size = options['batch_size']
+        while True:
+            try:
+                sent = deliver_pending(batch_size)
+                # Полная пачка - вероятно, в очереди есть ещё письма, паузу не делаем
+                while sent == batch_size:
+                    sent = deliver_pending(batch_size)
+            except DatabaseError as e:
+                if options['once']:
+                    raise
+                # Обработчик продолжает работу: на следующем проходе соединение будет открыто заново
+                logger.warning('Ошибка базы данных в обработчике почты: %s', e)
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+            # Как между запросами: соединение, оборванное сервером или старше CONN_MAX_AGE, открывается заново
+            close_old_connections()
@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0008_note_meta_description'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='published_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Опубликованных статей'),
+        ),
+        migrations.AddField(
+            model_name='tagpost',
+            name='published_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='Опубликованных статей'),
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.1 on 2026-10-18 12:30
+
+import html
+import re
+
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+# Миграция не импортирует код приложения (notes.search, notes.utils): его последующие изменения
+# не должны менять то, что делает уже выпущенная миграция. Ниже - копии на момент её создания.
+
+BATCH_SIZE = 500
+SEARCH_CONFIG = 'russian'
+SEARCH_INDEX_NAME = 'notes_note_search_idx'
+FTS_TABLE = 'notes_note_fts'
+
+SQLITE_SCHEMA = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"title, search_text, content='notes_note', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON notes_note BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, search_text) VALUES (new.id, new.title, new.search_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON notes_note BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, search_text) "
+    f"VALUES ('delete', old.id, old.title, old.search_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON notes_note BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, search_text) "
+    f"VALUES ('delete', old.id, old.title, old.search_text); "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, search_text) VALUES (new.id, new.title, new.search_text); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+)
+
+SQLITE_DROP_SCHEMA = (
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_BLOCK_END_RE = re.compile(r"</(?:p|div|li|h[1-6]|blockquote|pre|tr|td|th|figcaption)>|<br\s*/?>", re.IGNORECASE)
+
+
+def html_to_text(value):
+    if not value:
+        return ''
+    text = strip_tags(_BLOCK_END_RE.sub(lambda match: match.group(0) + ' ', value))
+    return _WHITESPACE_RE.sub(' ', html.unescape(text)).strip()
+
+
+def fill_search_text(apps, schema_editor):
+    note_model = apps.get_model('notes', 'Note')
+    notes = note_model.objects.only('content_short', 'content_full').order_by('pk')
+    batch = []
+    for note in notes.iterator(chunk_size=BATCH_SIZE):
+        note.search_text = '\n'.join(filter(None, (html_to_text(note.content_short), html_to_text(note.content_full))))
+        batch.append(note)
+        if len(batch) >= BATCH_SIZE:
+            note_model.objects.bulk_update(batch, ['search_text'])
+            batch = []
+    if batch:
+        note_model.objects.bulk_update(batch, ['search_text'])
+
+
+def create_index(apps, schema_editor):
+    from django.contrib.postgres.indexes import GinIndex
+
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        vector = (
+            SearchVector('title', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('search_text', weight='B', config=SEARCH_CONFIG)
+        )
+        schema_editor.add_index(apps.get_model('notes', 'Note'), GinIndex(vector, name=SEARCH_INDEX_NAME))
+    elif vendor == 'sqlite':
+        for sql in SQLITE_SCHEMA:
+            schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {SEARCH_INDEX_NAME}')
+    elif vendor == 'sqlite':
+        for sql in SQLITE_DROP_SCHEMA:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0009_category_published_count_tagpost_published_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Текст для поиска'),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1 on 2026-10-18 13:00
+
+import html
+import re
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+# Копия notes.utils.html_to_text на момент создания миграции: код приложения не импортируется,
+# чтобы его изменения не меняли уже выпущенную миграцию
+BATCH_SIZE = 500
+_WHITESPACE_RE = re.compile(r"\s+")
+_BLOCK_END_RE = re.compile(r"</(?:p|div|li|h[1-6]|blockquote|pre|tr|td|th|figcaption)>|<br\s*/?>", re.IGNORECASE)
+
+
+def html_to_text(value):
+    if not value:
+        return ''
+    text = strip_tags(_BLOCK_END_RE.sub(lambda match: match.group(0) + ' ', value))
+    return _WHITESPACE_RE.sub(' ', html.unescape(text)).strip()
+
+
+def fill_excerpt(apps, schema_editor):
+    note_model = apps.get_model('notes', 'Note')
+    notes = note_model.objects.only('meta_description', 'content_short').order_by('pk')
+    batch = []
+    for note in notes.iterator(chunk_size=BATCH_SIZE):
+        if note.meta_description and note.meta_description.strip():
+            note.excerpt = note.meta_description.strip()[:160]
+        else:
+            note.excerpt = html_to_text(note.content_short)[:160]
+        batch.append(note)
+        if len(batch) >= BATCH_SIZE:
+            note_model.objects.bulk_update(batch, ['excerpt'])
+            batch = []
+    if batch:
+        note_model.objects.bulk_update(batch, ['excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0010_note_search_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', editable=False, max_length=160, verbose_name='Описание для метатегов'),
+        ),
+        migrations.RunPython(fill_excerpt, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0012_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64, verbose_name='SHA-256 изображения'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Высота изображения'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='image_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True, verbose_name='Размер файла изображения'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ширина изображения'),
+        ),
+    ]
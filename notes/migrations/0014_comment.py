@@ -0,0 +1,51 @@
+# Generated by Django 5.1 on 2026-10-18 16:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_table_if_missing(apps, schema_editor):
+    # До этой миграции у Comment не было миграций, и в существующих базах таблица уже есть.
+    # В новой базе она создаётся здесь - без индексов, их добавляет AddIndex ниже
+    comment_model = apps.get_model('notes', 'Comment')
+    if comment_model._meta.db_table not in schema_editor.connection.introspection.table_names():
+        schema_editor.create_model(comment_model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0013_note_image_metadata'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            # Только состояние: таблица в существующих базах уже есть
+            state_operations=[
+                migrations.CreateModel(
+                    name='Comment',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('body', models.TextField(verbose_name='Текст комментария')),
+                        ('created', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                        ('updated', models.DateTimeField(auto_now=True, verbose_name='Обновлён')),
+                        ('status', models.IntegerField(choices=[(0, 'Опубликован'), (1, 'На модерации'), (2, 'Удалён'), (3, 'Скрыт')], default=1, verbose_name='Статус комментария')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_comments', to='notes.note')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_comments', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'verbose_name': 'Комментарий',
+                        'verbose_name_plural': 'Комментарии',
+                        'ordering': ('created',),
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_table_if_missing, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'status', 'created'], name='notes_comment_thread_idx'),
+        ),
+    ]
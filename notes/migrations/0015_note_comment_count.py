@@ -0,0 +1,38 @@
+# Generated by Django 5.1 on 2026-10-18 17:05
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+ACTIVE = 0
+
+
+def recount_comments(apps, schema_editor):
+    Note = apps.get_model('notes', 'Note')
+    Comment = apps.get_model('notes', 'Comment')
+    active = Comment.objects.filter(post=OuterRef('pk'), status=ACTIVE).order_by().values('post')
+    Note.objects.update(
+        comment_count=Coalesce(Subquery(active.annotate(total=Count('pk')).values('total')), 0),
+        last_comment_at=Subquery(active.annotate(last=Max('created')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0014_comment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество комментариев'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Последний комментарий'),
+        ),
+        migrations.RunPython(recount_comments, migrations.RunPython.noop),
+    ]
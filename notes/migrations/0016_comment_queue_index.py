@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0015_note_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['status', 'created'], name='notes_comment_queue_idx'),
+        ),
+    ]
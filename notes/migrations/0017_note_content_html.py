@@ -0,0 +1,29 @@
+# Generated by Django 5.1 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+# Миграция меняет только схему. Поля заполняет обработка из notes.content, которая меняется вместе
+# с настройками редактора, поэтому ни импортировать её, ни копировать сюда нельзя. После миграции выполните
+#     python manage.py backfill_note_fields --fields content_short_html content_full_html
+# Ту же команду нужно запускать после изменений в render_content. Статьи, сохранённые после миграции,
+# получают поля сразу.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0016_comment_queue_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='content_short_html',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Краткий текст статьи (HTML для вывода)'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='content_full_html',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Полный текст статьи (HTML для вывода)'),
+        ),
+    ]
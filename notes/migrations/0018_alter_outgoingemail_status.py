@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0017_note_content_html'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outgoingemail',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Ожидает отправки'), (1, 'Отправлено'), (2, 'Ошибка отправки'), (3, 'Отправляется')], default=0, verbose_name='Статус'),
+        ),
+    ]
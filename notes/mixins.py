@@ -1,16 +1,20 @@
 from typing import Any
 
-from django.contrib.auth.mixins import AccessMixin
+from django.contrib.auth.mixins import AccessMixin, LoginRequiredMixin, UserPassesTestMixin
 from django.core.exceptions import PermissionDenied
 from django.db.models import QuerySet
-from django.http import HttpRequest
+from django.http import HttpRequest, Http404
 from django.urls import reverse
+from notes.caching import get_note_rows
 from notes.forms import CommentForm
-from notes.models import Comment
+from notes.fragments import attach_comment_html
+from notes.mail import enqueue_email
+from notes.models import Comment, Note
+from notes.pagination import (
+    CachedCountPaginator, InvalidCursor, KEYSET_ORDERING, comments_after, decode_cursor, encode_cursor, keyset_page,
+)
 import pytz
-from bs4 import BeautifulSoup
 from django.contrib import messages
-from django.core.mail import send_mail
 from django.utils import timezone
 
 from choocha import settings
@@ -34,6 +38,13 @@ class ObjectOwnershipMixin(AccessMixin):
             raise PermissionDenied("У вас нет прав на выполнение этого действия.")
 
 
+class ModeratorRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """Доступ только для модераторов (staff) и администраторов"""
+
+    def test_func(self) -> bool:
+        return self.request.user.is_staff or self.request.user.is_superuser
+
+
 class CommentMixin:
     """Общая логика для работы с комментариями"""
 
@@ -69,6 +80,38 @@ class CommentMixin:
         return is_admin
 
 
+class CommentThreadMixin:
+    """
+    Ветка комментариев статьи порциями по comments_page_size.
+    Видимость проверяется в запросе (Comment.objects.visible_to), а следующая порция
+    выбирается по курсору (created, pk) последнего показанного комментария, без OFFSET.
+    """
+    comments_page_size = 20
+
+    def get_visible_comments(self, post: Note) -> QuerySet:
+        return Comment.objects.filter(post=post).visible_to(self.request.user)
+
+    def get_comments_page(self, post: Note, after: str | None = None) -> dict[str, Any]:
+        page = self.get_visible_comments(post).select_related("user").order_by("created", "pk")
+        if after:
+            try:
+                page = comments_after(page, after)
+            except InvalidCursor:
+                raise Http404("Комментарий не найден")
+
+        page = list(page[:self.comments_page_size + 1])
+        has_more = len(page) > self.comments_page_size
+        page = page[:self.comments_page_size]
+        attach_comment_html(page)
+        return {
+            "comments": page,
+            "next_comments_url": (
+                reverse("post_comments", kwargs={"post_slug": post.slug}) + f"?after={page[-1].pk}"
+                if has_more else None
+            ),
+        }
+
+
 class PaginationMixin:
     """
     Базовый миксин для добавления пагинации в представление
@@ -87,6 +130,62 @@ class PaginationMixin:
         return context
 
 
+class KeysetPaginationMixin:
+    """
+    Миксин навигации по курсору для списков статей.
+    Ссылки «вперёд/назад» содержат курсор по (-time_update, title) и не требуют OFFSET,
+    номерные страницы остаются для произвольного перехода, а количество записей берётся из кеша.
+    """
+    paginator_class = CachedCountPaginator
+    cursor_kwarg = "cursor"
+    count_cache_key = None
+
+    def get_paginator(self, queryset: QuerySet, per_page: int, orphans: int = 0,
+                      allow_empty_first_page: bool = True, **kwargs) -> CachedCountPaginator:
+        return super().get_paginator(
+            queryset, per_page, orphans, allow_empty_first_page, count_cache_key=self.count_cache_key, **kwargs
+        )
+
+    def paginate_queryset(self, queryset: QuerySet, page_size: int) -> tuple:
+        queryset = queryset.order_by(*KEYSET_ORDERING)
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        if cursor:
+            try:
+                payload = decode_cursor(cursor)
+            except InvalidCursor:
+                raise Http404("Некорректный курсор страницы")
+            paginator = self.get_paginator(queryset, page_size)
+            page = keyset_page(queryset, paginator, payload, page_size)
+            if not page.object_list:
+                raise Http404("Страница не содержит результатов")
+            is_paginated = page.has_other_pages()
+        else:
+            paginator, page, _, is_paginated = super().paginate_queryset(queryset, page_size)
+            page.object_list = list(page.object_list)
+
+        page.next_cursor = (
+            encode_cursor(page.object_list[-1], page.number + 1, "next") if page.has_next() else None
+        )
+        # На первую страницу ведёт канонический адрес без курсора
+        page.previous_cursor = (
+            encode_cursor(page.object_list[0], page.number - 1, "prev")
+            if page.has_previous() and page.number > 2 else None
+        )
+        return paginator, page, page.object_list, is_paginated
+
+
+class CachedNoteListMixin:
+    """
+    Миксин для списков статей, которые кешируются как упорядоченный список идентификаторов.
+    get_queryset должен вернуть список id, а снимки строк загружаются только для текущей страницы.
+    """
+
+    def paginate_queryset(self, queryset: list[int], page_size: int) -> tuple:
+        paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+        page.object_list = get_note_rows(list(page.object_list))
+        return paginator, page, page.object_list, is_paginated
+
+
 class AddPageDescriptionMixin:
     """
     Базовый миксин для добавления дополнительных данных в контекст
@@ -94,16 +193,8 @@ class AddPageDescriptionMixin:
 
     @staticmethod
     def get_post_description(post: Any) -> str:
-        if post.meta_description and post.meta_description.strip():
-            return post.meta_description
-        else:
-            soup = BeautifulSoup(
-                post.content_short, features="html5lib"
-            )
-            clean_text = soup.get_text(
-                strip=True
-            )
-        return clean_text[:160]
+        # Описание вычисляется при сохранении статьи (Note.excerpt), разбор HTML на запрос не нужен
+        return post.excerpt
 
 
 def format_additional_data(additional_data: dict, max_length: int = 100) -> str:
@@ -117,7 +208,7 @@ def format_additional_data(additional_data: dict, max_length: int = 100) -> str:
 
 def send_notification_email(request: HttpRequest, context: dict, email_to: list = None, alert: bool = False) -> bool:
     """
-    Универсальная функция отправки уведомлений
+    Универсальная функция отправки уведомлений (через очередь исходящей почты)
 
     :param request: HttpRequest
     :param context: {
@@ -156,12 +247,12 @@ def send_notification_email(request: HttpRequest, context: dict, email_to: list
 {add_info if add_info else 'Отсутствует'}
         """
 
-        send_mail(
+        # Письмо только ставится в очередь, отправку выполняет manage.py send_queued_mail
+        enqueue_email(
             subject=f"Choocha.ru - {context['subject']}",
-            message=full_message,
+            body=full_message,
             from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=email_to,
-            fail_silently=False
+            recipients=email_to,
         )
 
         if alert:
@@ -1,11 +1,19 @@
+import hashlib
+from typing import Iterable
+
 from django_ckeditor_5.fields import CKEditor5Field
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.core.files.images import get_image_dimensions
+from django.db import models, transaction
 from django.db.models import QuerySet
 from django_extensions.db.fields import AutoSlugField
 from django.shortcuts import reverse
+from django.utils import timezone
 from slugify import slugify
 
+from .content import render_content
+from .utils import html_to_text
+
 
 class PublishedManager(models.Manager):
     def get_queryset(self) -> QuerySet:
@@ -25,6 +33,12 @@ class TagPost(models.Model):
         db_index=True,
         verbose_name='Слаг'
     )
+    published_count = models.PositiveIntegerField(
+        default=0,
+        db_index=True,
+        editable=False,
+        verbose_name='Опубликованных статей'
+    )
 
     class Meta:
         verbose_name = 'Метка'
@@ -47,6 +61,12 @@ class Category(models.Model):
         db_index=True,
         verbose_name='Слаг'
     )
+    published_count = models.PositiveIntegerField(
+        default=0,
+        db_index=True,
+        editable=False,
+        verbose_name='Опубликованных статей'
+    )
 
     class Meta:
         verbose_name = 'Категория'
@@ -80,6 +100,11 @@ class Note(models.Model):
         verbose_name='Изображение',
         null=True
     )
+    # Сведения об изображении хранятся в строке, чтобы не открывать файл при выводе
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='Ширина изображения')
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='Высота изображения')
+    image_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False, verbose_name='Размер файла изображения')
+    image_hash = models.CharField(max_length=64, blank=True, default='', editable=False, verbose_name='SHA-256 изображения')
     content_short = CKEditor5Field(
         max_length=2000,
         blank=True,
@@ -115,6 +140,44 @@ class Note(models.Model):
         null=True,
         verbose_name='Метаописание'
     )
+    excerpt = models.CharField(
+        max_length=160,
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Описание для метатегов'
+    )
+    search_text = models.TextField(
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Текст для поиска'
+    )
+    # Очищенный HTML для вывода в шаблонах (notes.content.render_content)
+    content_short_html = models.TextField(
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Краткий текст статьи (HTML для вывода)'
+    )
+    content_full_html = models.TextField(
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Полный текст статьи (HTML для вывода)'
+    )
+    # Одобренные комментарии: поддерживаются сигналами комментариев (notes.counters.recount_comments)
+    comment_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество комментариев'
+    )
+    last_comment_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name='Последний комментарий'
+    )
 
     objects = models.Manager()
     published = PublishedManager()
@@ -135,6 +198,81 @@ class Note(models.Model):
     def __str__(self) -> str:
         return self.title
 
+    # Поля, вычисляемые из содержимого статьи при каждом сохранении
+    derived_fields = ('excerpt', 'search_text', 'content_short_html', 'content_full_html')
+    # Колонки, из которых строится каждое вычисляемое поле
+    derived_field_sources = {
+        'excerpt': ('meta_description', 'content_short'),
+        'search_text': ('content_short', 'content_full'),
+        'content_short_html': ('content_short',),
+        'content_full_html': ('content_full',),
+    }
+
+    # Поля со сведениями о файле изображения
+    image_fields = ('image_width', 'image_height', 'image_size', 'image_hash')
+
+    def save(self, *args, **kwargs) -> None:
+        self.refresh_derived_fields()
+        try:
+            self.refresh_image_metadata()
+        except FileNotFoundError:
+            # Файл старого изображения потерян - статью всё равно можно сохранить,
+            # backfill_image_metadata покажет такие статьи
+            pass
+        if kwargs.get('update_fields') is not None:
+            update_fields = {*kwargs['update_fields'], *self.derived_fields}
+            if 'image' in update_fields:
+                update_fields.update(self.image_fields)
+            kwargs['update_fields'] = update_fields
+        # Счётчики категорий и меток пересчитываются в post_save - в той же транзакции
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def refresh_derived_fields(self, fields: Iterable[str] | None = None) -> None:
+        """Пересчитывает вычисляемые поля: все или только fields (значение поля X строит build_X)"""
+        for field in fields or self.derived_fields:
+            setattr(self, field, getattr(self, f'build_{field}')())
+
+    def refresh_image_metadata(self, force: bool = False) -> None:
+        """
+        Размеры, объём и SHA-256 файла изображения.
+        Файл читается только для нового изображения или если сведения ещё не заполнены.
+
+        width_field/height_field у ImageField не используются: с ними Django перечитывает размеры
+        в post_init каждой загружаемой статьи, у которой они не заполнены, и падает, если файла нет.
+        """
+        if not self.image:
+            self.image_width = self.image_height = self.image_size = None
+            self.image_hash = ''
+            return
+        if self.image_hash and self.image._committed and not force:
+            return
+        digest = hashlib.sha256()
+        for chunk in self.image.chunks():
+            digest.update(chunk)
+        # Для размеров достаточно заголовка файла
+        self.image_width, self.image_height = get_image_dimensions(self.image)
+        if self.image._committed:
+            self.image.close()
+        self.image_size = self.image.size
+        self.image_hash = digest.hexdigest()
+
+    def build_excerpt(self) -> str:
+        """Описание для метатегов: заданное вручную или начало краткого текста без разметки"""
+        if self.meta_description and self.meta_description.strip():
+            return self.meta_description.strip()[:160]
+        return html_to_text(self.content_short)[:160]
+
+    def build_search_text(self) -> str:
+        """Плоский текст статьи для полнотекстового индекса"""
+        return '\n'.join(filter(None, (html_to_text(self.content_short), html_to_text(self.content_full))))
+
+    def build_content_short_html(self) -> str:
+        return render_content(self.content_short)
+
+    def build_content_full_html(self) -> str:
+        return render_content(self.content_full)
+
     def get_absolute_url(self) -> str:
         return reverse('post', kwargs={'post_slug': self.slug})
 
@@ -149,6 +287,17 @@ class UploadFiles(models.Model):
     file = models.FileField(upload_to='uploads_model/', verbose_name='Файл')
 
 
+class CommentQuerySet(models.QuerySet):
+    def visible_to(self, user) -> QuerySet:
+        """Модераторам видны все комментарии, авторам - активные и свои, остальным только активные"""
+        if user.is_staff:
+            return self
+        visible = models.Q(status=Comment.Status.ACTIVE)
+        if user.is_authenticated:
+            visible |= models.Q(user=user)
+        return self.filter(visible)
+
+
 class Comment(models.Model):
     class Status(models.IntegerChoices):
         ACTIVE = 0, "Опубликован"
@@ -175,10 +324,18 @@ class Comment(models.Model):
         verbose_name='Статус комментария',
     )
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ('created',)
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        # Ветка комментариев статьи: фильтр по статусу и сортировка по времени без чтения лишних строк
+        indexes = (
+            models.Index(fields=('post', 'status', 'created'), name='notes_comment_thread_idx'),
+            # Очередь модерации: комментарии одного статуса по времени со всех статей
+            models.Index(fields=('status', 'created'), name='notes_comment_queue_idx'),
+        )
 
     def __str__(self) -> str:
         username = getattr(self.user, 'username', 'Аноним')
@@ -191,3 +348,40 @@ class Comment(models.Model):
         if is_staff or is_superuser:
             self.status = Comment.Status.ACTIVE
         super().save(*args, **kwargs)
+
+
+class OutgoingEmail(models.Model):
+    """Письмо в очереди исходящей почты. Отправляется фоновым обработчиком (manage.py send_queued_mail)"""
+
+    class Status(models.IntegerChoices):
+        PENDING = 0, 'Ожидает отправки'
+        SENT = 1, 'Отправлено'
+        FAILED = 2, 'Ошибка отправки'
+        # Забрано обработчиком; next_attempt_at - срок, после которого письмо может забрать другой обработчик
+        SENDING = 3, 'Отправляется'
+
+    subject = models.CharField(max_length=255, verbose_name='Тема')
+    body = models.TextField(verbose_name='Текст')
+    from_email = models.CharField(max_length=255, blank=True, verbose_name='Отправитель')
+    recipients = models.JSONField(default=list, verbose_name='Получатели')
+    status = models.IntegerField(
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name='Статус',
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток отправки')
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name='Следующая попытка')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+    sent_at = models.DateTimeField(blank=True, null=True, verbose_name='Отправлено')
+
+    class Meta:
+        ordering = ('created',)
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+        indexes = (
+            models.Index(fields=('status', 'next_attempt_at')),
+        )
+
+    def __str__(self) -> str:
+        return f'{self.subject} → {", ".join(self.recipients)}'
@@ -0,0 +1,135 @@
+"""
+Кеш страниц для анонимных посетителей.
+
+Ключ - путь и значимые параметры запроса (CACHED_QUERY_PARAMS) в постоянном порядке: запрос без cookie
+сессии (и без cookie сообщений) гарантированно анонимный, поэтому cookie CSRF и прочие cookie на ключ
+не влияют. Метки кампаний (utm_*) в ключ не входят, а запрос с любым другим параметром обходит кеш -
+иначе случайные параметры заполняли бы кеш записями на PAGE_STALE_TTL.
+Запись помнит версию содержимого (CONTENT_VERSION_KEY), при которой построена. После изменения
+статей, категорий или меток и по истечении PAGE_FRESH_TTL запись считается устаревшей:
+страницу перестраивает один процесс (блокировка PAGE_LOCK_KEY), остальные в это время отдают
+прежнюю версию. Изменение комментариев удаляет страницу статьи целиком (purge_pages).
+"""
+import time
+from functools import wraps
+from typing import Callable
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse
+
+from .caching import content_version, invalidate, page_key, page_lock_key
+
+# Сколько страница считается свежей и сколько хранится устаревшей версия для отдачи во время перестроения
+PAGE_FRESH_TTL = 60 * 5
+PAGE_STALE_TTL = 60 * 60 * 24
+# Если процесс, перестраивающий страницу, упал, блокировка снимется сама
+PAGE_LOCK_TIMEOUT = 30
+
+# Заголовок для отладки и мониторинга: hit, stale или miss
+PAGE_CACHE_HEADER = "X-Page-Cache"
+MESSAGES_COOKIE_NAME = "messages"
+
+# Параметры, от которых зависит страница (номер страницы и курсор списка)
+CACHED_QUERY_PARAMS = ("page", "cursor")
+# Метки рекламных кампаний и переходов: страницу не меняют
+IGNORED_QUERY_PARAMS = frozenset({"fbclid", "gclid", "yclid"})
+IGNORED_QUERY_PARAM_PREFIX = "utm_"
+
+
+def _is_anonymous_request(request: HttpRequest) -> bool:
+    return (
+        request.method in ("GET", "HEAD")
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and MESSAGES_COOKIE_NAME not in request.COOKIES
+    )
+
+
+def _cache_path(request: HttpRequest) -> str | None:
+    """Путь для ключа кеша или None, если в запросе есть параметр, не влияющий на ключ"""
+    for name in request.GET:
+        if not (
+            name in CACHED_QUERY_PARAMS
+            or name in IGNORED_QUERY_PARAMS
+            or name.startswith(IGNORED_QUERY_PARAM_PREFIX)
+        ):
+            return None
+    # Как и представление, при повторе параметра берём последнее значение
+    query = urlencode([(name, request.GET[name]) for name in CACHED_QUERY_PARAMS if name in request.GET])
+    return f"{request.path}?{query}" if query else request.path
+
+
+def _is_cacheable_response(request: HttpRequest, response: HttpResponse) -> bool:
+    # Страница с токеном CSRF или новой сессией привязана к конкретному посетителю
+    session = getattr(request, "session", None)
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+        and not (session is not None and session.modified)
+    )
+
+
+def _cached_headers(response: HttpResponse) -> list[tuple[str, str]]:
+    # Заголовки представления (Content-Type, Vary, Cache-Control, Content-Language...) отдаются и из кеша.
+    # Cookie в запись не попадают: страница с ними не кешируется, а Set-Cookie отсекается на всякий случай
+    return [(name, value) for name, value in response.items() if name.lower() != "set-cookie"]
+
+
+def _from_entry(entry: dict, state: str) -> HttpResponse:
+    response = HttpResponse(entry["content"])
+    for name, value in entry["headers"]:
+        response[name] = value
+    response[PAGE_CACHE_HEADER] = state
+    return response
+
+
+def anonymous_cache_page(view: Callable[..., HttpResponse]) -> Callable[..., HttpResponse]:
+    """Декоратор представления: кеширует страницу для анонимных посетителей"""
+
+    @wraps(view)
+    def wrapper(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        path = _cache_path(request) if _is_anonymous_request(request) else None
+        if path is None:
+            return view(request, *args, **kwargs)
+
+        version = content_version()
+        entry = cache.get(page_key(path))
+
+        if entry is not None:
+            if entry["version"] == version and entry["fresh_until"] > time.time():
+                return _from_entry(entry, "hit")
+            if not cache.add(page_lock_key(path), 1, PAGE_LOCK_TIMEOUT):
+                # Страницу уже перестраивает другой процесс
+                return _from_entry(entry, "stale")
+            locked = True
+        else:
+            # Без устаревшей версии отдавать нечего - блокировка лишь сообщает остальным, что перестроение идёт
+            locked = cache.add(page_lock_key(path), 1, PAGE_LOCK_TIMEOUT)
+
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, "render") and callable(response.render):
+                response.render()
+            if _is_cacheable_response(request, response):
+                entry = {
+                    "content": response.content,
+                    "headers": _cached_headers(response),
+                    "version": version,
+                    "fresh_until": time.time() + PAGE_FRESH_TTL,
+                }
+                cache.set(page_key(path), entry, PAGE_STALE_TTL)
+        finally:
+            if locked:
+                cache.delete(page_lock_key(path))
+        response[PAGE_CACHE_HEADER] = "miss"
+        return response
+
+    return wrapper
+
+
+def purge_pages(*paths: str) -> None:
+    """Удаляет страницы из кеша после фиксации транзакции (например, страницу статьи при изменении комментариев)"""
+    invalidate(page_key(path) for path in paths)
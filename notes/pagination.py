@@ -0,0 +1,133 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any
+
+from django.core.paginator import Paginator, Page
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+from .caching import get_or_compute
+
+# Порядок, совпадающий с индексом Note.Meta.indexes (-time_update, title); pk - для однозначности
+KEYSET_ORDERING = ("-time_update", "title", "pk")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(note: Any, page_number: int, direction: str) -> str:
+    """
+    Непрозрачный курсор: позиция статьи в сортировке, номер страницы и направление.
+    """
+    payload = {
+        "t": note.time_update.isoformat(),
+        "s": note.title,
+        "i": note.pk,
+        "p": page_number,
+        "d": direction,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> dict[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        payload["t"] = datetime.fromisoformat(payload["t"])
+        if payload["d"] not in ("next", "prev") or int(payload["p"]) < 1:
+            raise InvalidCursor(cursor)
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(cursor) from e
+    return payload
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Пагинатор, который берёт количество записей из кеша вместо COUNT(*) на каждый запрос.
+    Ключ сбрасывается при публикации и снятии статей с публикации.
+    """
+
+    def __init__(self, *args, count_cache_key: str | None = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.count_cache_key = count_cache_key
+
+    @cached_property
+    def count(self) -> int:
+        if self.count_cache_key is None:
+            return super().count
+        return get_or_compute(self.count_cache_key, self.object_list.count)
+
+
+class KeysetPage(Page):
+    """
+    Страница, выбранная по курсору. Наличие соседних страниц определяется по самим данным,
+    номер страницы и их общее число - приблизительные (по кешированному количеству).
+    """
+
+    def __init__(self, object_list, number: int, paginator: Paginator, has_next: bool, has_previous: bool) -> None:
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def has_next(self) -> bool:
+        return self._has_next
+
+    def has_previous(self) -> bool:
+        return self._has_previous
+
+    def next_page_number(self) -> int:
+        return self.number + 1
+
+    def previous_page_number(self) -> int:
+        return self.number - 1
+
+
+def keyset_filter(payload: dict[str, Any]) -> Q:
+    """Условие «после» (next) или «до» (prev) позиции курсора в порядке KEYSET_ORDERING"""
+    t, title, pk = payload["t"], payload["s"], payload["i"]
+    if payload["d"] == "next":
+        return (
+            Q(time_update__lt=t)
+            | Q(time_update=t, title__gt=title)
+            | Q(time_update=t, title=title, pk__gt=pk)
+        )
+    return (
+        Q(time_update__gt=t)
+        | Q(time_update=t, title__lt=title)
+        | Q(time_update=t, title=title, pk__lt=pk)
+    )
+
+
+def keyset_page(queryset: QuerySet, paginator: Paginator, payload: dict[str, Any], per_page: int) -> KeysetPage:
+    """
+    Выбирает страницу по курсору одним запросом без OFFSET и COUNT:
+    берётся per_page + 1 строк, лишняя строка означает наличие следующей страницы в этом направлении.
+    """
+    forward = payload["d"] == "next"
+    ordering = KEYSET_ORDERING if forward else ("time_update", "-title", "-pk")
+    rows = list(queryset.filter(keyset_filter(payload)).order_by(*ordering)[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    # Номер страницы из курсора приблизителен: количество могло измениться после его выдачи
+    number = max(1, min(int(payload["p"]), paginator.num_pages))
+    if forward:
+        return KeysetPage(rows, number, paginator, has_next=has_more, has_previous=True)
+    rows.reverse()
+    if not has_more:
+        number = 1
+    return KeysetPage(rows, number, paginator, has_next=True, has_previous=has_more)
+
+
+def comments_after(comments: QuerySet, after: str) -> QuerySet:
+    """
+    Комментарии, идущие после комментария after в порядке (created, pk).
+    Курсор ищется в той же выборке, поэтому по нему нельзя узнать о недоступных комментариях.
+    """
+    created = comments.filter(pk=after).values_list("created", flat=True).first() if after.isdigit() else None
+    if created is None:
+        raise InvalidCursor(after)
+    return comments.filter(Q(created__gt=created) | Q(created=created, pk__gt=after))
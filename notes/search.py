@@ -0,0 +1,119 @@
+"""
+Полнотекстовый поиск по статьям.
+
+В PostgreSQL используется функциональный GIN-индекс по SearchVector с русской морфологией,
+в SQLite (разработка и тесты) - внешняя FTS5-таблица, которую поддерживают триггеры.
+Оба варианта индексируют Note.title и плоский текст Note.search_text.
+"""
+import re
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import QuerySet
+from django.utils.html import escape
+from django.utils.safestring import mark_safe, SafeString
+
+from .models import Note
+
+SEARCH_CONFIG = "russian"
+FTS_TABLE = "notes_note_fts"
+
+# Служебные маркеры подсветки: текст фрагмента экранируется, и только потом маркеры заменяются на <mark>
+_MARK_START, _MARK_STOP = "\x02", "\x03"
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+SNIPPET_WORDS = 24
+
+
+def search_vector() -> SearchVector:
+    """
+    Выражение поискового вектора. Одно и то же выражение используется в индексе и в запросах,
+    иначе PostgreSQL не сможет применить индекс.
+    """
+    return (
+        SearchVector("title", weight="A", config=SEARCH_CONFIG)
+        + SearchVector("search_text", weight="B", config=SEARCH_CONFIG)
+    )
+
+
+def highlight(fragment: str | None) -> SafeString:
+    """Экранирует фрагмент и превращает маркеры совпадений в <mark>"""
+    return mark_safe(
+        escape(fragment or "").replace(_MARK_START, "<mark>").replace(_MARK_STOP, "</mark>")
+    )
+
+
+def fts5_query(query: str) -> str:
+    """
+    Запрос пользователя в синтаксисе FTS5: каждое слово в кавычках с поиском по префиксу.
+    Операторы FTS5 из ввода не пропускаются.
+    """
+    return " ".join(f'"{word}"*' for word in _WORD_RE.findall(query))
+
+
+def _search_postgres(queryset: QuerySet, query: str) -> QuerySet:
+    search_query = SearchQuery(query, search_type="websearch", config=SEARCH_CONFIG)
+    return (
+        queryset
+        .annotate(search=search_vector())
+        .filter(search=search_query)
+        .annotate(
+            rank=SearchRank(search_vector(), search_query),
+            headline=SearchHeadline(
+                "search_text",
+                search_query,
+                config=SEARCH_CONFIG,
+                start_sel=_MARK_START,
+                stop_sel=_MARK_STOP,
+                max_words=SNIPPET_WORDS,
+                min_words=SNIPPET_WORDS // 2,
+            ),
+        )
+        .order_by("-rank", "-time_update")
+    )
+
+
+def _match_sqlite(query: str) -> list[tuple[int, float, str]]:
+    match = fts5_query(query)
+    if not match:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, bm25({FTS_TABLE}, 10.0, 1.0) AS rank, "
+            f"snippet({FTS_TABLE}, 1, %s, %s, '…', %s) "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank",
+            [_MARK_START, _MARK_STOP, SNIPPET_WORDS, match],
+        )
+        return cursor.fetchall()
+
+
+def _search_sqlite(queryset: QuerySet, query: str) -> list[Note]:
+    matches = _match_sqlite(query)
+    notes = queryset.in_bulk([pk for pk, _, _ in matches])
+    results = []
+    for pk, rank, snippet in matches:
+        if pk in notes:
+            note = notes[pk]
+            # bm25 в FTS5 тем меньше, чем лучше совпадение
+            note.rank, note.headline = -rank, snippet
+            results.append(note)
+    return results
+
+
+def search_notes(query: str, queryset: QuerySet | None = None) -> QuerySet | list[Note]:
+    """
+    Ищет статьи по запросу. Результаты упорядочены по релевантности,
+    у каждой статьи есть атрибуты rank и headline (фрагмент с маркерами совпадений).
+    """
+    queryset = Note.published.all() if queryset is None else queryset
+    if connection.vendor == "postgresql":
+        return _search_postgres(queryset, query)
+    return _search_sqlite(queryset, query)
+
+
+def filter_notes(queryset: QuerySet, query: str) -> QuerySet:
+    """Фильтрация QuerySet по полнотекстовому индексу без ранжирования (для админки)"""
+    if connection.vendor == "postgresql":
+        search_query = SearchQuery(query, search_type="websearch", config=SEARCH_CONFIG)
+        return queryset.annotate(search=search_vector()).filter(search=search_query)
+    return queryset.filter(pk__in=[pk for pk, _, _ in _match_sqlite(query)])
@@ -0,0 +1,130 @@
+"""
+Сериализаторы API только для чтения (notes/api.py).
+
+Клиент может запросить часть полей (?fields=slug,title). Сериализатор отбрасывает остальные поля,
+а представление по тем же полям строит .only(), select_related и prefetch_related,
+поэтому лишние колонки (прежде всего content_full) и связи не загружаются.
+"""
+from typing import Iterable
+
+from django.db.models import Prefetch, QuerySet
+from rest_framework import serializers
+
+from .models import Note, Category, TagPost, Comment
+
+
+class SparseFieldsMixin:
+    """Оставляет только поля из аргумента fields; неизвестные имена игнорируются"""
+
+    def __init__(self, *args, fields: Iterable[str] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    url = serializers.CharField(source="get_absolute_url", read_only=True)
+
+    class Meta:
+        model = Category
+        fields = ("slug", "name", "published_count", "url")
+
+
+class TagSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    url = serializers.CharField(source="get_absolute_url", read_only=True)
+
+    class Meta:
+        model = TagPost
+        fields = ("slug", "name", "published_count", "url")
+
+
+class BriefTaxonomySerializer(serializers.Serializer):
+    slug = serializers.CharField()
+    name = serializers.CharField()
+
+
+class NoteImageSerializer(serializers.Serializer):
+    url = serializers.CharField(source="image.url")
+    width = serializers.IntegerField(source="image_width")
+    height = serializers.IntegerField(source="image_height")
+
+
+class NoteListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    url = serializers.CharField(source="get_absolute_url", read_only=True)
+    category = BriefTaxonomySerializer(source="cat", read_only=True)
+    tags = BriefTaxonomySerializer(many=True, read_only=True)
+    author = serializers.CharField(source="author.username", read_only=True, allow_null=True, default=None)
+    image = serializers.SerializerMethodField()
+
+    # Колонки и связи, которые нужны каждому полю. Поля без записи читают одноимённую колонку
+    model_fields = {
+        "url": ("slug",),
+        "category": ("cat__slug", "cat__name"),
+        "tags": (),
+        "author": ("author__username",),
+        "image": ("image", "image_width", "image_height"),
+    }
+    select_related = {
+        "category": "cat",
+        "author": "author",
+    }
+    prefetch_related = {
+        "tags": lambda: Prefetch("tags", queryset=TagPost.objects.only("slug", "name").order_by("name")),
+    }
+
+    class Meta:
+        model = Note
+        fields = (
+            "id", "slug", "title", "url", "excerpt", "time_create", "time_update",
+            "comment_count", "last_comment_at", "category", "tags", "author", "image",
+        )
+
+    def get_image(self, note: Note) -> dict | None:
+        return NoteImageSerializer(note).data if note.image else None
+
+    @classmethod
+    def field_names(cls, requested: Iterable[str] | None = None) -> list[str]:
+        if not requested:
+            return list(cls.Meta.fields)
+        requested = set(requested)
+        return [name for name in cls.Meta.fields if name in requested]
+
+    @classmethod
+    def optimize(cls, queryset: QuerySet, requested: Iterable[str] | None = None, extra: Iterable[str] = ()) -> QuerySet:
+        """Загружает только колонки и связи, нужные запрошенным полям (и колонки extra, например для сортировки)"""
+        names = cls.field_names(requested)
+        columns = {"id", *extra}
+        for name in names:
+            columns.update(cls.model_fields.get(name, (name,)))
+        queryset = queryset.only(*columns)
+        related = [cls.select_related[name] for name in names if name in cls.select_related]
+        if related:
+            queryset = queryset.select_related(*related)
+        prefetch = [cls.prefetch_related[name]() for name in names if name in cls.prefetch_related]
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+
+class NoteDetailSerializer(NoteListSerializer):
+    # Отдаётся очищенный HTML, как на сайте, а не исходный текст из редактора
+    content_short = serializers.CharField(source="content_short_html", read_only=True)
+    content_full = serializers.CharField(source="content_full_html", read_only=True)
+
+    model_fields = {
+        **NoteListSerializer.model_fields,
+        "content_short": ("content_short_html",),
+        "content_full": ("content_full_html",),
+    }
+
+    class Meta(NoteListSerializer.Meta):
+        fields = (*NoteListSerializer.Meta.fields, "content_short", "content_full")
+
+
+class CommentSerializer(serializers.ModelSerializer):
+    author = serializers.CharField(source="user.username", read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ("id", "author", "body", "created", "updated")
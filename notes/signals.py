@@ -0,0 +1,203 @@
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .caching import (
+    ALL_TAGS_KEY, PUBLISHED_COUNT_KEY, invalidate, sidebar_keys, last_posts_keys, category_posts_key, tag_posts_key, note_row_key,
+    sitemap_keys, CONTENT_VERSION_KEY,
+)
+from .counters import recount_categories, recount_tags, recount_comments
+from .models import Note, Category, TagPost, Comment
+from .pagecache import purge_pages
+
+###################################
+#     Инвалидация кеша статей     #
+###################################
+
+
+@receiver(pre_save, sender=Note)
+def remember_note_state(sender, instance: Note, **kwargs) -> None:
+    """Запоминаем состояние статьи до сохранения, чтобы обновить кеш и счётчики старой категории"""
+    instance._prev_state = (
+        Note.objects.filter(pk=instance.pk).values("cat_id", "cat__slug", "status").first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Note)
+def invalidate_note_on_save(sender, instance: Note, created: bool, **kwargs) -> None:
+    prev = getattr(instance, "_prev_state", None)
+    was_published = prev is not None and prev["status"] == Note.Status.PUBLISHED
+    is_published = instance.status == Note.Status.PUBLISHED
+
+    # Черновик остался черновиком - ни один кешированный список его не содержит
+    if not was_published and not is_published:
+        return
+
+    keys = [
+        category_posts_key(instance.cat.slug),
+        note_row_key(instance.pk),
+        *last_posts_keys(),
+        *sitemap_keys("notes"),
+        CONTENT_VERSION_KEY,
+    ]
+    if prev is not None:
+        keys.append(category_posts_key(prev["cat__slug"]))
+    if not created:
+        keys += [tag_posts_key(slug) for slug in instance.tags.values_list("slug", flat=True)]
+    if was_published != is_published or (prev is not None and prev["cat__slug"] != instance.cat.slug):
+        # Изменились счётчики категорий и меток - а с ними и состав их разделов карты сайта
+        keys += [PUBLISHED_COUNT_KEY, *sidebar_keys(), *sitemap_keys("tags", "categories")]
+    invalidate(keys)
+
+
+@receiver(pre_delete, sender=Note)
+def invalidate_note_on_delete(sender, instance: Note, **kwargs) -> None:
+    # Связи с метками удаляются без m2m_changed, поэтому собираем ключи до удаления
+    if instance.status != Note.Status.PUBLISHED:
+        return
+    invalidate([
+        category_posts_key(instance.cat.slug),
+        note_row_key(instance.pk),
+        *(tag_posts_key(slug) for slug in instance.tags.values_list("slug", flat=True)),
+        PUBLISHED_COUNT_KEY,
+        *sidebar_keys(),
+        *last_posts_keys(),
+        *sitemap_keys(),
+        CONTENT_VERSION_KEY,
+    ])
+
+
+@receiver(m2m_changed, sender=Note.tags.through)
+def invalidate_note_tags(sender, instance, action: str, reverse: bool, pk_set: set | None, **kwargs) -> None:
+    if action == "pre_clear" and not reverse:
+        instance._cache_cleared_tags = list(instance.tags.values_list("slug", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if reverse:
+        # tag.posts.add(...) - изменился список одной метки
+        slugs = [instance.slug]
+    elif action == "post_clear":
+        slugs = getattr(instance, "_cache_cleared_tags", [])
+    else:
+        slugs = TagPost.objects.filter(pk__in=pk_set).values_list("slug", flat=True)
+    invalidate([ALL_TAGS_KEY, *(tag_posts_key(slug) for slug in slugs), *sitemap_keys("tags"), CONTENT_VERSION_KEY])
+
+
+###################################
+# Инвалидация категорий и меток   #
+###################################
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=TagPost)
+def remember_slug(sender, instance, **kwargs) -> None:
+    """Запоминаем прежний slug, чтобы сбросить кеш списка по старому адресу"""
+    instance._cache_prev_slug = (
+        sender.objects.filter(pk=instance.pk).values_list("slug", flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Category)
+def invalidate_category_on_save(sender, instance: Category, **kwargs) -> None:
+    prev_slug = getattr(instance, "_cache_prev_slug", None)
+    # Название категории хранится в снимках строк её статей
+    note_ids = Note.published.filter(cat=instance).values_list("pk", flat=True)
+    invalidate([
+        category_posts_key(instance.slug),
+        *([category_posts_key(prev_slug)] if prev_slug else []),
+        *(note_row_key(pk) for pk in note_ids),
+        *sidebar_keys(),
+        *sitemap_keys("categories"),
+        CONTENT_VERSION_KEY,
+    ])
+
+
+@receiver(post_delete, sender=Category)
+def invalidate_category_on_delete(sender, instance: Category, **kwargs) -> None:
+    invalidate([category_posts_key(instance.slug), *sidebar_keys(), *sitemap_keys("categories"), CONTENT_VERSION_KEY])
+
+
+@receiver(post_save, sender=TagPost)
+def invalidate_tag_on_save(sender, instance: TagPost, **kwargs) -> None:
+    prev_slug = getattr(instance, "_cache_prev_slug", None)
+    invalidate([
+        ALL_TAGS_KEY,
+        tag_posts_key(instance.slug),
+        *([tag_posts_key(prev_slug)] if prev_slug else []),
+        *sitemap_keys("tags"),
+        CONTENT_VERSION_KEY,
+    ])
+
+
+@receiver(post_delete, sender=TagPost)
+def invalidate_tag_on_delete(sender, instance: TagPost, **kwargs) -> None:
+    invalidate([ALL_TAGS_KEY, tag_posts_key(instance.slug), *sitemap_keys("tags"), CONTENT_VERSION_KEY])
+
+
+###########################################
+# Счётчики опубликованных статей          #
+###########################################
+
+@receiver(post_save, sender=Note)
+def recount_on_note_save(sender, instance: Note, created: bool, **kwargs) -> None:
+    # Note.save() выполняется в транзакции, поэтому счётчики меняются вместе со статьёй
+    prev = getattr(instance, "_prev_state", None)
+    prev_status = prev["status"] if prev else Note.Status.DRAFT
+    prev_cat_id = prev["cat_id"] if prev else instance.cat_id
+
+    if prev_status != instance.status or prev_cat_id != instance.cat_id:
+        recount_categories({prev_cat_id, instance.cat_id})
+    if prev_status != instance.status and not created:
+        recount_tags(instance.tags.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Note)
+def remember_note_tags(sender, instance: Note, **kwargs) -> None:
+    instance._prev_tag_ids = list(instance.tags.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Note)
+def recount_on_note_delete(sender, instance: Note, **kwargs) -> None:
+    if instance.status == Note.Status.PUBLISHED:
+        recount_categories([instance.cat_id])
+        recount_tags(getattr(instance, "_prev_tag_ids", []))
+
+
+@receiver(m2m_changed, sender=Note.tags.through)
+def recount_on_note_tags(sender, instance, action: str, reverse: bool, pk_set: set | None, **kwargs) -> None:
+    if action == "pre_clear" and not reverse:
+        instance._prev_tag_ids = list(instance.tags.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if reverse:
+        recount_tags([instance.pk])
+    elif instance.status == Note.Status.PUBLISHED:
+        recount_tags(getattr(instance, "_prev_tag_ids", []) if action == "post_clear" else pk_set)
+
+
+###########################################
+# Счётчики комментариев статьи            #
+###########################################
+
+def _deleted_with_note(origin: object) -> bool:
+    return isinstance(origin, Note) or (isinstance(origin, QuerySet) and origin.model is Note)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def recount_on_comment_change(sender, instance: Comment, origin: object = None, **kwargs) -> None:
+    # Комментарии удаляются каскадом вместе со статьёй: её счётчики, снимок строки и страница
+    # исчезают вместе с ней, и пересчёт на каждый комментарий был бы лишним
+    if _deleted_with_note(origin):
+        return
+    # Создание, одобрение, смена статуса в админке и удаление - один UPDATE статьи
+    recount_comments([instance.post_id])
+    invalidate([note_row_key(instance.post_id)])
+    # Число и список комментариев выводятся на странице статьи. Статья не загружается целиком
+    # через instance.post: нужен только slug, как и в moderation.moderate()
+    purge_pages(*(note.get_absolute_url() for note in Note.objects.filter(pk=instance.post_id).only("slug")))
@@ -1,29 +1,212 @@
+"""
+Карта сайта.
+
+Разделы (статьи, метки, категории) делятся на части до 50 000 адресов и заранее
+записываются в файлы SITEMAP_ROOT (вместе с .gz) вместе с индексом sitemap.xml.
+Изменения статей, меток и категорий сбрасывают в кеше метку актуальности своего раздела,
+и фоновый обработчик (manage.py build_sitemaps --interval N) перестраивает только этот раздел.
+Запросы лишь отдают готовые файлы и никогда не ждут построения. Файлы, содержимое которых
+не изменилось, не перезаписываются, поэтому ETag/Last-Modified остаются прежними.
+"""
+import gzip
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
+from django.contrib.sitemaps.views import SitemapIndexItem
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_safe
+
+from choocha.files import serve_file
+from .caching import SITEMAP_LOCK_KEY, sitemap_fresh_key
 from .models import Note, TagPost, Category
 
 
-class NoteSitemap(Sitemap):
+class BaseSitemap(Sitemap):
     changefreq = 'weekly'
+    protocol = 'https'
+    # Ограничение протокола sitemaps.org на количество адресов в одном файле
+    limit = 50000
+
+
+class NoteSitemap(BaseSitemap):
     priority = 1.0
 
     def items(self):
-        return Note.published.all()
+        # Для адреса и даты изменения достаточно двух полей, порядок по pk стабилен между частями
+        return Note.published.only('slug', 'time_update').order_by('pk')
 
     def lastmod(self, obj):
         return obj.time_update
 
 
-class TagSitemap(Sitemap):
-    changefreq = 'weekly'
+class TagSitemap(BaseSitemap):
     priority = 0.8
 
     def items(self):
-        return TagPost.objects.all().order_by('name')
+        return TagPost.objects.filter(published_count__gt=0).only('slug').order_by('name')
 
 
-class CategorySitemap(Sitemap):
-    changefreq = 'weekly'
+class CategorySitemap(BaseSitemap):
     priority = 0.7
 
     def items(self):
-        return Category.objects.all().order_by('name')
+        return Category.objects.filter(published_count__gt=0).only('slug').order_by('name')
+
+
+SITEMAPS = {
+    'notes': NoteSitemap,
+    'tags': TagSitemap,
+    'categories': CategorySitemap,
+}
+
+###################################
+#   Файлы карты сайта             #
+###################################
+
+SITEMAP_INDEX = 'sitemap.xml'
+# Состав частей каждого раздела и даты их изменения - из него собирается индекс
+SITEMAP_MANIFEST = 'manifest.json'
+SHARD_NAME_RE = re.compile(r'^sitemap-(?P<section>[a-z]+)-(?P<page>\d+)\.xml$')
+
+SITEMAP_CACHE_CONTROL = 'public, max-age=3600'
+# Одновременно строит только один обработчик; блокировка истекает, если он упал
+SITEMAP_LOCK_TIMEOUT = 60 * 5
+
+
+def shard_name(section: str, page: int) -> str:
+    return f'sitemap-{section}-{page}.xml'
+
+
+def _root() -> Path:
+    return Path(settings.SITEMAP_ROOT)
+
+
+def _write(name: str, content: bytes, compress: bool = True) -> bool:
+    """
+    Атомарно записывает файл и его .gz, если содержимое изменилось.
+    Неизменённый файл сохраняет mtime, а значит и ETag.
+    """
+    path = _root() / name
+    if path.is_file() and path.read_bytes() == content:
+        return False
+    variants = [(path, content)]
+    if compress:
+        variants.append((path.with_name(path.name + '.gz'), gzip.compress(content, mtime=0)))
+    for target, data in variants:
+        with tempfile.NamedTemporaryFile(dir=_root(), delete=False) as tmp:
+            tmp.write(data)
+        # NamedTemporaryFile создаёт файл с правами 0600 - прокси под другим пользователем не смог бы
+        # отдать его через X-Accel-Redirect
+        os.chmod(tmp.name, 0o644)
+        os.replace(tmp.name, target)
+    return True
+
+
+def _read_manifest() -> dict[str, list[list[str | None]]]:
+    try:
+        return json.loads((_root() / SITEMAP_MANIFEST).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def build_section(section: str) -> list[list[str | None]]:
+    """Перезаписывает изменившиеся части раздела и удаляет лишние. Возвращает [[имя, lastmod], ...]"""
+    sitemap = SITEMAPS[section]()
+    site = Site.objects.get_current()
+    pages = sitemap.paginator.num_pages if sitemap.paginator.count else 0
+
+    shards = []
+    for page in range(1, pages + 1):
+        urls = sitemap.get_urls(page=page, site=site)
+        _write(shard_name(section, page), render_to_string('sitemap.xml', {'urlset': urls}).encode())
+        lastmods = [url['lastmod'] for url in urls if url['lastmod']]
+        shards.append([shard_name(section, page), max(lastmods).isoformat() if lastmods else None])
+
+    for path in _root().glob(f'sitemap-{section}-*.xml*'):
+        match = SHARD_NAME_RE.match(path.name.removesuffix('.gz'))
+        if match and int(match['page']) > pages:
+            path.unlink(missing_ok=True)
+    return shards
+
+
+def build_index(manifest: dict[str, list[list[str | None]]]) -> None:
+    domain = Site.objects.get_current().domain
+    items = [
+        SitemapIndexItem(
+            f'{BaseSitemap.protocol}://{domain}{reverse("sitemap-shard", args=[name])}',
+            parse_datetime(lastmod) if lastmod else None,
+        )
+        for section in SITEMAPS
+        for name, lastmod in manifest.get(section, [])
+    ]
+    _write(SITEMAP_INDEX, render_to_string('sitemap_index.xml', {'sitemaps': items}).encode())
+
+
+def _is_fresh(section: str) -> bool:
+    return bool(cache.get(sitemap_fresh_key(section)))
+
+
+def refresh_sitemaps(force: bool = False) -> bool:
+    """
+    Перестраивает устаревшие разделы и индекс. Возвращает False, если перестроение
+    уже выполняет другой процесс.
+    """
+    _root().mkdir(parents=True, exist_ok=True)
+    manifest = _read_manifest()
+    stale = [
+        section for section in SITEMAPS
+        if force or section not in manifest or not _is_fresh(section)
+    ]
+    if not stale and (_root() / SITEMAP_INDEX).is_file():
+        return True
+
+    if not cache.add(SITEMAP_LOCK_KEY, 1, SITEMAP_LOCK_TIMEOUT):
+        return False
+    fresh_keys = [sitemap_fresh_key(section) for section in stale]
+    try:
+        # Метки ставятся до построения: изменение во время построения снова их сбросит
+        cache.set_many(dict.fromkeys(fresh_keys, 1), None)
+        for section in stale:
+            manifest[section] = build_section(section)
+        build_index(manifest)
+        _write(SITEMAP_MANIFEST, json.dumps(manifest, indent=1).encode(), compress=False)
+    except Exception:
+        cache.delete_many(fresh_keys)
+        raise
+    finally:
+        cache.delete(SITEMAP_LOCK_KEY)
+    return True
+
+
+def _serve(request, name: str) -> HttpResponse:
+    if not (_root() / SITEMAP_INDEX).is_file():
+        # Карта ещё ни разу не построена (build_sitemaps)
+        response = HttpResponse(status=503)
+        response['Retry-After'] = '10'
+        return response
+    response = serve_file(request, name, _root(), 'sitemaps/', SITEMAP_CACHE_CONTROL, precompressed=True)
+    response['X-Robots-Tag'] = 'noindex, noodp, noarchive'
+    return response
+
+
+@require_safe
+def sitemap_index(request) -> HttpResponse:
+    return _serve(request, SITEMAP_INDEX)
+
+
+@require_safe
+def sitemap_shard(request, name: str) -> HttpResponse:
+    match = SHARD_NAME_RE.match(name)
+    if not match or match['section'] not in SITEMAPS:
+        raise Http404('Нет такой части карты сайта')
+    return _serve(request, name)
@@ -0,0 +1,40 @@
+from django import template
+from django.db.models.fields.files import ImageFieldFile
+from django.utils.html import format_html
+from django.utils.safestring import SafeString
+
+from notes.images import DEFAULT_SIZES, picture, responsive_content as _responsive_content
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(image: ImageFieldFile, alt: str = "", sizes: str = DEFAULT_SIZES, css_class: str = "") -> SafeString:
+    """
+    Выводит изображение в <picture> с srcset из уменьшенных копий (WebP/AVIF).
+
+    Параметры:
+    - image (ImageFieldFile): значение ImageField, например post.image.
+    - alt (str): альтернативный текст.
+    - sizes (str): атрибут sizes для <source>.
+    - css_class (str): класс тега <img>.
+    """
+    if not image:
+        return SafeString("")
+    # Размеры берутся из полей статьи (image.width открыл бы файл)
+    width = getattr(image.instance, "image_width", None)
+    height = getattr(image.instance, "image_height", None)
+    img_tag = format_html(
+        '<img src="{}" alt="{}"{}{} loading="lazy" decoding="async">',
+        image.url,
+        alt,
+        format_html(' width="{}" height="{}"', width, height) if width and height else "",
+        format_html(' class="{}"', css_class) if css_class else "",
+    )
+    return picture(image.name, img_tag, sizes)
+
+
+@register.filter
+def responsive_content(html: str) -> SafeString:
+    """Оборачивает картинки из загрузок CKEditor в HTML статьи в <picture> с srcset"""
+    return SafeString(_responsive_content(html))
@@ -1,8 +1,6 @@
 from django import template
-from django.db.models import Count, Q
-from django.core.cache import cache
-from redis import RedisError
 
+from notes.caching import ALL_TAGS_KEY, categories_key, last_posts_key, get_or_compute
 from notes.models import Category, TagPost, Note
 
 register = template.Library()
@@ -21,26 +19,18 @@ def show_categories(cat_selected: int = 0) -> dict[str, object]:
     - cat_selected (int): Выбранная категория.
     """
 
-    try:
-        return {
-            'all_categories': cache.get_or_set(
-                f"notes:categories:{cat_selected}",
-                lambda: Category.objects
-                .annotate(total=Count('posts', filter=Q(posts__status=Note.Status.PUBLISHED)))
-                .filter(total__gt=0)  # Исключили категории без опубликованных постов
-                .order_by('name'),
-                86400,
+    # list(): запрос выполняется внутри вычисления, и его длительность учитывается при раннем обновлении
+    return {
+        'all_categories': get_or_compute(
+            categories_key(cat_selected),
+            lambda: list(
+                Category.objects
+                .filter(published_count__gt=0)  # Исключили категории без опубликованных постов
+                .order_by('name')
             ),
-            'cat_selected': cat_selected
-        }
-    except RedisError:
-        return {
-            'all_categories': Category.objects
-            .annotate(total=Count('posts', filter=Q(posts__status=Note.Status.PUBLISHED)))
-            .filter(total__gt=0)
-            .order_by('name'),
-            'cat_selected': cat_selected
-        }
+        ),
+        'cat_selected': cat_selected
+    }
 
 
 @register.inclusion_tag('notes/get_list_tags.html')
@@ -51,24 +41,16 @@ def show_all_tags() -> dict[str, object]:
     Возвращаемые значения:
     - all_tags (QuerySet/List): Список тэгов.
     """
-    try:
-        return {
-            'all_tags': cache.get_or_set(
-                'notes:all_tags',
-                lambda: TagPost.objects
-                .annotate(total=Count('posts', filter=Q(posts__status=Note.Status.PUBLISHED)))
-                .filter(total__gt=0)  # Исключили теги без опубликованных постов
-                .order_by('name'),
-                86400
-            )
-        }
-    except RedisError:
-        return {
-            'all_tags': TagPost.objects
-            .annotate(total=Count('posts', filter=Q(posts__status=Note.Status.PUBLISHED)))
-            .filter(total__gt=0)
-            .order_by('name')
-        }
+    return {
+        'all_tags': get_or_compute(
+            ALL_TAGS_KEY,
+            lambda: list(
+                TagPost.objects
+                .filter(published_count__gt=0)  # Исключили теги без опубликованных постов
+                .order_by('name')
+            ),
+        )
+    }
 
 
 @register.inclusion_tag('notes/get_last_posts.html')
@@ -82,13 +64,10 @@ def show_last_posts(count: int = 5) -> dict[str, object]:
     Возвращаемые значения:
     - last_posts (QuerySet/List): Список последних опубликованных статей.
     """
-    try:
-        return {
-            'last_posts': cache.get_or_set(
-                f'last_posts:{count}',
-                lambda: Note.published.get_latest(count),
-                3600,
-            )
-        }
-    except RedisError:
-        return {'last_posts': Note.published.get_latest(count)}
+    # В кеш попадают только заголовок и slug: блок выводит ссылки, а тексты статей раздували бы каждую запись
+    return {
+        'last_posts': get_or_compute(
+            last_posts_key(count),
+            lambda: list(Note.published.get_latest(count).only('title', 'slug')),
+        )
+    }
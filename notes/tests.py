@@ -1,10 +1,46 @@
+import gzip
 import logging
+import tempfile
+from datetime import timedelta
 from http import HTTPStatus
+from importlib import import_module
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipIf
 
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from prometheus_client import REGISTRY
+from redis import RedisError
 
-from notes.models import Note
+from choocha import cache as tiered
+from choocha.instrumentation import timed
+from choocha.metrics import key_family
+from choocha.storage import CompressedManifestStaticFilesStorage
+from notes import content as content_pipeline
+from notes.admin import NotesAdmin
+from notes.benchmarks import generate_data, run_benchmarks, over_budget, compare
+from notes.caching import category_posts_key, tag_posts_key, categories_key, ALL_TAGS_KEY, last_posts_key, \
+    note_row_key, PUBLISHED_COUNT_KEY, post_body_key, page_key, page_lock_key, get_or_compute, CachedValue
+from notes.counters import recount_comments
+from notes.fragments import post_body_version
+from notes.images import generate_derivatives, responsive_content, generation
+from notes.mail import enqueue_email, deliver_pending, deliver
+from notes.models import Note, Category, TagPost, OutgoingEmail, Comment
+from notes.moderation import moderate
+from notes.pagecache import anonymous_cache_page
+from notes.sitemaps import build_section
 
 logger = logging.getLogger(__name__)
 
@@ -71,3 +107,1269 @@ class GetPagesTestCase(TestCase):
 
     def tearDown(self):
         """ Действия после выполнения каждого теста """
+
+
+class CacheInvalidationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create_user(username='author')
+        cls.cat = Category.objects.create(name='Python')
+        cls.tag = TagPost.objects.create(name='Django')
+        cls.note = Note.objects.create(
+            title='Первая статья', cat=cls.cat, author=cls.author, status=Note.Status.PUBLISHED
+        )
+        cls.note.tags.add(cls.tag)
+
+    def setUp(self):
+        cache.clear()
+
+    def fill_cache(self) -> list[str]:
+        keys = [
+            category_posts_key(self.cat.slug),
+            tag_posts_key(self.tag.slug),
+            categories_key(0),
+            categories_key(self.cat.pk),
+            ALL_TAGS_KEY,
+            last_posts_key(5),
+        ]
+        cache.set_many({key: 'stale' for key in keys})
+        return keys
+
+    def test_01_note_save_invalidates_lists(self):
+        keys = self.fill_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.note.status = Note.Status.DRAFT
+            self.note.save()
+        self.assertEqual(cache.get_many(keys), {})
+
+    def test_02_draft_save_keeps_cache(self):
+        draft = Note.objects.create(title='Черновик', cat=self.cat, status=Note.Status.DRAFT)
+        keys = self.fill_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            draft.title = 'Черновик 2'
+            draft.save()
+        self.assertEqual(len(cache.get_many(keys)), len(keys))
+
+    def test_03_tag_removal_invalidates_tag_list(self):
+        self.fill_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.note.tags.clear()
+        self.assertIsNone(cache.get(tag_posts_key(self.tag.slug)))
+        self.assertIsNone(cache.get(ALL_TAGS_KEY))
+        self.assertIsNotNone(cache.get(category_posts_key(self.cat.slug)))
+
+    def test_04_category_save_invalidates_sidebar(self):
+        self.fill_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(pk=self.cat.pk).first().save()
+        self.assertIsNone(cache.get(category_posts_key(self.cat.slug)))
+        self.assertIsNone(cache.get(categories_key(self.cat.pk)))
+
+
+    def test_05_last_posts_cache_only_links(self):
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, self.note.get_absolute_url())
+        last_posts = cache.get(last_posts_key(5)).value
+        self.assertEqual(last_posts, [self.note])
+        self.assertEqual(
+            {field.attname for field in Note._meta.concrete_fields} - last_posts[0].get_deferred_fields(),
+            {'id', 'title', 'slug'},
+        )
+
+
+class CachedNoteListTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cat = Category.objects.create(name='Python')
+        cls.tag = TagPost.objects.create(name='Django')
+        for i in range(7):
+            note = Note.objects.create(title=f'Статья {i}', cat=cls.cat, status=Note.Status.PUBLISHED)
+            note.tags.add(cls.tag)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_category_page_caches_ids_and_rows(self):
+        response = self.client.get(reverse('category', args=[self.cat.slug]))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        expected = list(Note.published.filter(cat=self.cat).values_list('pk', flat=True))
+        self.assertEqual(cache.get(category_posts_key(self.cat.slug)).value, expected)
+        self.assertEqual([post.pk for post in response.context_data['posts']], expected[:5])
+        # Кешируются снимки только для показанной страницы
+        self.assertEqual(len(cache.get_many([note_row_key(pk) for pk in expected])), 5)
+
+    def test_02_second_page_reuses_cached_ids(self):
+        path = reverse('tag', args=[self.tag.slug])
+        self.client.get(path)
+        # Проверка существования метки и снимки двух статей второй страницы
+        with self.assertNumQueries(2):
+            response = self.client.get(path + '?page=2')
+        self.assertEqual(len(response.context_data['posts']), 2)
+        self.assertContains(response, self.cat.name)
+
+
+class SingleFlightCacheTestCase(TestCase):
+    key = 'notes:test:single-flight'
+
+    def setUp(self):
+        cache.clear()
+        self.compute = mock.Mock(return_value='новое')
+
+    def test_01_miss_computes_once(self):
+        self.assertEqual(get_or_compute(self.key, self.compute), 'новое')
+        self.assertEqual(get_or_compute(self.key, self.compute), 'новое')
+        self.compute.assert_called_once()
+        # Ключ блокировки снимается после пересчёта
+        self.assertFalse(cache.has_key(f'{self.key}:lock'))
+
+    def test_02_locked_key_returns_stale_value(self):
+        cache.set(self.key, CachedValue('старое', 0.1, timezone.now().timestamp() - 1))
+        cache.add(f'{self.key}:lock', 1)
+        self.assertEqual(get_or_compute(self.key, self.compute), 'старое')
+        self.compute.assert_not_called()
+
+    def test_03_early_refresh(self):
+        expires = timezone.now().timestamp() + 60
+        cache.set(self.key, CachedValue('старое', 10.0, expires))
+        with mock.patch('notes.caching.random.random', return_value=0.5):
+            self.assertEqual(get_or_compute(self.key, self.compute), 'старое')
+        # Почти единичное random() даёт большой -log(1 - r) и пересчёт задолго до истечения срока
+        with mock.patch('notes.caching.random.random', return_value=0.999999):
+            self.assertEqual(get_or_compute(self.key, self.compute), 'новое')
+        self.compute.assert_called_once()
+
+    def test_04_ttl_is_jittered(self):
+        with mock.patch('notes.caching.random.random', return_value=1.0):
+            get_or_compute(self.key, self.compute, 1000)
+        self.assertLessEqual(cache.get(self.key).expires, timezone.now().timestamp() + 900)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'l2': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-test-l2'},
+})
+class TieredCacheTestCase(TestCase):
+    def setUp(self):
+        tiered._breakers.clear()
+        self.cache = tiered.TieredCache('l2', {'OPTIONS': {'FAILURE_THRESHOLD': 2, 'COOLDOWN': 30}})
+        self.cache.clear()
+
+    def test_01_reads_go_to_l1(self):
+        self.cache.set('key', 'value')
+        with mock.patch.object(self.cache.l2, 'get') as l2_get:
+            self.assertEqual(self.cache.get('key'), 'value')
+        l2_get.assert_not_called()
+        # Запись из другого процесса попадает в L1 при первом чтении
+        self.cache.l2.set('other', 'value')
+        self.assertEqual(self.cache.get('other'), 'value')
+        self.assertEqual(self.cache.l1.get('other'), 'value')
+
+    def test_02_l2_errors_fall_back_to_l1(self):
+        with mock.patch.object(self.cache.l2, 'set', side_effect=RedisError), \
+                mock.patch.object(self.cache.l2, 'add', side_effect=RedisError):
+            self.cache.set('key', 'value')
+            self.assertTrue(self.cache.add('lock', 1))
+            self.assertFalse(self.cache.add('lock', 1))
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_03_breaker_skips_l2_during_cooldown(self):
+        with mock.patch.object(self.cache.l2, 'get', side_effect=RedisError) as l2_get:
+            for _ in range(3):
+                self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(l2_get.call_count, 2)
+        self.assertTrue(self.cache.breaker.is_open)
+
+        self.cache.l2.set('key', 'value')
+        self.assertIsNone(self.cache.get('key'))
+        # После паузы пробный запрос проходит и замыкает выключатель
+        with mock.patch('choocha.cache.time.monotonic', return_value=tiered.time.monotonic() + 31):
+            self.assertEqual(self.cache.get('key'), 'value')
+        self.assertFalse(self.cache.breaker.is_open)
+
+
+class KeysetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cat = Category.objects.create(name='Python')
+        for i in range(12):
+            Note.objects.create(title=f'Статья {i:02}', cat=cls.cat, status=Note.Status.PUBLISHED)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_cursor_walk_matches_offset_pages(self):
+        path = reverse('home')
+        response = self.client.get(path)
+        offset_page_2 = list(self.client.get(path + '?page=2').context_data['posts'])
+        cursor = response.context_data['page_obj'].next_cursor
+
+        response = self.client.get(path + f'?cursor={cursor}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(list(response.context_data['posts']), offset_page_2)
+        self.assertEqual(response.context_data['page_obj'].number, 2)
+
+        last = self.client.get(path + f"?cursor={response.context_data['page_obj'].next_cursor}")
+        self.assertEqual(len(last.context_data['posts']), 2)
+        self.assertFalse(last.context_data['page_obj'].has_next())
+
+        back = self.client.get(path + f"?cursor={last.context_data['page_obj'].previous_cursor}")
+        self.assertEqual(list(back.context_data['posts']), offset_page_2)
+
+    def test_02_invalid_cursor(self):
+        response = self.client.get(reverse('home') + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_03_count_is_cached(self):
+        self.client.get(reverse('home'))
+        self.assertEqual(cache.get(PUBLISHED_COUNT_KEY).value, 12)
+
+    def test_04_list_skips_full_text(self):
+        response = self.client.get(reverse('home'))
+        for post in response.context_data['posts']:
+            self.assertTrue(
+                {'content_short', 'content_full', 'content_full_html', 'search_text'} <= post.get_deferred_fields()
+            )
+
+
+class PublishedCountTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cat = Category.objects.create(name='Python')
+        cls.other_cat = Category.objects.create(name='Go')
+        cls.tag = TagPost.objects.create(name='Django')
+
+    def assertCounts(self, cat: int, other_cat: int, tag: int):
+        self.assertEqual(
+            [Category.objects.get(pk=self.cat.pk).published_count,
+             Category.objects.get(pk=self.other_cat.pk).published_count,
+             TagPost.objects.get(pk=self.tag.pk).published_count],
+            [cat, other_cat, tag],
+        )
+
+    def test_01_lifecycle(self):
+        note = Note.objects.create(title='Статья', cat=self.cat, status=Note.Status.PUBLISHED)
+        note.tags.add(self.tag)
+        self.assertCounts(1, 0, 1)
+
+        note.cat = self.other_cat
+        note.save()
+        self.assertCounts(0, 1, 1)
+
+        note.status = Note.Status.DRAFT
+        note.save()
+        self.assertCounts(0, 0, 0)
+
+        note.status = Note.Status.PUBLISHED
+        note.save()
+        note.tags.clear()
+        self.assertCounts(0, 1, 0)
+
+        note.delete()
+        self.assertCounts(0, 0, 0)
+
+    def test_02_recount_command(self):
+        Note.objects.create(title='Статья', cat=self.cat, status=Note.Status.PUBLISHED)
+        Category.objects.update(published_count=10)
+        call_command('recount_posts', stdout=StringIO())
+        self.assertCounts(1, 0, 0)
+
+    def test_03_admin_actions_with_status_filter(self):
+        note = Note.objects.create(title='Статья', cat=self.cat, status=Note.Status.PUBLISHED)
+        note.tags.add(self.tag)
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        changelist = reverse('admin:notes_note_changelist')
+
+        cache.set(PUBLISHED_COUNT_KEY, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                changelist + f'?status__exact={Note.Status.PUBLISHED}',
+                {'action': 'set_draft', '_selected_action': [note.pk]},
+            )
+        self.assertCounts(0, 0, 0)
+        self.assertIsNone(cache.get(PUBLISHED_COUNT_KEY))
+
+        cache.set(PUBLISHED_COUNT_KEY, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                changelist + f'?status__exact={Note.Status.DRAFT}',
+                {'action': 'set_published', '_selected_action': [note.pk]},
+            )
+        self.assertCounts(1, 0, 1)
+        self.assertIsNone(cache.get(PUBLISHED_COUNT_KEY))
+
+
+class SearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        if connection.vendor == 'sqlite':
+            # Индекс создаётся миграцией; её команды идемпотентны и выполняются здесь для БД без миграций
+            migration = import_module('notes.migrations.0010_note_search_text')
+            with connection.cursor() as cursor:
+                for sql in migration.SQLITE_SCHEMA:
+                    cursor.execute(sql)
+        cat = Category.objects.create(name='Python')
+        Note.objects.create(
+            title='Генераторы', cat=cat, status=Note.Status.PUBLISHED,
+            content_full='<p>Генераторы &amp; итераторы в <b>Python</b> <script>x</script></p>',
+        )
+        Note.objects.create(title='Черновик про генераторы', cat=cat, status=Note.Status.DRAFT)
+        Note.objects.create(title='Декораторы', cat=cat, status=Note.Status.PUBLISHED, content_full='<p>Обёртки</p>')
+
+    def test_01_search_text_is_stripped(self):
+        note = Note.objects.get(title='Генераторы')
+        self.assertEqual(note.search_text, 'Генераторы & итераторы в Python x')
+
+    def test_02_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'итераторы'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual([post.title for post in response.context_data['posts']], ['Генераторы'])
+        self.assertContains(response, '<mark>итераторы</mark>')
+        self.assertContains(response, '&amp; <mark>')
+
+    def test_03_empty_query(self):
+        response = self.client.get(reverse('search'), {'q': ' "* '})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.context_data['posts']), 0)
+
+
+class NoteExcerptTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cat = Category.objects.create(name='Python')
+
+    def test_01_excerpt_from_content(self):
+        note = Note.objects.create(
+            title='Статья', cat=self.cat, status=Note.Status.PUBLISHED,
+            content_short='<p>Первый&nbsp;абзац</p><p>' + 'слово ' * 50 + '</p>',
+        )
+        self.assertEqual(note.excerpt, ('Первый абзац ' + 'слово ' * 50)[:160])
+        response = self.client.get(note.get_absolute_url())
+        self.assertEqual(response.context_data['page_description'], f'Просмотр статьи: {note.excerpt}')
+
+    def test_02_meta_description_wins(self):
+        note = Note.objects.create(
+            title='Статья', cat=self.cat, content_short='<p>Текст</p>', meta_description=' Описание '
+        )
+        self.assertEqual(note.excerpt, 'Описание')
+
+    def test_03_backfill(self):
+        note = Note.objects.create(title='Статья', cat=self.cat, content_short='<p>Текст</p>')
+        Note.objects.filter(pk=note.pk).update(excerpt='', search_text='')
+        call_command('backfill_note_fields', stdout=StringIO())
+        note.refresh_from_db()
+        self.assertEqual((note.excerpt, note.search_text), ('Текст', 'Текст'))
+
+    def test_04_backfill_only_requested_fields(self):
+        note = Note.objects.create(title='Статья', cat=self.cat, content_short='<p>Текст</p>')
+        Note.objects.filter(pk=note.pk).update(excerpt='', search_text='')
+        with mock.patch('notes.models.render_content') as render:
+            call_command('backfill_note_fields', '--fields', 'search_text', stdout=StringIO())
+        render.assert_not_called()
+        note.refresh_from_db()
+        self.assertEqual((note.excerpt, note.search_text), ('', 'Текст'))
+
+
+class ContentPipelineTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cat = Category.objects.create(name='Python')
+
+    def render(self, html):
+        return content_pipeline.render_content(html)
+
+    def test_01_allowlist(self):
+        html = (
+            '<p onclick="steal()">Текст <b>жирный</b> <custom>внутри</custom></p>'
+            '<script>alert(1)</script><!-- комментарий --><iframe src="https://example.com"><p>x</p></iframe>'
+            '<p><a href="java\tscript:alert(1)">плохая</a> <a href="https://example.com" target="_blank">хорошая</a></p>'
+            '<p class="ok bad:class" style="color: red">Абзац</p>'
+        )
+        self.assertEqual(
+            self.render(html),
+            '<p>Текст <b>жирный</b> внутри</p>'
+            '<p><a>плохая</a> <a href="https://example.com" rel="noopener noreferrer" target="_blank">хорошая</a></p>'
+            '<p class="ok">Абзац</p>',
+        )
+
+    def test_02_normalize_and_minify(self):
+        html = '<p>&nbsp;</p>\n<ul>\n  <li>Один   пункт</li>\n  <li>Два</li>\n</ul>\n<pre><code>a  =  1\n  b</code></pre>'
+        self.assertEqual(
+            self.render(html), '<ul><li>Один пункт</li><li>Два</li></ul><pre><code>a  =  1\n  b</code></pre>',
+        )
+        self.assertEqual(self.render('  '), '')
+        self.assertEqual(self.render(None), '')
+
+    def test_03_images(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        buffer = BytesIO()
+        Image.new('RGB', (300, 200), 'green').save(buffer, 'PNG')
+        with override_settings(MEDIA_ROOT=tmp.name):
+            default_storage.save('uploads/photo.png', ContentFile(buffer.getvalue()))
+            result = self.render(
+                '<figure class="image image_resized" style="width:50%;"><img src="/media/uploads/photo.png"></figure>'
+                '<p><img src="https://example.com/remote.png" alt="Внешняя" style="background: url(x)"></p>'
+            )
+        self.assertEqual(
+            result,
+            '<figure class="image image_resized" style="width:50%;">'
+            '<img alt="" decoding="async" height="200" loading="lazy" src="/media/uploads/photo.png" width="300"/></figure>'
+            '<p><img alt="Внешняя" decoding="async" loading="lazy" src="https://example.com/remote.png"/></p>',
+        )
+
+    @skipIf(content_pipeline.highlight is None, 'Pygments не установлен')
+    def test_04_code_highlighting(self):
+        result = self.render('<pre><code class="language-python">if a &lt; b:\n    pass</code></pre>')
+        self.assertIn('<span style="color: #008000; font-weight: bold">if</span>', result)
+        self.assertIn('&lt;', result)
+        self.assertNotIn('<script', self.render('<pre><code class="language-unknown">&lt;script&gt;</code></pre>'))
+
+    def test_05_code_without_pygments(self):
+        html = '<pre><code class="language-python">x = 1</code></pre>'
+        with mock.patch('notes.content.highlight', None):
+            self.assertEqual(self.render(html), html)
+
+    def test_06_stored_on_save_and_rendered(self):
+        note = Note.objects.create(
+            title='Статья', cat=self.cat, status=Note.Status.PUBLISHED,
+            content_short='<p>Кратко<script>alert(1)</script></p>',
+            content_full='<p>Полностью</p>\n<p><img src="https://example.com/a.png"></p>',
+        )
+        self.assertEqual(note.content_short_html, '<p>Кратко</p>')
+        self.assertEqual(
+            note.content_full_html,
+            '<p>Полностью</p><p><img alt="" decoding="async" loading="lazy" src="https://example.com/a.png"/></p>',
+        )
+        cache.clear()
+        self.assertNotContains(self.client.get(reverse('home')), 'alert(1)')
+        self.assertContains(self.client.get(note.get_absolute_url()), note.content_full_html, html=True)
+
+        Note.objects.filter(pk=note.pk).update(content_short_html='', content_full_html='')
+        cache.set(note_row_key(note.pk), 'снимок с пустым HTML')
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                'backfill_note_fields', '--fields', 'content_short_html', 'content_full_html', stdout=StringIO(),
+            )
+        note.refresh_from_db()
+        self.assertEqual(note.content_short_html, '<p>Кратко</p>')
+        self.assertIn('<p>Полностью</p>', note.content_full_html)
+        self.assertIsNone(cache.get(note_row_key(note.pk)))
+
+    def test_07_editor_markup(self):
+        # Данные CKEditor 43 для кнопок панели 'extends': заголовок, шрифты, отступ, списки, видео, задачи
+        html = (
+            '<h1>Заголовок</h1>'
+            '<p style="margin-left:40px;"><span style="font-family:\'Courier New\', Courier, monospace;">код</span> '
+            '<span style="color:hsl(0, 75%, 60%);">красный</span> '
+            '<span style="background-color:hsl(60, 75%, 60%);">фон</span> '
+            '<span style="font-size:18px;">крупный</span> <span class="text-big">большой</span> '
+            '<mark class="marker-yellow">маркер</mark></p>'
+            '<ol reversed="reversed" start="3" style="list-style-type:lower-roman;"><li>Пункт</li></ol>'
+            '<figure class="media"><oembed url="https://www.youtube.com/watch?v=dQw4w9WgXcQ"></oembed></figure>'
+            '<ul class="todo-list">'
+            '<li><label class="todo-list__label"><input checked="checked" disabled="disabled" type="checkbox"/>'
+            '<span class="todo-list__label__description">Сделано</span></label></li>'
+            '<li><label class="todo-list__label"><input disabled="disabled" type="checkbox"/>'
+            '<span class="todo-list__label__description">Не сделано</span></label></li></ul>'
+        )
+        self.assertEqual(self.render(html), html)
+
+    def test_08_editor_table(self):
+        html = (
+            '<figure class="table" style="float:left;width:50%;">'
+            '<table class="ck-table-resized" style="background-color:hsl(0, 0%, 90%);border:1px solid hsl(0, 0%, 0%);">'
+            '<colgroup><col style="width:40%;"/><col style="width:60%;"/></colgroup>'
+            '<thead><tr><th style="text-align:center;">А</th><th>Б</th></tr></thead>'
+            '<tbody><tr><td colspan="2" style="background-color:hsl(120, 75%, 60%);border-style:dotted;vertical-align:top;">'
+            'В</td></tr></tbody></table><figcaption>Подпись</figcaption></figure>'
+        )
+        self.assertEqual(self.render(html), html)
+
+    def test_09_unsafe_editor_markup(self):
+        self.assertEqual(
+            self.render(
+                '<p style="margin-left:40px;color:red"><span style="color:red;background:url(https://example.com/x.png);'
+                'font-size:expression(alert(1));font-weight:bold">текст</span></p>'
+                '<figure class="media"><oembed url="javascript:alert(1)"></oembed></figure>'
+                '<p>Поле <input type="text" name="q" value="поле"><input type="checkbox" onclick="steal()"></p>'
+            ),
+            '<p style="margin-left:40px;"><span style="color:red;">текст</span></p>'
+            '<figure class="media"><oembed></oembed></figure><p>Поле <input type="checkbox"/></p>',
+        )
+
+    def test_10_markup_declarations_removed(self):
+        for html in (
+            '<p>a<![CDATA[><img src=x onerror=alert(1)>]]></p>',
+            '<!DOCTYPE html><p>a</p>',
+            '<!x <img src=x onerror=alert(1)>><p>a</p>',
+            '<?x <img src=x onerror=alert(1)> ?><p>a</p>',
+            '<p>a<!-- <img src=x onerror=alert(1)> --></p>',
+        ):
+            with self.subTest(html=html):
+                result = self.render(html)
+                self.assertNotIn('onerror', result)
+                self.assertNotIn('<!', result)
+                self.assertNotIn('<?', result)
+                self.assertIn('<p>a', result)
+
+    def test_11_allowlist_follows_toolbar(self):
+        tags, attributes, styles = content_pipeline.editor_allowlist({
+            'default': {'toolbar': {'items': ['bold', '|', 'mediaEmbed']}, 'image': {'toolbar': ['imageStyle:side']}},
+        })
+        self.assertIn('strong', tags)
+        self.assertEqual(attributes['oembed'], {'url'})
+        self.assertNotIn('h1', tags)
+        self.assertNotIn('input', tags)
+        self.assertEqual(styles, {})
+        self.assertEqual(
+            content_pipeline.editor_allowlist({})[0], frozenset(content_pipeline.BASE_MARKUP),
+        )
+
+
+class MailQueueTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='reader', password='12345QPow!')
+        cls.note = Note.objects.create(
+            title='Статья', cat=Category.objects.create(name='Python'), status=Note.Status.PUBLISHED
+        )
+
+    @mock.patch('notes.mixins.settings.EMAIL_ADMIN', 'admin@example.com')
+    def test_01_comment_only_enqueues(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('add_comment', args=[self.note.slug]), {'body': 'Спасибо!'})
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.Status.PENDING).count(), 1)
+
+        call_command('send_queued_mail', once=True)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Спасибо!', mail.outbox[0].body)
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.Status.SENT)
+
+    def test_02_failed_delivery_is_retried_later(self):
+        email = enqueue_email('Тема', 'Текст', ['admin@example.com'])
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=OSError('relay down')):
+            self.assertEqual(deliver_pending(), 0)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.Status.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        # До наступления времени повтора письмо не отправляется
+        self.assertEqual(deliver_pending(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_03_claimed_before_sending(self):
+        email = enqueue_email('Тема', 'Текст', ['admin@example.com'])
+        depth = len(connection.atomic_blocks)
+        statuses = []
+
+        def send(message):
+            # Во время отправки письмо уже забрано, и транзакция выборки завершена
+            statuses.append((OutgoingEmail.objects.get(pk=email.pk).status, len(connection.atomic_blocks)))
+            return 1
+
+        with mock.patch('django.core.mail.EmailMessage.send', autospec=True, side_effect=send):
+            self.assertEqual(deliver_pending(), 1)
+        self.assertEqual(statuses, [(OutgoingEmail.Status.SENDING, depth)])
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.Status.SENT)
+
+    def test_04_expired_claim_is_taken_again(self):
+        email = enqueue_email('Тема', 'Текст', ['admin@example.com'])
+        OutgoingEmail.objects.filter(pk=email.pk).update(
+            status=OutgoingEmail.Status.SENDING, next_attempt_at=timezone.now() + timedelta(minutes=1),
+        )
+        self.assertEqual(deliver_pending(), 0)
+        OutgoingEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_pending(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class PostFragmentCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='reader')
+        cls.note = Note.objects.create(
+            title='Статья', cat=Category.objects.create(name='Python'), status=Note.Status.PUBLISHED,
+            content_full='<p>Полный текст</p>',
+        )
+        Comment.objects.create(post=cls.note, user=cls.user, body='Активный', status=Comment.Status.ACTIVE)
+        Comment.objects.create(post=cls.note, user=cls.user, body='Скрытый', status=Comment.Status.HIDE)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_body_and_comments_are_cached(self):
+        response = self.client.get(self.note.get_absolute_url())
+        self.assertContains(response, '<p>Полный текст</p>')
+        self.assertContains(response, 'Активный')
+        self.assertNotContains(response, 'Скрытый')
+        self.assertIsNotNone(cache.get(post_body_key(self.note.pk, post_body_version(self.note))))
+
+    def test_02_author_sees_own_hidden_comment_with_actions(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.note.get_absolute_url())
+        self.assertContains(response, 'Скрытый')
+        self.assertContains(response, 'Редактировать', count=2)
+
+    def test_03_new_version_after_update(self):
+        self.client.get(self.note.get_absolute_url())
+        self.note.content_full = '<p>Новый текст</p>'
+        self.note.save()
+        response = self.client.get(self.note.get_absolute_url() + '?v=2')
+        self.assertContains(response, '<p>Новый текст</p>')
+
+    def test_04_new_version_after_pipeline_change(self):
+        # HTML пересчитан командой через bulk_update: time_update прежний, меняется версия обработки
+        self.client.get(self.note.get_absolute_url())
+        Note.objects.filter(pk=self.note.pk).update(content_full_html='<p>Пересчитанный текст</p>')
+        with mock.patch('notes.fragments.CONTENT_PIPELINE_VERSION', content_pipeline.CONTENT_PIPELINE_VERSION + 1):
+            response = self.client.get(self.note.get_absolute_url() + '?v=3')
+        self.assertContains(response, '<p>Пересчитанный текст</p>')
+
+
+class CommentThreadTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create_user(username='author')
+        cls.other = get_user_model().objects.create_user(username='other')
+        cls.note = Note.objects.create(title='Обсуждаемая', cat=Category.objects.create(name='Python'),
+                                       status=Note.Status.PUBLISHED)
+        Comment.objects.bulk_create(
+            Comment(post=cls.note, user=cls.other, body=f'Комментарий {i}', status=Comment.Status.ACTIVE)
+            for i in range(3)
+        )
+        Comment.objects.create(post=cls.note, user=cls.author, body='На модерации')
+        Comment.objects.create(post=cls.note, user=cls.other, body='Удалённый', status=Comment.Status.DELETED)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_visibility_filtered_in_query(self):
+        anonymous = Comment.objects.filter(post=self.note).visible_to(mock.Mock(is_staff=False, is_authenticated=False))
+        self.assertEqual(anonymous.count(), 3)
+        self.assertEqual(Comment.objects.filter(post=self.note).visible_to(self.author).count(), 4)
+        self.assertEqual(Comment.objects.filter(post=self.note).visible_to(mock.Mock(is_staff=True)).count(), 5)
+
+    @mock.patch('notes.mixins.CommentThreadMixin.comments_page_size', 2)
+    def test_02_post_shows_first_page_and_visible_count(self):
+        response = self.client.get(self.note.get_absolute_url())
+        self.assertContains(response, 'Комментарии (3)')
+        self.assertEqual([c.body for c in response.context['comments']], ['Комментарий 0', 'Комментарий 1'])
+        self.assertNotContains(response, 'Удалённый')
+
+        response = self.client.get(response.context['next_comments_url'])
+        self.assertEqual([c.body for c in response.context['comments']], ['Комментарий 2'])
+        self.assertIsNone(response.context['next_comments_url'])
+
+    def test_03_cursor_cannot_point_to_hidden_comment(self):
+        hidden = Comment.objects.get(body='Удалённый')
+        url = reverse('post_comments', kwargs={'post_slug': self.note.slug})
+        self.assertEqual(self.client.get(f'{url}?after={hidden.pk}').status_code, 404)
+        self.assertEqual(self.client.get(f'{url}?after=abc').status_code, 404)
+
+
+class CommentCounterTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='reader')
+        cls.staff = get_user_model().objects.create_user(username='moderator', is_staff=True)
+        cls.note = Note.objects.create(title='Обсуждаемая', cat=Category.objects.create(name='Python'),
+                                       status=Note.Status.PUBLISHED)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_lifecycle_updates_counters(self):
+        comment = Comment.objects.create(post=self.note, user=self.user, body='На модерации')
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.comment_count, self.note.last_comment_at), (0, None))
+
+        self.client.force_login(self.staff)
+        self.client.get(reverse('approve_comment', args=[comment.pk]))
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.comment_count, self.note.last_comment_at), (1, comment.created))
+
+        comment.status = Comment.Status.HIDE
+        comment.save()
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.comment_count, 0)
+
+        Comment.objects.create(post=self.note, user=self.staff, body='Ответ модератора')
+        comment.delete()
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.comment_count, 1)
+
+    def test_02_note_delete_skips_comment_recount(self):
+        def delete_note_queries(comments: int) -> int:
+            note = Note.objects.create(title=f'Удаляемая {comments}', cat=self.note.cat, status=Note.Status.PUBLISHED)
+            Comment.objects.bulk_create(
+                Comment(post=note, user=self.user, body='Ответ', status=Comment.Status.ACTIVE) for _ in range(comments)
+            )
+            with CaptureQueriesContext(connection) as queries, \
+                    mock.patch('notes.signals.recount_comments') as recount:
+                note.delete()
+            recount.assert_not_called()
+            return len(queries)
+
+        self.assertEqual(delete_note_queries(1), delete_note_queries(5))
+
+    def test_03_listing_shows_count_from_row_snapshot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.note, user=self.staff, body='Одобренный')
+        self.assertContains(self.client.get(reverse('category', args=[self.note.cat.slug])), 'Комментарии: 1')
+        self.assertEqual(recount_comments(), 1)
+
+
+class ModerationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='reader')
+        cls.staff = get_user_model().objects.create_user(username='moderator', is_staff=True)
+        cls.note = Note.objects.create(title='Обсуждаемая', cat=Category.objects.create(name='Python'),
+                                       status=Note.Status.PUBLISHED)
+        Comment.objects.bulk_create(Comment(post=cls.note, user=cls.user, body=f'Спам {i}') for i in range(3))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.staff)
+
+    def test_01_bulk_approve_in_constant_queries(self):
+        ids = list(Comment.objects.values_list('pk', flat=True))
+        # Выборка строк, UPDATE статуса, пересчёт счётчиков, адреса страниц статей (и SAVEPOINT/RELEASE)
+        with self.assertNumQueries(6):
+            self.assertEqual(moderate(Comment.objects.filter(pk__in=ids), Comment.Status.ACTIVE), 3)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.comment_count, 3)
+        self.assertEqual(moderate(Comment.objects.filter(pk__in=ids), Comment.Status.ACTIVE), 0)
+
+    @mock.patch('notes.views.MODERATION_PAGE_SIZE', 2)
+    def test_02_queue_pages_and_actions(self):
+        response = self.client.get(reverse('moderation_queue'))
+        self.assertEqual([c.body for c in response.context['comments']], ['Спам 0', 'Спам 1'])
+        response = self.client.get(reverse('moderation_queue') + f"?after={response.context['next_after']}")
+        self.assertEqual([c.body for c in response.context['comments']], ['Спам 2'])
+
+        spam = Comment.objects.filter(body__in=['Спам 0', 'Спам 2']).values_list('pk', flat=True)
+        self.client.post(reverse('moderation_queue'), {'action': 'delete', 'ids': list(spam)})
+        self.assertEqual(Comment.objects.filter(status=Comment.Status.DELETED).count(), 2)
+        self.assertEqual([c.body for c in self.client.get(reverse('moderation_queue')).context['comments']], ['Спам 1'])
+
+    def test_03_queue_requires_moderator(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('moderation_queue')).status_code, HTTPStatus.FORBIDDEN)
+
+
+class AnonymousPageCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='reader')
+        cls.note = Note.objects.create(title='Статья', cat=Category.objects.create(name='Python'),
+                                       status=Note.Status.PUBLISHED)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_anonymous_pages_served_from_cache(self):
+        self.assertEqual(self.client.get(reverse('home'))['X-Page-Cache'], 'miss')
+        # Cookie CSRF не делает посетителя неанонимным
+        self.client.cookies['csrftoken'] = 'token'
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Статья')
+
+    def test_02_session_bypasses_cache(self):
+        self.client.get(self.note.get_absolute_url())
+        self.client.force_login(self.user)
+        response = self.client.get(self.note.get_absolute_url())
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertContains(response, 'Добро пожаловать, reader')
+
+    def test_03_stale_page_served_while_other_worker_rebuilds(self):
+        self.client.get(reverse('home'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Note.objects.create(title='Новая', cat=self.note.cat, status=Note.Status.PUBLISHED)
+        cache.add(page_lock_key(reverse('home')), 1)
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response['X-Page-Cache'], 'stale')
+        self.assertNotContains(response, 'Новая')
+
+        cache.delete(page_lock_key(reverse('home')))
+        self.assertContains(self.client.get(reverse('home')), 'Новая')
+        self.assertEqual(self.client.get(reverse('home'))['X-Page-Cache'], 'hit')
+
+    def test_04_comment_change_purges_post_page(self):
+        self.client.get(self.note.get_absolute_url())
+        staff = get_user_model().objects.create_user(username='moderator', is_staff=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.note, user=staff, body='Одобренный')
+        response = self.client.get(self.note.get_absolute_url())
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Одобренный')
+
+    def test_05_query_params(self):
+        home = reverse('home')
+        self.client.get(home + '?page=1')
+        self.assertEqual(self.client.get(home + '?utm_source=mail&page=1&gclid=x')['X-Page-Cache'], 'hit')
+        self.assertEqual(self.client.get(home + '?utm_source=mail')['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(home)['X-Page-Cache'], 'hit')
+        # Неизвестный параметр - кеш не читается и не пополняется
+        response = self.client.get(home + '?random=123')
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertIsNone(cache.get(page_key(home + '?random=123')))
+
+    def test_06_hit_keeps_view_headers(self):
+        def view(request):
+            response = HttpResponse('<p>Страница</p>', content_type='text/html; charset=utf-8')
+            response['Vary'] = 'Accept-Language'
+            response['Cache-Control'] = 'max-age=60'
+            response['Content-Language'] = 'ru'
+            return response
+
+        cached_view = anonymous_cache_page(view)
+        self.assertEqual(cached_view(RequestFactory().get('/page/'))['X-Page-Cache'], 'miss')
+        response = cached_view(RequestFactory().get('/page/'))
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertEqual(response.content, '<p>Страница</p>'.encode())
+        self.assertEqual(
+            [response[name] for name in ('Content-Type', 'Vary', 'Cache-Control', 'Content-Language')],
+            ['text/html; charset=utf-8', 'Accept-Language', 'max-age=60', 'ru'],
+        )
+
+
+class FileServingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        (self.root / "media").mkdir()
+        (self.root / "static").mkdir()
+        (self.root / "media" / "file.txt").write_bytes(b"0123456789")
+        css = b"body { color: red; }\n" * 50
+        (self.root / "static" / "styles.0123456789ab.css").write_bytes(css)
+        (self.root / "static" / "styles.0123456789ab.css.gz").write_bytes(gzip.compress(css))
+        settings_override = override_settings(
+            MEDIA_ROOT=self.root / "media", STATIC_ROOT=self.root / "static", SENDFILE_BACKEND="",
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_01_media_conditional_get(self):
+        response = self.client.get("/media/file.txt")
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+        response = self.client.get("/media/file.txt", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_02_media_range(self):
+        response = self.client.get("/media/file.txt", HTTP_RANGE="bytes=2-4")
+        self.assertEqual(response.status_code, HTTPStatus.PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), b"234")
+        self.assertEqual(response["Content-Range"], "bytes 2-4/10")
+        response = self.client.get("/media/file.txt", HTTP_RANGE="bytes=20-")
+        self.assertEqual(response.status_code, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        response = self.client.get("/media/file.txt", HTTP_RANGE="bytes=-0")
+        self.assertEqual(response.status_code, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        response = self.client.get("/media/file.txt", HTTP_RANGE="bytes=-3")
+        self.assertEqual(b"".join(response.streaming_content), b"789")
+
+    def test_03_static_precompressed_and_immutable(self):
+        response = self.client.get("/static/styles.0123456789ab.css", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        for accept_encoding in ("gzip;q=0, deflate", "br", "*;q=0.5, gzip;q=0"):
+            response = self.client.get("/static/styles.0123456789ab.css", HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertFalse(response.has_header("Content-Encoding"), accept_encoding)
+        response = self.client.get("/static/styles.0123456789ab.css", HTTP_ACCEPT_ENCODING="br;q=0, *")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+    def test_04_range_error_keeps_own_headers(self):
+        path = "/static/styles.0123456789ab.css"
+        response = self.client.get(path, HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=0-1")
+        self.assertEqual(response.status_code, HTTPStatus.PARTIAL_CONTENT)
+        self.assertEqual((response["Content-Type"], response["Content-Encoding"]), ("text/css", "gzip"))
+        # Тело ответа 416 - не данные файла: ни его типа, ни сжатия у него нет
+        response = self.client.get(path, HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=100000-")
+        self.assertEqual(response.status_code, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertNotEqual(response["Content-Type"], "text/css")
+
+    def test_05_sendfile_and_traversal(self):
+        with override_settings(SENDFILE_BACKEND="nginx"):
+            response = self.client.get("/media/file.txt")
+        self.assertEqual(response["X-Accel-Redirect"], "/protected/media/file.txt")
+        with override_settings(SENDFILE_BACKEND="nginx"):
+            response = self.client.get("/static/styles.0123456789ab.css", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["X-Accel-Redirect"], "/protected/static/styles.0123456789ab.css.gz")
+        self.assertEqual((response["Content-Type"], response["Content-Encoding"]), ("text/css", "gzip"))
+        self.assertEqual(self.client.get("/media/../static/styles.0123456789ab.css").status_code, HTTPStatus.NOT_FOUND)
+
+    def test_06_storage_compresses_text_files(self):
+        storage = CompressedManifestStaticFilesStorage(location=self.root / "static")
+        self.assertEqual(storage.compress("styles.0123456789ab.css")[0], "styles.0123456789ab.css.gz")
+        self.assertEqual(storage.compress("missing.png"), [])
+
+
+class ImageDerivativesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        buffer = BytesIO()
+        Image.new("RGB", (800, 400), "red").save(buffer, "PNG")
+        self.name = default_storage.save("uploads/photo.png", ContentFile(buffer.getvalue()))
+
+    def test_01_derivatives_are_generated_once(self):
+        created = generate_derivatives(self.name)
+        self.assertIn("derivatives/uploads/photo-w320.webp", created)
+        self.assertIn("derivatives/uploads/photo-w800.webp", created)
+        self.assertNotIn("derivatives/uploads/photo-w1024.webp", created)
+        with default_storage.open("derivatives/uploads/photo-w320.webp") as f:
+            self.assertEqual(Image.open(f).size, (320, 160))
+        self.assertEqual(generate_derivatives(self.name), [])
+
+    def test_02_content_images_get_srcset(self):
+        html = '<p><img src="/media/uploads/photo.png" alt=""></p>'
+        self.assertEqual(responsive_content(html), html)
+        generate_derivatives(self.name)
+        result = responsive_content(html)
+        self.assertIn('<picture><source type="image/webp"', result)
+        self.assertIn("/media/derivatives/uploads/photo-w640.webp 640w", result)
+        self.assertIn('<img src="/media/uploads/photo.png" alt=""></picture>', result)
+
+    def test_03_worker_processes_note_content(self):
+        Note.objects.create(
+            title="С картинкой", cat=Category.objects.create(name="Фото"),
+            content_full='<img src="/media/uploads/photo.png">',
+        )
+        call_command("generate_image_derivatives", "--once", stdout=StringIO())
+        self.assertTrue(default_storage.exists("derivatives/uploads/photo-w640.webp"))
+        self.assertEqual(generation(), 1)
+
+    def test_04_worker_skips_failing_images(self):
+        default_storage.save("uploads/short.png", default_storage.open(self.name))
+        Note.objects.create(
+            title="С картинками", cat=Category.objects.create(name="Фото"),
+            content_short='<img src="/media/uploads/short.png">',
+            content_full='<img src="/media/uploads/broken.png"><img src="/media/uploads/photo.png">',
+        )
+
+        def generate(name, *args, **kwargs):
+            if name == "uploads/broken.png":
+                raise MemoryError("decompression bomb")
+            return generate_derivatives(name, *args, **kwargs)
+
+        with mock.patch("notes.management.commands.generate_image_derivatives.generate_derivatives", generate), \
+                self.assertLogs("notes.management.commands.generate_image_derivatives", "ERROR"):
+            call_command("generate_image_derivatives", "--once", stdout=StringIO())
+        self.assertTrue(default_storage.exists("derivatives/uploads/photo-w640.webp"))
+        self.assertTrue(default_storage.exists("derivatives/uploads/short-w640.webp"))
+
+
+class ImageMetadataTestCase(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        buffer = BytesIO()
+        Image.new("RGB", (300, 200), "blue").save(buffer, "PNG")
+        self.content = buffer.getvalue()
+        self.cat = Category.objects.create(name="Фото")
+
+    def test_01_metadata_filled_on_upload(self):
+        note = Note(title="Картинка", cat=self.cat)
+        note.image = ContentFile(self.content, name="photo.png")
+        note.save()
+        note = Note.objects.get(pk=note.pk)
+        self.assertEqual((note.image_width, note.image_height, note.image_size), (300, 200, len(self.content)))
+        self.assertEqual(len(note.image_hash), 64)
+
+        note.image = None
+        note.save()
+        self.assertEqual((note.image_width, note.image_size, note.image_hash), (None, None, ""))
+
+    def test_02_backfill_command(self):
+        name = default_storage.save("images/legacy.png", ContentFile(self.content))
+        note = Note.objects.create(title="Старая", cat=self.cat)
+        Note.objects.filter(pk=note.pk).update(image=name)
+        out = StringIO()
+        call_command("backfill_image_metadata", stdout=out)
+        note.refresh_from_db()
+        self.assertEqual((note.image_width, note.image_height), (300, 200))
+        self.assertIn("Обновлено статей: 1", out.getvalue())
+
+    def test_03_admin_size_without_file_access(self):
+        note = Note(title="Без файла", cat=self.cat, image="images/missing.png", image_width=10, image_height=20, image_size=2048)
+        self.assertEqual(NotesAdmin.post_image_size(note), "10x20, 2,0\xa0КБ")
+
+
+class SitemapTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cat = Category.objects.create(name="Python")
+        Category.objects.create(name="Пустая")
+        cls.note = Note.objects.create(title="Опубликованная", cat=cls.cat, status=Note.Status.PUBLISHED)
+        Note.objects.create(title="Черновик", cat=cls.cat)
+
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        settings_override = override_settings(SITEMAP_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def build(self):
+        call_command("build_sitemaps", stdout=StringIO())
+
+    def test_01_index_and_shards(self):
+        # Запрос карту не строит
+        self.assertEqual(self.client.get("/sitemap.xml").status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        self.build()
+        response = self.client.get("/sitemap.xml")
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        index = b"".join(response.streaming_content).decode()
+        self.assertIn("/sitemap-notes-1.xml</loc>", index)
+        self.assertIn("/sitemap-categories-1.xml</loc>", index)
+        self.assertNotIn("sitemap-tags", index)
+
+        shard = b"".join(self.client.get("/sitemap-categories-1.xml").streaming_content).decode()
+        self.assertIn("/category/python/", shard)
+        self.assertNotIn("/category/pustaia/", shard)
+        self.assertTrue((self.root / "sitemap-notes-1.xml.gz").is_file())
+        self.assertEqual((self.root / "sitemap-notes-1.xml.gz").stat().st_mode & 0o777, 0o644)
+        self.assertEqual(self.client.get("/sitemap-notes-2.xml").status_code, HTTPStatus.NOT_FOUND)
+
+    def test_02_conditional_get(self):
+        self.build()
+        etag = self.client.get("/sitemap-notes-1.xml")["ETag"]
+        response = self.client.get("/sitemap-notes-1.xml", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_03_only_changed_section_is_rebuilt(self):
+        self.build()
+        categories_mtime = (self.root / "sitemap-categories-1.xml").stat().st_mtime_ns
+        self.note.content_full = "<p>Обновлённый текст</p>"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.note.save()
+        with mock.patch("notes.sitemaps.build_section", wraps=build_section) as build:
+            # Устаревший раздел отдаётся как есть, перестраивает его обработчик
+            self.assertEqual(self.client.get("/sitemap-notes-1.xml").status_code, HTTPStatus.OK)
+            build.assert_not_called()
+            self.build()
+            shard = b"".join(self.client.get("/sitemap-notes-1.xml").streaming_content).decode()
+        self.assertEqual([call.args[0] for call in build.call_args_list], ["notes"])
+        self.assertIn(f"<lastmod>{self.note.time_update:%Y-%m-%d}</lastmod>", shard)
+        self.assertEqual((self.root / "sitemap-categories-1.xml").stat().st_mtime_ns, categories_mtime)
+
+
+class FeedTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cat = Category.objects.create(name="Python")
+        cls.tag = TagPost.objects.create(name="django")
+        cls.note = Note.objects.create(title="Опубликованная", cat=cls.cat, status=Note.Status.PUBLISHED)
+        cls.note.tags.add(cls.tag)
+        Note.objects.create(title="Черновик", cat=cls.cat)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_rss_and_conditional_get(self):
+        response = self.client.get(reverse("feed_rss"))
+        self.assertEqual(response["Content-Type"], "application/rss+xml; charset=utf-8")
+        self.assertContains(response, "Опубликованная")
+        self.assertNotContains(response, "Черновик")
+        response = self.client.get(reverse("feed_rss"), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_02_category_and_tag_feeds(self):
+        response = self.client.get(reverse("category_feed_atom", kwargs={"cat_slug": self.cat.slug}))
+        self.assertContains(response, "<title>choocha.ru: Python</title>")
+        self.assertContains(response, "Опубликованная")
+        response = self.client.get(reverse("tag_feed_rss", kwargs={"tag_slug": self.tag.slug}))
+        self.assertContains(response, "Опубликованная")
+        self.assertEqual(self.client.get(reverse("tag_feed_rss", kwargs={"tag_slug": "missing"})).status_code, 404)
+
+    def test_03_feed_rendered_once_until_change(self):
+        # Разные query string - мимо кеша страниц, но с тем же ключом ленты
+        self.client.get(reverse("feed_rss"))
+        with self.assertNumQueries(0):
+            self.client.get(reverse("feed_rss") + "?second")
+        with self.captureOnCommitCallbacks(execute=True):
+            Note.objects.create(title="Свежая", cat=self.cat, status=Note.Status.PUBLISHED)
+        self.assertContains(self.client.get(reverse("feed_rss") + "?third"), "Свежая")
+
+
+class ApiTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username="reader", password="pass")
+        cls.cat = Category.objects.create(name="Python")
+        cls.tag = TagPost.objects.create(name="django")
+        cls.note = Note.objects.create(
+            title="Опубликованная", cat=cls.cat, status=Note.Status.PUBLISHED, author=cls.user,
+            content_short="<p>Кратко</p>", content_full="<p>Полный текст</p>",
+        )
+        cls.note.tags.add(cls.tag)
+        Note.objects.create(title="Черновик", cat=cls.cat)
+        Comment.objects.create(post=cls.note, user=cls.user, body="Одобренный", status=Comment.Status.ACTIVE)
+        Comment.objects.create(post=cls.note, user=cls.user, body="На модерации")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_list_without_full_content(self):
+        response = self.client.get(reverse("api-note-list"))
+        results = response.json()["results"]
+        self.assertEqual([note["title"] for note in results], ["Опубликованная"])
+        self.assertNotIn("content_full", results[0])
+        self.assertEqual(results[0]["category"], {"slug": self.cat.slug, "name": "Python"})
+        self.assertEqual(results[0]["tags"], [{"slug": self.tag.slug, "name": "django"}])
+        self.assertEqual(results[0]["author"], "reader")
+
+    def test_02_sparse_fields_load_only_requested_columns(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("api-note-list") + "?fields=slug,title")
+        self.assertEqual(response.json()["results"], [{"slug": self.note.slug, "title": "Опубликованная"}])
+        self.assertEqual(self.client.get(reverse("api-note-list") + f"?tag={self.tag.slug}").json()["results"][0]["slug"],
+                         self.note.slug)
+        self.assertEqual(self.client.get(reverse("api-note-list") + "?category=missing").json()["results"], [])
+
+    def test_03_detail_etag_and_cache(self):
+        url = reverse("api-note-detail", kwargs={"slug": self.note.slug})
+        response = self.client.get(url)
+        self.assertEqual(response.json()["content_full"], "<p>Полный текст</p>")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        # Данные ответа берутся из кеша: остаётся только запрос времени изменения
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        self.note.title = "Изменённая"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.note.save()
+        self.assertEqual(self.client.get(url).json()["title"], "Изменённая")
+        self.assertEqual(self.client.get(reverse("api-note-detail", kwargs={"slug": "missing"})).status_code, 404)
+
+    def test_04_only_approved_comments(self):
+        response = self.client.get(reverse("api-note-comments", kwargs={"slug": self.note.slug}))
+        self.assertEqual([comment["body"] for comment in response.json()["results"]], ["Одобренный"])
+
+    def test_05_taxonomies(self):
+        response = self.client.get(reverse("api-category-list"))
+        self.assertEqual(response.json(), [{
+            "slug": self.cat.slug, "name": "Python", "published_count": 1, "url": self.cat.get_absolute_url(),
+        }])
+        response = self.client.get(reverse("api-tag-detail", kwargs={"slug": self.tag.slug}) + "?fields=name")
+        self.assertEqual(response.json(), {"name": "django"})
+
+
+class BenchmarkTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        generate_data(notes=30, categories=3, tags=10, comments_per_note=2, users=3, batch_size=20)
+
+    def test_01_query_budgets(self):
+        results = run_benchmarks(iterations=1)
+        self.assertEqual(len(results), 14)
+        self.assertEqual(over_budget(results), [])
+        # С заполненным кешем страницы для анонимных посетителей отдаются без запросов
+        self.assertEqual(results['index:warm']['queries'], 0)
+
+    def test_02_compare_with_baseline(self):
+        baseline = {'post:cold': {'queries': 10, 'p50_ms': 5, 'p95_ms': 10, 'peak_kib': 100}}
+        results = {'post:cold': {'queries': 11, 'p50_ms': 5, 'p95_ms': 20, 'peak_kib': 100}}
+        regressions, warnings = compare(results, baseline)
+        self.assertEqual(regressions, ['post:cold: запросов 10 -> 11'])
+        self.assertEqual(warnings, ['post:cold: p95_ms 10 -> 20'])
+
+
+class InstrumentationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cat = Category.objects.create(name='Python')
+        Note.objects.create(title='Статья', cat=cls.cat, status=Note.Status.PUBLISHED)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_01_server_timing(self):
+        response = self.client.get(reverse('home'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertRegex(timing, r'total;dur=[\d.]+$')
+
+    @override_settings(INSTRUMENTATION={'SLOW_REQUEST_MS': 0})
+    def test_02_slow_request_logs_sql(self):
+        with self.assertLogs('choocha.instrumentation', 'WARNING') as logs:
+            self.client.get(reverse('home'))
+        self.assertIn('SELECT', logs.output[0])
+        self.assertTrue(logs.records[0].request_metrics['slow_queries'])
+
+    @override_settings(INSTRUMENTATION={'SAMPLE_RATE': 0})
+    def test_03_unsampled_request(self):
+        response = self.client.get(reverse('home'))
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+$')
+
+    def test_04_timed_outside_request(self):
+        with timed('mail'):
+            pass
+
+
+class MetricsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cat = Category.objects.create(name='Python')
+        Note.objects.create(title='Статья', cat=cls.cat, status=Note.Status.PUBLISHED)
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_01_request_latency_by_view(self):
+        labels = {'view': 'home', 'method': 'GET', 'status': '2xx'}
+        before = self.sample('choocha_http_request_duration_seconds_count', **labels)
+        self.client.get(reverse('home'))
+        self.assertEqual(self.sample('choocha_http_request_duration_seconds_count', **labels), before + 1)
+        self.assertGreater(self.sample('choocha_db_queries_per_request_sum', view='home'), 0)
+
+    def test_02_cache_key_families(self):
+        self.assertEqual(key_family(category_posts_key('python')), 'notes:cat')
+        self.assertEqual(key_family(page_lock_key('/')), 'notes:page:lock')
+        self.assertEqual(key_family(category_posts_key('python') + ':lock'), 'notes:cat')
+        self.assertEqual(key_family('unknown'), 'other')
+
+    def test_03_mail_outcomes(self):
+        before = self.sample('choocha_mail_messages_total', result='sent')
+        email = OutgoingEmail.objects.create(subject='Тема', body='Текст', recipients=['a@example.com'])
+        deliver([email])
+        self.assertEqual(self.sample('choocha_mail_messages_total', result='sent'), before + 1)
+
+    def test_04_endpoint(self):
+        cache.clear()
+        OutgoingEmail.objects.create(subject='Тема', body='Текст', recipients=['a@example.com'])
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertIn(b'choocha_mail_queue_pending 1.0', response.content)
+            self.assertIn(b'choocha_http_request_duration_seconds_bucket', response.content)
+            # Длина очередей берётся из кеша
+            OutgoingEmail.objects.create(subject='Тема', body='Текст', recipients=['b@example.com'])
+            with self.assertNumQueries(0):
+                response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertIn(b'choocha_mail_queue_pending 1.0', response.content)
+            # Адрес клиента ничего не даёт: за прокси все запросы идут с 127.0.0.1
+            self.assertEqual(self.client.get('/metrics').status_code, HTTPStatus.NOT_FOUND)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong')
+            self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
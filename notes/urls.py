@@ -1,18 +1,31 @@
 from django.urls import path
 from django.views.decorators.cache import cache_page
 from . import views
+from .pagecache import anonymous_cache_page
+from .feeds import (
+    cached_feed, LatestNotesFeed, LatestNotesAtomFeed, CategoryFeed, CategoryAtomFeed, TagFeed, TagAtomFeed,
+)
 
 urlpatterns = [
-    path('', views.IndexView.as_view(), name='home'),
-    path('about/', cache_page(86400)(views.AboutView.as_view()), name='about'),
+    path('', anonymous_cache_page(views.IndexView.as_view()), name='home'),
+    path('about/', anonymous_cache_page(views.AboutView.as_view()), name='about'),
     path('addpost/', views.AddPost.as_view(), name='add_post'),
     path('contact/', cache_page(43200)(views.ContactView.as_view()), name='contact'),
-    path('post/<slug:post_slug>/', views.ShowPost.as_view(), name='post'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('post/<slug:post_slug>/', anonymous_cache_page(views.ShowPost.as_view()), name='post'),
     path('post/<slug:post_slug>/comment/', views.AddCommentView.as_view(), name='add_comment'),
-    path('category/<slug:cat_slug>/', views.ShowPostByCategory.as_view(), name='category'),
-    path('tag/<slug:tag_slug>/', views.ShowPostByTag.as_view(), name='tag'),
+    path('post/<slug:post_slug>/comments/', views.CommentThread.as_view(), name='post_comments'),
+    path('category/<slug:cat_slug>/', anonymous_cache_page(views.ShowPostByCategory.as_view()), name='category'),
+    path('tag/<slug:tag_slug>/', anonymous_cache_page(views.ShowPostByTag.as_view()), name='tag'),
+    path('feed/rss/', cached_feed(LatestNotesFeed()), name='feed_rss'),
+    path('feed/atom/', cached_feed(LatestNotesAtomFeed()), name='feed_atom'),
+    path('category/<slug:cat_slug>/feed/rss/', cached_feed(CategoryFeed()), name='category_feed_rss'),
+    path('category/<slug:cat_slug>/feed/atom/', cached_feed(CategoryAtomFeed()), name='category_feed_atom'),
+    path('tag/<slug:tag_slug>/feed/rss/', cached_feed(TagFeed()), name='tag_feed_rss'),
+    path('tag/<slug:tag_slug>/feed/atom/', cached_feed(TagAtomFeed()), name='tag_feed_atom'),
     path('update/<int:pk>/', views.UpdatePost.as_view(), name='update_post'),
     path('delete/<int:pk>/', views.DeletePost.as_view(), name='delete_post'),
+    path('comments/moderation/', views.ModerationQueue.as_view(), name='moderation_queue'),
     path('comments/<int:pk>/approve/', views.ApproveComment.as_view(), name='approve_comment'),
     path('comments/<int:pk>/edit/', views.EditComment.as_view(), name='edit_comment'),
     path('comments/<int:pk>/delete/', views.DeleteComment.as_view(), name='delete_comment'),
@@ -0,0 +1,19 @@
+import html
+import re
+
+from django.utils.html import strip_tags
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Границы блоков, после которых нужен пробел, чтобы слова соседних абзацев не склеивались
+_BLOCK_END_RE = re.compile(r"</(?:p|div|li|h[1-6]|blockquote|pre|tr|td|th|figcaption)>|<br\s*/?>", re.IGNORECASE)
+
+
+def html_to_text(value: str | None) -> str:
+    """
+    Преобразует HTML из CKEditor в плоский текст: без тегов, с раскрытыми сущностями
+    и схлопнутыми пробелами.
+    """
+    if not value:
+        return ""
+    text = strip_tags(_BLOCK_END_RE.sub(lambda match: match.group(0) + " ", value))
+    return _WHITESPACE_RE.sub(" ", html.unescape(text)).strip()
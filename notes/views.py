@@ -1,41 +1,48 @@
 from typing import Any
 
 from django.contrib import messages
-from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
 from django.db.models import QuerySet
-from django.http import HttpResponseRedirect, HttpResponse, HttpRequest
-from django.shortcuts import get_object_or_404, redirect
+from django.http import HttpResponseRedirect, HttpResponse, HttpRequest, Http404
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy, reverse
 from django.utils import timezone
 from django.utils.html import escape
 from django.views import View
 from django.views.generic import TemplateView, ListView, DetailView, CreateView, DeleteView, UpdateView, FormView
-from redis import RedisError
 
 from .forms import AddPostForm, UpdatePostForm, ContactForm, CommentForm
+from .fragments import render_post_body
+from .caching import PUBLISHED_COUNT_KEY, category_posts_key, tag_posts_key, get_or_compute
 from .models import Note, TagPost, Category, Comment
-from django.core.cache import cache
-from .mixins import ObjectOwnershipMixin, CommentMixin,PaginationMixin, send_notification_email, AddPageDescriptionMixin
+from .moderation import MODERATION_ACTIONS, MODERATION_PAGE_SIZE, moderate
+from .pagination import InvalidCursor, comments_after
+from .search import search_notes, highlight
+from .mixins import ObjectOwnershipMixin, CommentMixin,PaginationMixin, send_notification_email, AddPageDescriptionMixin, \
+    CachedNoteListMixin, KeysetPaginationMixin, CommentThreadMixin, ModeratorRequiredMixin
 
 
 ###################################
 #           Общий блок            #
 ###################################
 
-class IndexView(PaginationMixin, ListView):
+class IndexView(KeysetPaginationMixin, PaginationMixin, ListView):
     """
     Отображение основной страницы
     """
     template_name = "notes/index.html"
     context_object_name = "posts"
     paginate_by = 5
+    count_cache_key = PUBLISHED_COUNT_KEY
 
     def get_queryset(self) -> QuerySet:
+        # В списке выводится только content_short_html: исходный и полный тексты не читаются
         return (
             Note.published.all()
             .select_related(
                 "cat", "author"
             )
+            .defer("content_short", "content_full", "content_full_html", "search_text")
         )
 
     def get_context_data(self, **kwargs) -> dict[str, Any]:
@@ -148,10 +155,40 @@ class ContactView(FormView):
         return kwargs
 
 
+class SearchView(PaginationMixin, ListView):
+    """
+    Полнотекстовый поиск по опубликованным статьям
+    """
+    template_name = "notes/search.html"
+    context_object_name = "posts"
+    paginate_by = 10
+    max_query_length = 200
+
+    def get_queryset(self) -> QuerySet | list[Note]:
+        self.query = self.request.GET.get("q", "").strip()[:self.max_query_length]
+        if not self.query:
+            return Note.objects.none()
+        return search_notes(self.query, Note.published.select_related("cat", "author"))
+
+    def get_context_data(self, **kwargs) -> dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        context.update({
+            "page_title": f"Choocha.ru | Поиск: {self.query}" if self.query else "Choocha.ru | Поиск",
+            "page_description": "Поиск по статьям сайта",
+            "article_title": "Поиск по статьям",
+            "query": self.query,
+            "robots": 'noindex,follow',
+        })
+        # Подсветка только для статей текущей страницы
+        for post in context["posts"]:
+            post.highlighted = highlight(post.headline)
+        return self.get_paginator_context(context)
+
+
 ###############################
 # Блок для работы со статьями #
 ###############################
-class ShowPost(AddPageDescriptionMixin, DetailView):
+class ShowPost(AddPageDescriptionMixin, CommentThreadMixin, DetailView):
     """
     Отображение статьи
     """
@@ -161,10 +198,11 @@ class ShowPost(AddPageDescriptionMixin, DetailView):
     context_object_name = "post"
 
     def get_queryset(self) -> QuerySet:
+        # Полный текст берётся из кеша фрагментов и читается из БД только при промахе
         return (
             Note.published.all()
             .select_related("cat", "author")
-            .prefetch_related("post_comments", "post_comments__user")
+            .defer("content_short", "content_full", "content_full_html", "search_text")
         )
 
     def get_object(self, queryset: QuerySet = None) -> QuerySet:
@@ -183,6 +221,12 @@ class ShowPost(AddPageDescriptionMixin, DetailView):
             "page_description": f"Просмотр статьи: {self.get_post_description(post)}",
             "article_title": escaped_post_title if post.title else "Статья без названия",
             "comment_form": CommentForm(),
+            "post_body": render_post_body(post),
+            # Анониму видны только одобренные комментарии - их число хранится в статье
+            "comments_count": (
+                self.get_visible_comments(post).count() if self.request.user.is_authenticated else post.comment_count
+            ),
+            **self.get_comments_page(post),
             "content_type": 'article',
             "canonical_url": post.get_absolute_url(),
         })
@@ -194,7 +238,7 @@ class ShowPost(AddPageDescriptionMixin, DetailView):
         return context
 
 
-class ShowPostByCategory(PaginationMixin, ListView):
+class ShowPostByCategory(CachedNoteListMixin, PaginationMixin, ListView):
     """
     Вывод статей соответствующих указанной категории
     """
@@ -203,27 +247,15 @@ class ShowPostByCategory(PaginationMixin, ListView):
     context_object_name = "posts"
     paginate_by = 5
 
-    def get_queryset(self) -> QuerySet:
+    def get_queryset(self) -> list[int]:
         """
-        Возвращает список статей, соответствующих указанной категории.
-        Данные сохраняются в Redis-кеше на один час.
+        Возвращает идентификаторы статей, соответствующих указанной категории.
+        Список сохраняется в Redis-кеше и сбрасывается при изменении статей категории.
         """
-        try:
-            return cache.get_or_set(
-                f"notes:cat:{self.kwargs['cat_slug']}",
-                lambda: Note.published.filter(cat__slug=self.kwargs["cat_slug"])
-                .select_related(
-                    "cat", "author"
-                ),
-                60 * 60 # Хранить в кеше 1 час
-            )
-        except RedisError:
-            return (
-                Note.published.filter(cat__slug=self.kwargs["cat_slug"])
-                .select_related(
-                    "cat", "author"
-                )
-            )
+        return get_or_compute(
+            category_posts_key(self.kwargs["cat_slug"]),
+            lambda: list(Note.published.filter(cat__slug=self.kwargs["cat_slug"]).values_list("pk", flat=True)),
+        )
 
     def get_context_data(self, **kwargs) -> dict[str, Any]:
         """
@@ -245,6 +277,8 @@ class ShowPostByCategory(PaginationMixin, ListView):
             "article_title": f"Статьи из категории {category.name}",
             "content_type": "website",
             "canonical_url": self.request.build_absolute_uri(category.get_absolute_url()),
+            "feed_rss_url": reverse("category_feed_rss", kwargs={"cat_slug": category.slug}),
+            "feed_atom_url": reverse("category_feed_atom", kwargs={"cat_slug": category.slug}),
         })
         context.update({
             "og_title": context["page_title"],
@@ -254,7 +288,7 @@ class ShowPostByCategory(PaginationMixin, ListView):
         return self.get_paginator_context(context)
 
 
-class ShowPostByTag(PaginationMixin, ListView):
+class ShowPostByTag(CachedNoteListMixin, PaginationMixin, ListView):
     """
     Вывод статей соответствующих определённому тегу
     """
@@ -263,25 +297,15 @@ class ShowPostByTag(PaginationMixin, ListView):
     context_object_name = "posts"
     paginate_by = 5
 
-    def get_queryset(self) -> QuerySet:
+    def get_queryset(self) -> list[int]:
         """
-        Возвращает список статей, соответствующих указанному тегу.
-        Данные сохраняются в Redis-кеше на один час.
+        Возвращает идентификаторы статей, соответствующих указанному тегу.
+        Список сохраняется в Redis-кеше и сбрасывается при изменении статей с меткой.
         """
-        try:
-            return cache.get_or_set(
-                f"notes:tag:{self.kwargs['tag_slug']}",
-                lambda: Note.published.filter(tags__slug=self.kwargs["tag_slug"])
-                .select_related("cat", "author")
-                .prefetch_related("tags"),
-                60 * 60  # Хранить в кеше 1 час
-            )
-        except RedisError:
-            return (
-                Note.published.filter(tags__slug=self.kwargs["tag_slug"])
-                .select_related("cat", "author")
-                .prefetch_related("tags")
-            )
+        return get_or_compute(
+            tag_posts_key(self.kwargs["tag_slug"]),
+            lambda: list(Note.published.filter(tags__slug=self.kwargs["tag_slug"]).values_list("pk", flat=True)),
+        )
 
     def get_context_data(self, **kwargs) -> dict[str, Any]:
         """
@@ -303,6 +327,8 @@ class ShowPostByTag(PaginationMixin, ListView):
             "article_title": f"Статьи с меткой {tag.name}",
             "content_type": "website",
             "canonical_url": self.request.build_absolute_uri(tag.get_absolute_url()),
+            "feed_rss_url": reverse("tag_feed_rss", kwargs={"tag_slug": tag.slug}),
+            "feed_atom_url": reverse("tag_feed_atom", kwargs={"tag_slug": tag.slug}),
         })
         context.update({
             "og_title": context["page_title"],
@@ -416,14 +442,19 @@ class AddCommentView(LoginRequiredMixin, CommentMixin, CreateView):
         )
 
 
-class ApproveComment(LoginRequiredMixin, UserPassesTestMixin, View):
-    def test_func(self) -> bool:
-        return self.request.user.is_staff or self.request.user.is_superuser
+class CommentThread(CommentThreadMixin, View):
+    """Следующая порция комментариев статьи (кнопка «Показать ещё»)"""
+
+    def get(self, request: HttpRequest, post_slug: str) -> HttpResponse:
+        post = get_object_or_404(Note.published.only("id", "slug"), slug=post_slug)
+        context = self.get_comments_page(post, request.GET.get("after"))
+        return render(request, "notes/comment_list.html", {"post": post, **context})
 
+
+class ApproveComment(ModeratorRequiredMixin, View):
     def get(self, request: HttpRequest, pk: int) -> HttpResponse:
-        comment = get_object_or_404(Comment, pk=pk)
-        comment.active = True
-        comment.save()
+        comment = get_object_or_404(Comment.objects.select_related("post").only("post__slug"), pk=pk)
+        moderate(Comment.objects.filter(pk=comment.pk), Comment.Status.ACTIVE)
         messages.success(request, "Комментарий одобрен")
         return HttpResponseRedirect(
             reverse("post", kwargs={"post_slug": comment.post.slug})
@@ -431,6 +462,48 @@ class ApproveComment(LoginRequiredMixin, UserPassesTestMixin, View):
         )
 
 
+class ModerationQueue(ModeratorRequiredMixin, TemplateView):
+    """
+    Очередь комментариев на модерации порциями по MODERATION_PAGE_SIZE (курсор по created, pk)
+    и пакетные действия над отмеченными комментариями.
+    """
+    template_name = "notes/moderation.html"
+
+    def get_context_data(self, **kwargs) -> dict[str, Any]:
+        context = super().get_context_data(**kwargs)
+        queue = (
+            Comment.objects.filter(status=Comment.Status.ON_MODERATE)
+            .select_related("user", "post")
+            .only("body", "created", "user__username", "post__title", "post__slug")
+            .order_by("created", "pk")
+        )
+        after = self.request.GET.get("after")
+        if after:
+            try:
+                queue = comments_after(queue, after)
+            except InvalidCursor:
+                raise Http404("Комментарий не найден в очереди")
+        comments = list(queue[:MODERATION_PAGE_SIZE + 1])
+        context.update({
+            "page_title": "Choocha.ru | Модерация комментариев",
+            "article_title": "Модерация комментариев",
+            "robots": 'noindex,nofollow',
+            "comments": comments[:MODERATION_PAGE_SIZE],
+            "next_after": comments[MODERATION_PAGE_SIZE - 1].pk if len(comments) > MODERATION_PAGE_SIZE else None,
+        })
+        return context
+
+    def post(self, request: HttpRequest) -> HttpResponse:
+        status = MODERATION_ACTIONS.get(request.POST.get("action"))
+        ids = [pk for pk in request.POST.getlist("ids") if pk.isdigit()]
+        if status is None or not ids:
+            messages.error(request, "Выберите комментарии и действие")
+        else:
+            count = moderate(Comment.objects.filter(pk__in=ids), status)
+            messages.success(request, f"Обработано комментариев: {count}")
+        return redirect("moderation_queue")
+
+
 class DeleteComment(ObjectOwnershipMixin, LoginRequiredMixin, DeleteView):
     model = Comment
     template_name = "notes/delete_comment.html"
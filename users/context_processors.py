@@ -1,25 +1,48 @@
 #choocha/users/context_processors.py
+from types import MappingProxyType
+
+from .permissions import get_user_permissions
+
 menu = [{'title': "О сайте", 'url_name': 'about', 'for_all': True, },
         {'title': "Добавить статью", 'url_name': 'add_post', 'for_moderator': True},
         {'title': "Обратная связь", 'url_name': 'contact', 'for_all': True},
         {'title': "Войти", 'url_name': 'users:login', 'title2': "Регистрация", 'url_name2': 'users:register',
          'for_anonymous': True},
-        {'title': "", 'url_name': "users:profile", 'title2': "Выйти", 'url_name2': 'users:logout',
+        {'title': "", 'url_name': "users:profile", 'title2': "Выйти", 'url_name2': 'users:logout',
          'for_authorized': True},
         ]
 
+# Право, открывающее пункты for_moderator
+MODERATOR_PERMISSION = 'notes.add_note'
 
-def get_notes_menu_context(request):
+
+def _build_menu(anonymous: bool, moderator: bool) -> tuple[MappingProxyType, ...]:
     result_menu = []
     for item in menu:
-        if 'for_all' in item:
-            result_menu.append(item)
-        elif 'for_moderator' in item and request.user.has_perm('notes.add_note'):
-            result_menu.append(item)
-        elif 'for_anonymous' in item and request.user.is_anonymous:
-            result_menu.append(item)
-        elif 'for_authorized' in item and request.user.is_authenticated:
-            result_menu.append(item)
-    if request.user.is_authenticated:
-        result_menu[-1]['title'] = f'Добро пожаловать, {request.user.username}'
-    return {'mainmenu': result_menu}
+        if ('for_all' in item
+                or ('for_moderator' in item and moderator)
+                or ('for_anonymous' in item and anonymous)
+                or ('for_authorized' in item and not anonymous)):
+            # Пункты только для чтения: варианты меню общие для всех запросов (и гринлетов)
+            result_menu.append(MappingProxyType(dict(item)))
+    return tuple(result_menu)
+
+
+# Варианты меню для каждой роли строятся один раз при загрузке модуля
+MENU_BY_ROLE = {
+    'anonymous': _build_menu(anonymous=True, moderator=False),
+    'authorized': _build_menu(anonymous=False, moderator=False),
+    'moderator': _build_menu(anonymous=False, moderator=True),
+}
+
+
+def get_notes_menu_context(request):
+    user = request.user
+    if not user.is_authenticated:
+        return {'mainmenu': MENU_BY_ROLE['anonymous']}
+
+    # Права берутся из кеша (users.permissions), а не загружаются из БД на каждый запрос
+    role = 'moderator' if user.is_superuser or MODERATOR_PERMISSION in get_user_permissions(user) else 'authorized'
+    *items, last = MENU_BY_ROLE[role]
+    # Приветствие - новый пункт для этого запроса, общий вариант не изменяется
+    return {'mainmenu': [*items, {**last, 'title': f'Добро пожаловать, {user.username}'}]}
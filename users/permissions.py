@@ -0,0 +1,54 @@
+"""
+Кеш прав пользователей.
+
+Набор прав ("app.codename") хранится в общем кеше и подкладывается в user._perm_cache,
+который читает ModelBackend, поэтому has_perm и {{ perms }} в шаблонах не обращаются к БД.
+Личные права и группы пользователя сбрасывают его запись, изменение прав группы -
+общую версию PERMISSIONS_VERSION_KEY, которая входит в ключи всех пользователей.
+"""
+import uuid
+
+from django.core.cache import cache
+
+from choocha.metrics import register_cache_key_families
+
+PERMISSIONS_KEY = "users:perms:{version}:{pk}"
+PERMISSIONS_VERSION_KEY = "users:perms:version"
+
+register_cache_key_families((PERMISSIONS_KEY, PERMISSIONS_VERSION_KEY))
+
+# Права меняются редко и сбрасываются сигналами, поэтому TTL - лишь страховка
+PERMISSIONS_TTL = 60 * 60 * 24
+
+
+def permissions_key(pk: int, version: str) -> str:
+    return PERMISSIONS_KEY.format(version=version, pk=pk)
+
+
+def _version() -> str:
+    return cache.get_or_set(PERMISSIONS_VERSION_KEY, lambda: uuid.uuid4().hex, None)
+
+
+def get_user_permissions(user) -> frozenset[str]:
+    """Все права пользователя из кеша; при промахе вычисляются бэкендами аутентификации"""
+    if not user.is_authenticated or not user.is_active:
+        return frozenset()
+    cached = getattr(user, "_perm_cache", None)
+    if cached is not None:
+        return frozenset(cached)
+    key = permissions_key(user.pk, _version())
+    perms = cache.get(key)
+    if perms is None:
+        perms = frozenset(user.get_all_permissions())
+        cache.set(key, perms, PERMISSIONS_TTL)
+    # ModelBackend берёт права из этого атрибута и больше не обращается к БД в рамках запроса
+    user._perm_cache = set(perms)
+    return perms
+
+
+def invalidate_user(pk: int) -> None:
+    cache.delete(permissions_key(pk, _version()))
+
+
+def invalidate_all() -> None:
+    cache.delete(PERMISSIONS_VERSION_KEY)
@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from .permissions import invalidate_user, invalidate_all
+
+User = get_user_model()
+
+###################################
+#   Инвалидация кеша прав         #
+###################################
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_permissions(sender, instance, action: str, reverse: bool, **kwargs) -> None:
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # group.user_set.add(...) / permission.user_set.add(...) - затронуто сразу несколько пользователей
+        transaction.on_commit(invalidate_all)
+    else:
+        transaction.on_commit(lambda: invalidate_user(instance.pk))
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action: str, **kwargs) -> None:
+    if action in ("post_add", "post_remove", "post_clear"):
+        transaction.on_commit(invalidate_all)
+
+
+@receiver(post_save, sender=User)
+def invalidate_on_user_save(sender, instance, created: bool, **kwargs) -> None:
+    # is_active и is_superuser меняют итоговый набор прав
+    if not created:
+        transaction.on_commit(lambda: invalidate_user(instance.pk))
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_on_delete(sender, **kwargs) -> None:
+    transaction.on_commit(invalidate_all)
@@ -3,9 +3,13 @@ from http import HTTPStatus
 
 from captcha.models import CaptchaStore
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser, Group, Permission
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
 from django.urls import reverse
 
+from users.context_processors import MENU_BY_ROLE, get_notes_menu_context
+
 logger = logging.getLogger(__name__)
 
 
@@ -69,3 +73,44 @@ class RegisterUserTestCase(TestCase):
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertContains(response, 'Пользователь с таким именем уже существует')
         logger.info("Проверка регистрации пользователя с существующим именем прошла успешно")
+
+
+class MenuContextTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='writer', password='pass')
+        cls.add_note = Permission.objects.get(codename='add_note', content_type__app_label='notes')
+
+    def setUp(self):
+        cache.clear()
+
+    def menu_titles(self, user) -> list[str]:
+        request = RequestFactory().get('/')
+        request.user = user
+        return [item['title'] for item in get_notes_menu_context(request)['mainmenu']]
+
+    def test_01_menu_by_role_is_not_mutated(self):
+        self.assertIn('Войти', self.menu_titles(AnonymousUser()))
+        self.assertEqual(self.menu_titles(self.user)[-1], 'Добро пожаловать, writer')
+        self.assertEqual(MENU_BY_ROLE['authorized'][-1]['title'], '')
+        self.assertNotIn('Добавить статью', self.menu_titles(self.user))
+
+    def test_02_permissions_cached_and_invalidated(self):
+        self.menu_titles(get_user_model().objects.get(pk=self.user.pk))
+        user = get_user_model().objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.menu_titles(user)
+            self.assertFalse(user.has_perm('notes.add_note'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.user_permissions.add(self.add_note)
+        self.assertIn('Добавить статью', self.menu_titles(get_user_model().objects.get(pk=self.user.pk)))
+
+        group = Group.objects.create(name='editors')
+        group.user_set.add(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.user_permissions.clear()
+        self.assertNotIn('Добавить статью', self.menu_titles(get_user_model().objects.get(pk=self.user.pk)))
+        with self.captureOnCommitCallbacks(execute=True):
+            group.permissions.add(self.add_note)
+        self.assertIn('Добавить статью', self.menu_titles(get_user_model().objects.get(pk=self.user.pk)))